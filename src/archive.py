@@ -0,0 +1,152 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - spectrum archive
+# #########################################################################
+
+"""append-only archive of spectra, read through numpy.memmap
+
+    archive = SpectrumArchive('spectra')        # spectra.spd (counts) and spectra.spi (index)
+    i = archive.append(spectrum)
+    spectrum = archive[i]                       # counts are a view on the file
+    column = archive.column(520)                # absorbance at 520 nm of every spectrum (nan if not measured)
+
+data file (.spd) : 16 bytes header (Archive_Data_Magic) then the raw int16 counts (little-endian) of each spectrum
+index file (.spi) : 16 bytes header (Archive_Index_Magic) then one Index_Dtype record per spectrum
+
+Counts are written before their index record : a record always points to complete data, and an interrupted
+append leaves at most a partial record at the end of the index, which is ignored."""
+
+import os
+from s250Prim_async import get_numpy
+from spectrum import Spectrum, Abs_Scale
+
+Archive_Data_Magic = b'SPECDAT1'.ljust(16, b'\x00')
+Archive_Index_Magic = b'SPECIDX1'.ljust(16, b'\x00')
+Archive_Header_Size = 16
+
+# index record : byte offset of the counts in the data file, number of points and metadata
+Index_Fields = [('offset', '<u8'), ('n', '<u4'), ('wl_start', '<f4'), ('wl_step', '<f4'), ('speed', 'u1'),
+                ('res', 'u1'), ('firmware', '<u2'), ('model', 'S24'), ('time', '<f8'), ('baseline_time', '<f8')]
+Firmware_Unknown = 0xFFFF  # firmware field of a spectrum without version (0 is a valid version)
+
+
+def get_index_dtype():
+    return get_numpy().dtype(Index_Fields)
+
+
+class SpectrumArchive:
+    """SpectrumArchive : spectra appended to a data file and an index file - needs numpy"""
+
+    def __init__(self, path):
+        self.np = get_numpy()
+        if self.np is None:
+            raise ImportError("the spectrum archive needs numpy")
+        self.path = path
+        self.data_path = path + '.spd'
+        self.index_path = path + '.spi'
+        self.dtype = get_index_dtype()
+        for filename, magic in ((self.data_path, Archive_Data_Magic), (self.index_path, Archive_Index_Magic)):
+            if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+                with open(filename, 'wb') as f:
+                    f.write(magic)
+            else:
+                with open(filename, 'rb') as f:
+                    if f.read(Archive_Header_Size) != magic:
+                        raise ValueError("%s is not a spectrum archive file" % (filename,))
+        self._index = None
+        self._data = None
+
+    # ------- memory maps (reopened after appends)
+    def __len__(self):
+        return (os.path.getsize(self.index_path) - Archive_Header_Size) // self.dtype.itemsize
+
+    @property
+    def index(self):
+        """index : structured array (memmap) of the index records"""
+        n = len(self)
+        if self._index is None or len(self._index) != n:
+            if n == 0:
+                return self.np.empty(0, dtype=self.dtype)
+            self._index = self.np.memmap(self.index_path, dtype=self.dtype, mode='r',
+                                         offset=Archive_Header_Size, shape=(n,))
+        return self._index
+
+    @property
+    def data(self):
+        """data : every count of the archive as one int16 memmap (offsets of the index are in bytes)"""
+        n = (os.path.getsize(self.data_path) - Archive_Header_Size) // 2
+        if self._data is None or len(self._data) != n:
+            if n == 0:
+                return self.np.empty(0, dtype='<i2')
+            self._data = self.np.memmap(self.data_path, dtype='<i2', mode='r', offset=Archive_Header_Size,
+                                        shape=(n,))
+        return self._data
+
+    # ------- writing
+    def append(self, spectrum):
+        """append : add a spectrum at the end of the archive - return its number"""
+        np = self.np
+        raw = np.asarray(spectrum.raw, dtype='<i2')
+        with open(self.data_path, 'ab') as f:
+            offset = f.tell()
+            f.write(raw.tobytes())
+        record = np.zeros(1, dtype=self.dtype)
+        record['offset'] = offset
+        record['n'] = len(raw)
+        record['wl_start'] = spectrum.wl_start
+        record['wl_step'] = spectrum.wl_step
+        record['speed'] = spectrum.speed or 0
+        record['res'] = spectrum.res or 0
+        record['firmware'] = Firmware_Unknown if spectrum.firmware is None else spectrum.firmware
+        record['model'] = (spectrum.model or '').encode('ascii', 'replace')[:24]
+        record['time'] = np.nan if spectrum.time is None else spectrum.time
+        record['baseline_time'] = np.nan if spectrum.baseline_time is None else spectrum.baseline_time
+        with open(self.index_path, 'r+b') as f:
+            # drop a partial record left by an interrupted append
+            size = os.path.getsize(self.index_path)
+            f.truncate(size - (size - Archive_Header_Size) % self.dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(record.tobytes())
+        return len(self) - 1
+
+    # ------- reading
+    def counts(self, i):
+        """counts : raw counts of spectrum i (view on the file)"""
+        record = self.index[i]
+        start = (int(record['offset']) - Archive_Header_Size) // 2
+        return self.data[start:start + int(record['n'])]
+
+    def __getitem__(self, i):
+        """spectrum i - its counts are a view on the file"""
+        record = self.index[i]
+        firmware = int(record['firmware'])
+        baseline_time = float(record['baseline_time'])
+        t = float(record['time'])
+        return Spectrum(self.counts(i), float(record['wl_start']), float(record['wl_step']),
+                        model=record['model'].decode('ascii') or None,
+                        firmware=None if firmware == Firmware_Unknown else firmware,
+                        speed=int(record['speed']) or None, res=int(record['res']) or None,
+                        baseline_time=None if baseline_time != baseline_time else baseline_time,
+                        time=None if t != t else t)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, wl, rows=None):
+        """column : absorbance at wl nm of every spectrum (or of the spectra numbers in rows), nan where the
+        spectrum has no point at wl - one vectorized gather, no spectrum is loaded"""
+        np = self.np
+        index = self.index if rows is None else self.index[np.asarray(rows)]
+        out = np.full(len(index), np.nan)
+        if len(index) == 0:
+            return out
+        pos = (wl - index['wl_start'].astype(np.float64)) / index['wl_step']
+        i = np.rint(pos)
+        valid = (np.abs(pos - i) < 1e-6) & (i >= 0) & (i < index['n'])
+        where = (index['offset'][valid].astype(np.int64) - Archive_Header_Size) // 2 + i[valid].astype(np.int64)
+        out[valid] = self.data[where] / Abs_Scale
+        return out
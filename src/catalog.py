@@ -0,0 +1,179 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - catalog of acquisitions
+# #########################################################################
+
+"""sqlite catalog of every acquisition (spectra, absorbance readings, kinetics files)
+
+    catalog = Catalog('catalog.sqlite')
+    catalog.add_spectrum(spectrum, port, 'spectra', i)          # payload : record i of archive 'spectra'
+    catalog.add_abs(520, 0.4321, port, model, firmware)          # the value is the payload
+    rows = catalog.find('spectrum', model='Secomam Prim Lignt', wl_min=400, wl_max=700,
+                        since=time.time() - 30 * 86400)
+
+Devices (port, model, firmware) are stored once and referenced. Acquisitions are indexed by device, kind and time
+and by kind and wavelength range : the usual queries only read the matching part of the index."""
+
+import os
+import time
+import sqlite3
+from contextlib import contextmanager
+
+Kind_Spectrum = 'spectrum'
+Kind_Abs = 'abs'
+Kind_Kinetics = 'kinetics'
+Kinds = (Kind_Spectrum, Kind_Abs, Kind_Kinetics)
+
+Catalog_Schema = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    port TEXT,
+    model TEXT,
+    firmware INTEGER,
+    UNIQUE (port, model, firmware));
+CREATE TABLE IF NOT EXISTS acquisitions (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    time REAL NOT NULL,
+    device_id INTEGER REFERENCES devices (id),
+    wl_min REAL,
+    wl_max REAL,
+    speed INTEGER,
+    res INTEGER,
+    baseline_time REAL,
+    value REAL,
+    payload TEXT,
+    payload_index INTEGER);
+CREATE INDEX IF NOT EXISTS acquisitions_device_time ON acquisitions (device_id, kind, time, wl_min, wl_max);
+CREATE INDEX IF NOT EXISTS acquisitions_kind_time ON acquisitions (kind, time);
+CREATE INDEX IF NOT EXISTS acquisitions_kind_range ON acquisitions (kind, wl_min, wl_max);
+"""
+
+Acquisition_Columns = ('id', 'kind', 'time', 'port', 'model', 'firmware', 'wl_min', 'wl_max', 'speed', 'res',
+                       'baseline_time', 'value', 'payload', 'payload_index')
+
+
+class Catalog:
+    """Catalog : sqlite index of the acquisitions and of where their data are stored"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # the app registers from the ui thread, the cli from the main thread : one connection is enough
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(Catalog_Schema)
+        self.devices = {}  # (port, model, firmware): id
+        self.deferred = False
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def batch(self):
+        """batch : register many acquisitions with one commit"""
+        self.deferred = True
+        try:
+            yield self
+        finally:
+            self.deferred = False
+            self.db.commit()
+
+    def commit(self):
+        if not self.deferred:
+            self.db.commit()
+
+    # ------- registration
+    def device_id(self, port, model, firmware):
+        """device_id : id of a device, created on first use"""
+        key = (port, model, firmware)
+        if key not in self.devices:
+            self.db.execute("INSERT OR IGNORE INTO devices (port, model, firmware) VALUES (?, ?, ?)", key)
+            row = self.db.execute("SELECT id FROM devices WHERE port IS ? AND model IS ? AND firmware IS ?",
+                                  key).fetchone()
+            self.devices[key] = row[0]
+        return self.devices[key]
+
+    def add(self, kind, port, model, firmware, t=None, wl_min=None, wl_max=None, speed=None, res=None,
+            baseline_time=None, value=None, payload=None, payload_index=None):
+        """add : register an acquisition - return its id"""
+        cursor = self.db.execute(
+            "INSERT INTO acquisitions (kind, time, device_id, wl_min, wl_max, speed, res, baseline_time, value, "
+            "payload, payload_index) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, time.time() if t is None else t, self.device_id(port, model, firmware), wl_min, wl_max, speed,
+             res, baseline_time, value, payload, payload_index))
+        self.commit()
+        return cursor.lastrowid
+
+    def add_spectrum(self, spectrum, port, archive=None, archive_index=None):
+        """add_spectrum : register a Spectrum [archive: path of the archive holding it] [archive_index: its number]"""
+        return self.add(Kind_Spectrum, port, spectrum.model, spectrum.firmware, spectrum.time, spectrum.wl_start,
+                        spectrum.wl_end, spectrum.speed, spectrum.res, spectrum.baseline_time,
+                        payload=archive, payload_index=archive_index)
+
+    def add_abs(self, wl, value, port, model, firmware, t=None):
+        """add_abs : register an absorbance reading at wl nm"""
+        return self.add(Kind_Abs, port, model, firmware, t, wl, wl, value=value)
+
+    def add_kinetics(self, wl, path, port, model, firmware, t=None, n=None):
+        """add_kinetics : register a kinetics file at wl nm [n: number of samples]"""
+        return self.add(Kind_Kinetics, port, model, firmware, t, wl, wl, value=n, payload=path)
+
+    # ------- queries
+    def find(self, kind=None, port=None, model=None, firmware=None, wl_min=None, wl_max=None, since=None,
+             until=None, limit=None):
+        """find : acquisitions matching every given criterion, latest first - return sqlite3.Row list
+        [wl_min, wl_max: range (nm) the acquisition must lie in] [since, until: time (s since epoch)]"""
+        where, params = [], []
+        if port is not None or model is not None or firmware is not None:
+            # devices are few : resolve them first so that the (device, kind, time) index is used
+            devices = self.find_devices(port, model, firmware)
+            if not devices:
+                return []
+            where.append('a.device_id IN (%s)' % (', '.join('?' * len(devices)),))
+            params += devices
+        if kind is not None:
+            where.append('a.kind = ?')
+            params.append(kind)
+        for condition, val in (('a.wl_min >= ?', wl_min), ('a.wl_max <= ?', wl_max), ('a.time >= ?', since),
+                               ('a.time <= ?', until)):
+            if val is not None:
+                where.append(condition)
+                params.append(val)
+        sql = ("SELECT a.id, a.kind, a.time, d.port, d.model, d.firmware, a.wl_min, a.wl_max, a.speed, a.res, "
+               "a.baseline_time, a.value, a.payload, a.payload_index "
+               "FROM acquisitions a JOIN devices d ON d.id = a.device_id")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY a.time DESC"
+        if limit is not None:
+            sql += " LIMIT %d" % (int(limit),)
+        return self.db.execute(sql, params).fetchall()
+
+    def find_devices(self, port=None, model=None, firmware=None):
+        """find_devices : ids of the devices matching every given criterion"""
+        where, params = [], []
+        for column, val in (('port', port), ('model', model), ('firmware', firmware)):
+            if val is not None:
+                where.append('%s = ?' % (column,))
+                params.append(val)
+        sql = "SELECT id FROM devices" + (" WHERE " + " AND ".join(where) if where else "")
+        return [row[0] for row in self.db.execute(sql, params)]
+
+    def count(self, kind=None):
+        if kind is None:
+            return self.db.execute("SELECT COUNT(*) FROM acquisitions").fetchone()[0]
+        return self.db.execute("SELECT COUNT(*) FROM acquisitions WHERE kind = ?", (kind,)).fetchone()[0]
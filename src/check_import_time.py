@@ -0,0 +1,69 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   import time budget of the headless modules (driver, tools)
+# #########################################################################
+
+"""check that headless modules import fast and without kivy
+
+    python check_import_time.py
+
+each module is imported in a fresh interpreter (median of several runs), the script fails if a module exceeds
+its budget or pulls kivy (or numpy, which is only imported on first use)"""
+
+import sys
+import subprocess
+
+# ms - import time budgets (on top of the interpreter start)
+Import_Budgets = {
+    'utilities': 20.,
+    's250Prim_capture': 20.,
+    's250Prim_cache': 20.,
+    's250Prim_async': 30.,
+    's250Prim_worker': 30.,
+    's250Prim_discovery': 30.,
+    's250Prim_bench': 30.,
+    's250Prim_kinetics': 30.,
+    's250Prim_sequence': 30.,
+    'spectrum': 30.,
+    'archive': 30.,
+    'catalog': 30.,
+    'export': 30.,
+    'export_pool': 30.,
+    'render': 30.,
+    'processing': 30.,
+    's250Prim_aio': 100.,
+}
+Forbidden_Modules = ('kivy', 'numpy')
+
+Probe = """
+import sys, time
+t = time.perf_counter()
+import {module}
+t = (time.perf_counter() - t) * 1000.
+print(t, ' '.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({forbidden!r}))))
+"""
+
+
+def measure(module, runs=5):
+    """measure : return (median import time in ms, forbidden modules imported) of a module"""
+    times = []
+    forbidden = ''
+    for i in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', Probe.format(module=module, forbidden=Forbidden_Modules)],
+                                      universal_newlines=True)
+        t, _, forbidden = out.strip().partition(' ')
+        times.append(float(t))
+    return sorted(times)[len(times) // 2], forbidden
+
+
+if __name__ == "__main__":
+    failed = False
+    for module, budget in Import_Budgets.items():
+        t, forbidden = measure(module)
+        ok = t <= budget and not forbidden
+        failed = failed or not ok
+        print("%-20s %7.1f ms / %5.0f ms %s %s" % (module, t, budget, 'ok' if ok else 'FAILED', forbidden))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,60 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   adaptive timeouts of the driver against the simulator
+# #########################################################################
+
+"""check that adaptive timeouts learnt on short commands don't cut longer ones
+
+    python check_timeouts.py
+
+wavelength changes of every length are sent to the simulator (real time) : short moves first so that their
+timeouts are learnt, then long moves, and moves of the same travel bucket but of different length.
+The script fails if a command times out."""
+
+import sys
+import time
+from s250Prim_async import S250Prim, S250PrimTimeout
+from s250Prim_sim import S250PrimSimulator
+
+# wavelengths in nm, in order : short moves (333 -> 348), long moves, moves of 270 nm then one of 511 nm
+Moves = ([330, 333, 336, 339, 342, 345, 348, 890, 333, 336, 339, 890]
+         + [330, 600] * 4 + [330, 841, 330])
+
+
+def check_moves(spectro, moves):
+    """check_moves : set each wavelength (as query does) - return the number of timeouts"""
+    failures = 0
+    for wl in moves:
+        t0 = time.monotonic()
+        cmd, n_return = spectro.set_abs_wavelength(wl)
+        timeout = spectro.timeout_for(cmd)
+        try:
+            spectro.receive_exactly(n_return, timeout)
+            latency = time.monotonic() - t0
+            spectro.record_latency(cmd, latency)
+            result = 'ok'
+        except S250PrimTimeout:
+            latency = time.monotonic() - t0
+            failures += 1
+            result = 'FAILED'
+            spectro.drain()
+        print("%4d nm  travel %4s nm  latency %6.3f s  timeout %6.3f s  %s" % (
+            wl, '?' if spectro.wl_travel is None else '%d' % (spectro.wl_travel,), latency, timeout, result))
+    return failures
+
+
+if __name__ == "__main__":
+    sim = S250PrimSimulator(seed=1)
+    spectro = S250Prim()
+    try:
+        if not spectro.connect(sim.start()) or not spectro.query(spectro.start_device):
+            print("simulator not answering")
+            sys.exit(1)
+        failures = check_moves(spectro, Moves)
+    finally:
+        spectro.disconnect()
+        sim.stop()
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,243 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - data and image export
+# #########################################################################
+
+"""export of spectra as csv or tsv tables and of graphs as png images
+
+    path = export_spectrum(spectrum, 'exports')                     # exports/spectrum_20190412_101500.csv
+    paths = export_archive(archive, 'exports', layout=Layout_Long)  # every spectrum of the archive in one file
+    path = export_png(pixels, width, height, 'exports', bottom_up=True)  # rgba pixels read back from a texture
+
+The decimal separator is the one of the user locale (',' in french) : the columns are then separated by ';' so
+that spreadsheets (LibreOffice Calc, Excel) read the numbers directly. The locale is set once at start
+(use_user_locale) and the format is made on the main thread (get_format) then given to the writers.
+Rows are streamed to the file through the csv module (one line per row, '\\r\\n' ends), files are created with
+a new name when the name is taken.
+
+Archive layouts :
+    Layout_Wide  : one file, one line per wavelength, one column per spectrum (empty where it has no point)
+    Layout_Long  : one file, one line per point (spectrum, time, wavelength, abs)
+    Layout_Files : one file per spectrum
+
+Images are encoded to png here (zlib) : only the read-back of the pixels needs the gl context."""
+
+import os
+import csv
+import time
+import zlib
+import struct
+import locale
+from collections import namedtuple
+
+Layout_Wide = 'wide'
+Layout_Long = 'long'
+Layout_Files = 'files'
+Layouts = (Layout_Wide, Layout_Long, Layout_Files)
+
+Abs_Digits = 4  # the device gives absorbances in 1/10000
+
+# delimiter between columns, decimal separator, file extension
+ExportFormat = namedtuple('ExportFormat', 'delimiter decimal extension')
+
+
+def use_user_locale():
+    """use_user_locale : numeric conventions of the user locale for the whole process - call once on the main
+    thread before other threads start (setlocale is not thread safe)"""
+    try:
+        locale.setlocale(locale.LC_NUMERIC, '')
+    except locale.Error:
+        # unknown locale in the environment : keep the C conventions
+        pass
+
+
+def locale_decimal_point():
+    """locale_decimal_point : decimal separator of the current numeric locale (see use_user_locale)"""
+    return locale.localeconv()['decimal_point'] or '.'
+
+
+def get_format(kind='csv', decimal=None):
+    """get_format : ExportFormat of a kind of file ('csv' or 'tsv') [decimal: separator, default from the locale]"""
+    if decimal is None:
+        decimal = locale_decimal_point()
+    if kind == 'tsv':
+        return ExportFormat('\t', decimal, '.tsv')
+    if kind == 'csv':
+        return ExportFormat(';' if decimal == ',' else ',', decimal, '.csv')
+    raise ValueError("unknown export format: %s" % (kind,))
+
+
+def format_number(val, decimal='.', digits=Abs_Digits):
+    """format_number : number as text with a decimal separator - empty for nan"""
+    if val != val:
+        return ''
+    text = '%.*f' % (digits, val)
+    return text if decimal == '.' else text.replace('.', decimal)
+
+
+def format_time(t):
+    """format_time : local date and time of a time (s since epoch), empty if unknown"""
+    if t is None or t != t:
+        return ''
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+
+def open_unique(directory, name, extension, binary=False):
+    """open_unique : create a new file name.extension in directory (name_1, name_2... if taken)
+    - return (file, path) [binary: open in binary mode, text (utf-8, newlines untouched) otherwise]"""
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    i = 0
+    while True:
+        path = os.path.join(directory, '%s%s%s' % (name, '_%d' % (i,) if i else '', extension))
+        try:
+            # exclusive creation : two exports at the same time never share a file
+            if binary:
+                return open(path, 'xb'), path
+            return open(path, 'x', newline='', encoding='utf-8'), path
+        except FileExistsError:
+            i += 1
+
+
+def default_name(prefix, t=None):
+    return time.strftime(prefix + '_%Y%m%d_%H%M%S', time.localtime(time.time() if t is None else t))
+
+
+def spectrum_rows(spectrum, decimal='.'):
+    """spectrum_rows : (wavelength, abs) text rows of a spectrum"""
+    wavelengths, values = spectrum.wavelengths, spectrum.absorbance
+    if hasattr(values, 'tolist'):
+        wavelengths, values = wavelengths.tolist(), values.tolist()
+    for wl, val in zip(wavelengths, values):
+        yield format_number(wl, decimal, 0 if wl == int(wl) else 2), format_number(val, decimal)
+
+
+def write_meta(f, meta):
+    """write_meta : metadata as '# key: value' lines"""
+    for key, val in meta.items():
+        if val is not None:
+            f.write('# %s: %s\r\n' % (key, format_time(val) if key.endswith('time') else val))
+
+
+def write_spectrum(f, spectrum, fmt):
+    """write_spectrum : metadata, header and points of a spectrum to an open file"""
+    write_meta(f, spectrum.meta())
+    writer = csv.writer(f, delimiter=fmt.delimiter)
+    writer.writerow(('wavelength (nm)', 'abs'))
+    writer.writerows(spectrum_rows(spectrum, fmt.decimal))
+
+
+def export_spectrum(spectrum, directory='', name=None, fmt=None):
+    """export_spectrum : write a spectrum to a new file - return its path
+    [name: without extension, default from the time of the spectrum] [fmt: ExportFormat, default csv]"""
+    fmt = get_format() if fmt is None else fmt
+    f, path = open_unique(directory, default_name('spectrum', spectrum.time) if name is None else name,
+                          fmt.extension)
+    with f:
+        write_spectrum(f, spectrum, fmt)
+    return path
+
+
+def export_archive(archive, directory='', rows=None, layout=Layout_Wide, fmt=None, name=None, report=None,
+                   aborting=None):
+    """export_archive : write spectra of a SpectrumArchive - return the paths of the files
+    [rows: numbers of the spectra, default all] [layout: Layout_Wide, Layout_Long or Layout_Files]
+    [report: called with (done, total)] [aborting: returns True to stop - the file being written is removed]"""
+    fmt = get_format() if fmt is None else fmt
+    rows = list(range(len(archive))) if rows is None else list(rows)
+    if layout not in Layouts:
+        raise ValueError("unknown layout: %s" % (layout,))
+    if layout == Layout_Files:
+        paths = []
+        for done, i in enumerate(rows):
+            if aborting is not None and aborting():
+                break
+            spectrum = archive[i]
+            paths.append(export_spectrum(spectrum, directory, '%s_%d' % (default_name('spectrum', spectrum.time), i),
+                                         fmt))
+            if report is not None:
+                report((done + 1, len(rows)))
+        return paths
+    f, path = open_unique(directory, default_name('spectra') if name is None else name, fmt.extension)
+    with f:
+        writer = csv.writer(f, delimiter=fmt.delimiter)
+        if layout == Layout_Wide:
+            complete = write_wide(writer, archive, rows, fmt, report, aborting)
+        else:
+            complete = write_long(writer, archive, rows, fmt, report, aborting)
+    if not complete:
+        os.remove(path)
+        return []
+    return [path]
+
+
+def write_wide(writer, archive, rows, fmt, report=None, aborting=None):
+    """write_wide : one line per wavelength, one column per spectrum - return False if aborted"""
+    np = archive.np
+    index = archive.index[np.asarray(rows, dtype=np.int64)] if rows else archive.index[:0]
+    writer.writerow(['wavelength (nm)'] + ['%d %s' % (i, format_time(float(t))) for i, t in zip(rows, index['time'])])
+    if not rows:
+        return True
+    step = float(index['wl_step'].min())
+    wl_start = float(index['wl_start'].min())
+    wl_end = float((index['wl_start'] + (index['n'].astype(np.float64) - 1) * index['wl_step']).max())
+    wavelengths = wl_start + step * np.arange(int(round((wl_end - wl_start) / step)) + 1)
+    for done, wl in enumerate(wavelengths.tolist()):
+        if aborting is not None and aborting():
+            return False
+        # one gather in the archive for every spectrum at this wavelength
+        column = archive.column(wl, rows)
+        writer.writerow([format_number(wl, fmt.decimal, 0 if wl == int(wl) else 2)]
+                        + [format_number(val, fmt.decimal) for val in column.tolist()])
+        if report is not None:
+            report((done + 1, len(wavelengths)))
+    return True
+
+
+def write_long(writer, archive, rows, fmt, report=None, aborting=None):
+    """write_long : one line per point - return False if aborted"""
+    writer.writerow(('spectrum', 'time', 'wavelength (nm)', 'abs'))
+    for done, i in enumerate(rows):
+        if aborting is not None and aborting():
+            return False
+        spectrum = archive[i]
+        t = format_time(spectrum.time)
+        writer.writerows((i, t, wl, val) for wl, val in spectrum_rows(spectrum, fmt.decimal))
+        if report is not None:
+            report((done + 1, len(rows)))
+    return True
+
+
+# ------- png
+Png_Signature = b'\x89PNG\r\n\x1a\n'
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(pixels, width, height, bottom_up=False, level=6):
+    """encode_png : png file content of rgba pixels (4 bytes per pixel, rows of width pixels)
+    [bottom_up: first row is the bottom of the image (gl textures)] [level: zlib compression 0-9]"""
+    stride = width * 4
+    if len(pixels) < stride * height:
+        raise ValueError("%d bytes of pixels for a %dx%d image" % (len(pixels), width, height))
+    view = memoryview(pixels).cast('B')
+    rows = range(height - 1, -1, -1) if bottom_up else range(height)
+    # filter type 0 (none) before each row
+    raw = b''.join(b'\x00' + view[row * stride:(row + 1) * stride].tobytes() for row in rows)
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)  # 8 bits, rgba, no interlace
+    return (Png_Signature + png_chunk(b'IHDR', header) + png_chunk(b'IDAT', zlib.compress(raw, level))
+            + png_chunk(b'IEND', b''))
+
+
+def export_png(pixels, width, height, directory='', name=None, bottom_up=False):
+    """export_png : write rgba pixels to a new png file - return its path [name: without extension]"""
+    data = encode_png(pixels, width, height, bottom_up)
+    f, path = open_unique(directory, default_name('graph') if name is None else name, '.png', binary=True)
+    with f:
+        f.write(data)
+    return path
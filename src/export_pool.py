@@ -0,0 +1,111 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - background export workers
+# #########################################################################
+
+"""pool of threads writing exports while the ui goes on
+
+    pool = ExportPool(notify=lambda: Clock.schedule_once(lambda dt: pool.process_results()))
+    pool.start()
+    pool.submit(lambda report, aborting: export_spectrum(spectrum), on_ok, on_error)
+    # on the ui thread, after notify() :
+    pool.process_results()      # calls on_ok(path) or on_error()
+
+Jobs are called as job(report, aborting) like the tasks of S250PrimWorker : report(progress) hands a progress
+back to the ui, aborting is a threading.Event set when the pool stops. Callbacks are never called from a pool
+thread : results are queued and process_results() calls them on the ui thread. Encoding and file writes release
+the gil (zlib, file I/O), so a few threads keep the ui responsive."""
+
+import threading
+import queue
+import time
+from s250Prim_worker import Result_Ok, Result_Progress, Result_Error
+
+
+class ExportPool:
+    """ExportPool : threads running export jobs, results handed back to the ui thread"""
+
+    def __init__(self, workers=2, notify=None, progress_interval=0.1):
+        self.workers = workers
+        self.notify = notify
+        self.progress_interval = progress_interval  # s - min time between two progress reports of a job
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.aborting = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """start : start the threads - no arguments"""
+        self.aborting.clear()
+        self.threads = [threading.Thread(target=self.run, name='ExportPool-%d' % (i,), daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=5., abort=False):
+        """stop : stop the threads once the queued jobs are done [timeout: s to wait for each thread]
+        [abort: stop the running jobs too (aborting is set) and drop the queued ones]"""
+        if abort:
+            self.aborting.set()
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def submit(self, job, clbck_ok, clbck_error, clbck_progress=None):
+        """submit : queue a job - [job: function called with (report, aborting) in a pool thread, returns the
+        answer] [success callback] [error callback] [progress callback: called with what the job gives to report()]"""
+        self.jobs.put((job, clbck_ok, clbck_error, clbck_progress))
+
+    def pending(self):
+        """pending : number of jobs waiting for a thread"""
+        return self.jobs.qsize()
+
+    def post(self, status, clbck, ans=None):
+        """post : hand a result back to the ui"""
+        self.results.put((status, clbck, ans))
+        if self.notify is not None:
+            self.notify()
+
+    def process_results(self):
+        """process_results : call the callbacks of queued results - must be called from the ui thread
+        (an error only concerns its job : the following results are processed)"""
+        while True:
+            try:
+                status, clbck, ans = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if clbck is None:
+                continue
+            if status == Result_Error:
+                clbck()
+            else:
+                clbck(ans)
+
+    def run_job(self, job, clbck_ok, clbck_error, clbck_progress):
+        next_progress = [0.]
+
+        def report(ans):
+            # progress at most every progress_interval s
+            if clbck_progress is not None and time.monotonic() >= next_progress[0]:
+                self.post(Result_Progress, clbck_progress, ans)
+                next_progress[0] = time.monotonic() + self.progress_interval
+        try:
+            ans = job(report, self.aborting)
+        except Exception:
+            self.post(Result_Error, clbck_error)
+            return
+        self.post(Result_Ok, clbck_ok, ans)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if self.aborting.is_set():
+                continue
+            self.run_job(*job)
@@ -7,6 +7,9 @@
 #   Licence: MIT
 # #########################################################################
 
+import os
+import time
+import threading
 from kivy.utils import platform
 
 # ------- software version
@@ -23,24 +26,20 @@ if platform in ['windows', 'linux']:
 from kivy.app import App
 from kivy.uix.popup import Popup
 from kivy.uix.boxlayout import BoxLayout
-from kivy.clock import Clock
+from kivy.clock import Clock, mainthread
 from kivy.factory import Factory
 from graph import SmoothLinePlot
 import s250Prim_async
-if platform in ['windows', 'linux']:
-    from serial.tools import list_ports
-
-    def get_serial_ports_list():
-        ports = list_ports.comports()
-        return [item.device for item in ports]
-
-elif platform == 'android':
-    from usb4a import usb
-
-    def get_serial_ports_list():
-        usb_device_list = usb.get_usb_device_list()
-        return [device.getDeviceName() for device in usb_device_list]
-
+from s250Prim_worker import S250PrimWorker
+from s250Prim_discovery import get_serial_ports_list, discover
+from s250Prim_kinetics import Kinetics
+from s250Prim_sequence import AbsSequence, format_table
+from s250Prim_cache import BaselineCache, ZeroCache
+from spectrum import Spectrum
+from archive import SpectrumArchive
+from catalog import Catalog
+from export import export_spectrum, export_archive, export_png, get_format, use_user_locale
+from export_pool import ExportPool
 from utilities import get_bounds_and_ticks
 
 # ------- graph theme for display and printing
@@ -129,6 +128,33 @@ class PopupWavelengthAbs(Popup):
         self.dismiss()
 
 
+# ------ Popup window for wavelength list of an absorbance sequence
+class PopupWavelengthSequence(Popup):
+    """wavelengths selection for an absorbance sequence"""
+
+    def when_opened(self):
+        """what to do to initialize view"""
+        min, max = sapp.get_wavelength_bounds()
+        self.ids['wl_list_ti'].hint_text = 'ex: 450, 520, 600 (de %d \u00e0 %d nm)' % (min, max)
+
+    def on_ok(self):
+        """if user validates, check the list and start the sequence"""
+        min, max = sapp.get_wavelength_bounds()
+        try:
+            wls = [int(wl) for wl in self.ids['wl_list_ti'].text.replace(',', ' ').replace(';', ' ').split()]
+        except ValueError:
+            wls = []
+        if not wls or any(wl < min or wl > max for wl in wls):
+            self.ids['wl_list_ti'].text = ''
+            return
+        self.dismiss()
+        sapp.set_wavelength_sequence(wls)
+
+    def on_cancel(self):
+        """if user invalidates, just close popup"""
+        self.dismiss()
+
+
 # ------- Popup for message notification
 class PopupMessage(Popup):
     """PopupMessage : display a message box"""
@@ -202,86 +228,120 @@ class BoxAbs(BoxLayout):
     def init(self, wl):
         self.ids['boxabs_title_lbl'].text = 'Mesure d\'absorbance \u00e0 %d nm' % (wl,)
 
+    def init_kinetics(self):
+        self.ids['graph_widget'].xmin = 0
+        self.ids['graph_widget'].xmax = 60
+        self.ids['boxabs_rate_lbl'].text = ''
+
 
 # ------- Main App Class
 class SpectroApp(App):
     port = None
-    spectro = s250Prim_async.S250Prim()
-    wl_min = spectro.waveLengthLimits['start']
-    wl_max = spectro.waveLengthLimits['end']
-    wl_abs = spectro.waveLengthLimits['start']
+    spectro = None
+    wl_min = s250Prim_async.S250Prim.waveLengthLimits['start']
+    wl_max = s250Prim_async.S250Prim.waveLengthLimits['end']
+    wl_abs = s250Prim_async.S250Prim.waveLengthLimits['start']
     data_widget = None
-    timeout_number = 0
-    event_spectro_cmd = None
+    spectro_worker = None
     data_points = None
+    spectrum = None
+    archive = None
+    catalog = None
+    export_pool = None
+    export_format = None
     current_popup = None
     update_ports_list_event = None
+    silent_ports = frozenset()
     max_data = 0.
-
-    def send_command(self, cmd_func, clbck_ok, clbck_error):
-        """sends a command to the spectrometer and schedule a verification function"""
-        check_freq = 60  # Hz - check frequency (max 60Hz -> once per frame)
-        cmd_timeout = 120  # s - timeout to get a valid answer
+    kinetics = None
+    kinetics_file = None
+    kinetics_path = None
+    kinetics_bounds = None
+    sequence = None
+    device_model = None
+    device_firmware = None
+    baseline_cache = None
+    baseline_validity = 3600.  # s - a baseline of the same range is reused during this time
+    zero_cache = None
+    blank_new_zero = False
+    export_dir = ''  # exported files go to the current directory
+    spectrum_speed = 8
+    spectrum_res = 3
+
+    def send_command(self, cmd_func, clbck_ok, clbck_error, clbck_progress=None):
+        """queue a command for the serial I/O worker - answer comes back through process_command_results"""
         # proceed only if the spectrometer is connected. return false otherwise
-        if self.spectro.connected:
-            try:
-                self.timeout_number = check_freq * cmd_timeout  # stop schedule after cmd_timeout s
-                self.root.ids['led_out'].state = 'on'
-                # send command and get number of bytes to be received
-                cmd_data = cmd_func()
-                # don't schedule if command need 0 bytes as answer
-                if cmd_data[1] != 0:
-                    self.event_spectro_cmd = Clock.schedule_interval(
-                        lambda dt: self.check_command_result(cmd_data, clbck_ok, clbck_error), 1. / check_freq)
-                return True
-            except:
-                # cancel check_command_result scheduling
-                self.event_spectro_cmd.cancel()
-                # set ui in disconnect state
-                self.set_disconnected_ui_state()
-                # call error callback
-                clbck_error()
-                return False
+        if self.spectro.connected and self.spectro_worker is not None:
+            self.root.ids['led_out'].state = 'on'
+            self.spectro_worker.submit(cmd_func, clbck_ok, clbck_error, clbck_progress)
+            return True
         return False
 
-    def check_command_result(self, cmd_data, clbck_ok, clbck_error):
-        """check if the number of bytes is ok for processing command"""
-        cmd_sent, n_return = cmd_data
-        # get number of bytes waiting in input buffer
-        try:
-            n_waiting = self.spectro.conn.in_waiting
-        # if cant read but connected (sudden disconnection)
-        except:
-            # cancel check_command_result scheduling
-            self.event_spectro_cmd.cancel()
-            # set ui in disconnect state
-            self.set_disconnected_ui_state()
-            # call error callback
-            clbck_error()
-            return
-        # if enough bytes waiting for what we need to read
-        if n_waiting >= n_return:
+    def send_task(self, task, clbck_ok, clbck_error, clbck_progress=None):
+        """queue a long task (e.g. kinetics) for the serial I/O worker - like send_command"""
+        if self.spectro.connected and self.spectro_worker is not None:
+            self.root.ids['led_out'].state = 'on'
+            self.spectro_worker.submit_task(task, clbck_ok, clbck_error, clbck_progress)
+            return True
+        return False
+
+    def start_spectro_worker(self):
+        """start the serial I/O worker (owns the serial port until stop_spectro_worker is called)"""
+        # the restarted device may have lost its zero : blanks are dropped before the command is redone
+        self.spectro_worker = S250PrimWorker(self.spectro, notify=self.notify_command_results,
+                                             on_status=self.on_spectro_worker_status,
+                                             on_reconnect=self.zero_cache.clear)
+        self.spectro_worker.start()
+
+    def stop_spectro_worker(self):
+        """stop the serial I/O worker"""
+        if self.spectro_worker is not None:
+            self.spectro_worker.stop()
+            self.spectro_worker = None
+
+    def on_spectro_worker_status(self, status):
+        """show automatic reconnection of the serial I/O worker"""
+        state, info = status
+        if state == 'reconnecting':
+            self.root.ids['infobox_lbl'].text = "Reconnexion... (%d)\n%s" % (info, self.port)
+        elif state == 'reconnected':
+            self.root.ids['infobox_lbl'].text = "Connect\u00e9 \n%s" % (self.port,)
+
+    def notify_command_results(self):
+        """called from the worker thread : process results on the next frame"""
+        Clock.schedule_once(lambda dt: self.process_command_results())
+
+    def process_command_results(self):
+        """call callbacks of the answers handed back by the serial I/O worker"""
+        if self.spectro_worker is not None:
             self.root.ids['led_in'].state = 'on'
-            # cancel check_command_result scheduling (no more need to try)
-            self.event_spectro_cmd.cancel()
-            # read the bytes we need (no more)
-            data = self.spectro.receive(n_return)
-            # send to spectrometer library to proceed raw data
-            ans = self.spectro.return_command(data, cmd_sent)
-            # call success callback
-            clbck_ok(ans)
-        else:
-            self.timeout_number -= 1
-            # if timeout happened
-            if self.timeout_number == 0:
-                # cancel check_command_result scheduling (too late to try)
-                self.event_spectro_cmd.cancel()
-                # set as disconnect for ui
-                self.set_disconnected_ui_state()
-                # call error callback
-                clbck_error()
+            # set ui in disconnect state if the link is lost
+            self.spectro_worker.process_results(on_error=self.set_disconnected_ui_state)
+
+    def notify_export_results(self):
+        """called from an export thread : process results on the next frame"""
+        Clock.schedule_once(lambda dt: self.export_pool.process_results())
 
     def build(self):
+        # driver of the spectrometer
+        self.spectro = s250Prim_async.S250Prim()
+        # baselines already made on the devices
+        self.baseline_cache = BaselineCache(os.path.join(self.user_data_dir, 'baselines.json'),
+                                            self.baseline_validity)
+        # every measured spectrum is kept in the archive (it needs numpy)
+        try:
+            self.archive = SpectrumArchive(os.path.join(self.user_data_dir, 'spectra'))
+        except ImportError:
+            self.archive = None
+        # every acquisition (spectra, absorbances, kinetics files) is registered in the catalog
+        self.catalog = Catalog(os.path.join(self.user_data_dir, 'catalog.sqlite'))
+        # exports are encoded and written by background threads
+        self.export_pool = ExportPool(notify=self.notify_export_results)
+        self.export_pool.start()
+        # separators of the exported tables, from the locale (read here, not in the export threads)
+        self.export_format = get_format()
+        # blanks by wavelength against the zero of the device
+        self.zero_cache = ZeroCache()
         # update ports list now
         self.update_ports_list()
         # update ports list every 5s
@@ -293,8 +353,9 @@ class SpectroApp(App):
 
     def update_ports_list(self):
         """get available serial ports and set ports_list spinner values"""
-        # get ports on the system, make a tuple and set spinner values
-        self.root.ids['ports_list'].values = tuple(get_serial_ports_list())
+        # get ports on the system (but the ones where the last discovery found no spectrometer), set spinner values
+        self.root.ids['ports_list'].values = tuple(port for port in get_serial_ports_list()
+                                                   if port not in self.silent_ports)
         # if current value is not in list then go back to default
         if self.root.ids['ports_list'].text not in self.root.ids['ports_list'].values:
             self.root.ids['ports_list'].text = 'Port S\u00e9rie'
@@ -308,6 +369,33 @@ class SpectroApp(App):
             self.root.ids['ports_list'].text = self.root.ids['ports_list'].values[0]
             self.port = self.root.ids['ports_list'].values[0]
 
+    def on_discover_btn_press(self):
+        """probe all serial ports at once in background and keep only the ones where a spectrometer answers"""
+        self.current_popup = PopupOperation()
+        self.current_popup.open()
+        self.current_popup.update("Spectrom\u00e8tre", "Recherche des spectrom\u00e8tres...")
+        thread = threading.Thread(target=self.discover_ports, daemon=True)
+        thread.start()
+
+    def discover_ports(self):
+        ports = get_serial_ports_list()
+        self.on_discover_done(ports, discover(ports))
+
+    @mainthread
+    def on_discover_done(self, ports, found):
+        self.current_popup.dismiss()
+        if not found:
+            self.show_message("Recherche", "Aucun spectrom\u00e8tre trouv\u00e9.")
+            return
+        # ports that did not answer stay out of the list (ports plugged in later are listed again)
+        self.silent_ports = frozenset(ports) - set(port for port, model, rawmodel, firmware in found)
+        self.root.ids['ports_list'].values = tuple(port for port, model, rawmodel, firmware in found)
+        port, model, rawmodel, firmware = found[0]
+        self.root.ids['ports_list'].text = port
+        self.port = port
+        self.show_message("Recherche", "\n".join("%s : %s (version %d)" % (port, model, firmware)
+                                                 for port, model, rawmodel, firmware in found))
+
     def show_message(self, title: str, message: str, close_timeout: float = 2.0):
         p = PopupMessage()
         p.set_message(title, message)
@@ -333,12 +421,15 @@ class SpectroApp(App):
 
     def load_display_abs(self, collapse):
         if collapse:
+            self.stop_kinetics()
             self.root.ids['mainlayout'].remove_widget(self.data_widget)
             del (self.data_widget)
             self.data_widget = None
             self.root.ids['blank_abs_btn'].disabled = True
             self.root.ids['measure_abs_btn'].disabled = True
+            self.root.ids['kinetics_abs_btn'].disabled = True
             self.root.ids['wavelength_abs_lbl'].text = '--- nm'
+            self.data_points = None
         else:
             self.data_widget = BoxAbs()
             self.root.ids['mainlayout'].add_widget(self.data_widget)
@@ -357,6 +448,7 @@ class SpectroApp(App):
                 self.set_connected_ui_state()
                 # try to connect
                 if self.spectro.connect(self.port):
+                    self.start_spectro_worker()
                     # if ok, open a modal popup to tell we're busy and what we do
                     self.current_popup = PopupOperation()
                     self.current_popup.open()
@@ -374,6 +466,17 @@ class SpectroApp(App):
         # tell that it's ok and close popup after a short time
         self.current_popup.update("Spectrom\u00e8tre", "Connexion en cours... OK!")
         self.current_popup.close_after()
+        self.zero_cache.clear()
+        # model and firmware identify the device in the baseline cache
+        self.device_model = self.device_firmware = None
+        self.send_command(self.spectro.get_model_name, self.on_connect_model_ok, None)
+
+    def on_connect_model_ok(self, ans):
+        self.device_model = ans[0]
+        self.send_command(self.spectro.get_firmware_version, self.on_connect_firmware_ok, None)
+
+    def on_connect_firmware_ok(self, ans):
+        self.device_firmware = ans
 
     def on_connect_error(self):
         self.current_popup.dismiss()
@@ -383,22 +486,31 @@ class SpectroApp(App):
         self.root.ids['autotest_btn'].disabled = False
         self.root.ids['hardware_infos_btn'].disabled = False
         self.root.ids['wavelength_abs_btn'].disabled = False
+        self.root.ids['sequence_abs_btn'].disabled = False
         self.root.ids['wavelength_spectrum_btn'].disabled = False
         self.root.ids['connect_btn'].text = "D\u00e9connecter"
+        self.root.ids['discover_btn'].disabled = True
         self.root.ids['infobox_lbl'].text = "Connect\u00e9 \n%s" % (self.port,)
         self.update_ports_list_event.cancel()
 
     def set_disconnected_ui_state(self):
+        self.stop_kinetics()
+        self.stop_spectro_worker()
+        # the answer of a running kinetics won't be processed anymore
+        self.close_kinetics()
         self.spectro.disconnect()
         self.root.ids['autotest_btn'].disabled = True
         self.root.ids['hardware_infos_btn'].disabled = True
         self.root.ids['wavelength_abs_btn'].disabled = True
+        self.root.ids['sequence_abs_btn'].disabled = True
         self.root.ids['blank_abs_btn'].disabled = True
         self.root.ids['measure_abs_btn'].disabled = True
+        self.root.ids['kinetics_abs_btn'].disabled = True
         self.root.ids['wavelength_spectrum_btn'].disabled = True
         self.root.ids['blank_spectrum_btn'].disabled = True
         self.root.ids['measure_spectrum_btn'].disabled = True
         self.root.ids['connect_btn'].text = "Connecter"
+        self.root.ids['discover_btn'].disabled = False
         self.root.ids['infobox_lbl'].text = "D\u00e9connect\u00e9"
         self.update_ports_list()
         self.update_ports_list_event = Clock.schedule_interval(lambda dt: self.update_ports_list(), 5.)
@@ -416,6 +528,15 @@ class SpectroApp(App):
         self.root.ids['blank_spectrum_btn'].disabled = False
         self.root.ids['measure_spectrum_btn'].disabled = True
         self.data_widget.init(start, end)
+        # a recent baseline of the same range is still on the device : measure right away
+        if self.device_firmware is not None and self.baseline_cache.is_valid(
+                self.port, self.device_model, self.device_firmware, self.get_spectrum_params()):
+            self.root.ids['measure_spectrum_btn'].disabled = False
+            age = self.baseline_cache.age(self.port, self.device_model, self.device_firmware)
+            self.show_message("Spectre", "Ligne de base d\u00e9j\u00e0 faite il y a %d min." % (age // 60,))
+
+    def get_spectrum_params(self):
+        return self.wl_min, self.wl_max, self.spectrum_speed, self.spectrum_res
 
     def get_wavelength_spectrum(self):
         return (self.wl_min, self.wl_max)
@@ -424,7 +545,7 @@ class SpectroApp(App):
         return (self.spectro.waveLengthLimits['start'], self.spectro.waveLengthLimits['end'])
 
     def on_blank_spectrum_btn_press(self):
-        cmd_ok = self.send_command(lambda: self.spectro.make_spectrum_baseline(self.wl_min, self.wl_max),
+        cmd_ok = self.send_command(lambda: self.spectro.make_spectrum_baseline(*self.get_spectrum_params()),
                                    self.on_blank_spectrum_ok, self.on_blank_spectrum_error)
         if cmd_ok:
             self.current_popup = PopupOperation()
@@ -436,6 +557,9 @@ class SpectroApp(App):
     def on_blank_spectrum_ok(self, ans):
         if ans:
             self.root.ids['measure_spectrum_btn'].disabled = False
+            if self.device_firmware is not None:
+                self.baseline_cache.record(self.port, self.device_model, self.device_firmware,
+                                           self.get_spectrum_params())
             self.current_popup.update("Spectre", "Mesure de la ligne de base... OK!")
         self.current_popup.close_after()
 
@@ -455,68 +579,110 @@ class SpectroApp(App):
 
     def on_measure_spectrum_btn_press_ok(self, ans):
         wlStart, N = ans
+        if N == 0:
+            # the device lost its baseline (e.g. switched off) : a new one must be made
+            self.baseline_cache.invalidate(self.port, self.device_model, self.device_firmware)
+            self.root.ids['measure_spectrum_btn'].disabled = True
+            self.current_popup.dismiss()
+            self.show_message("Erreur.", "Pas de ligne de base : faites le blanc.")
+            return
         self.current_popup.update("Spectre", "Mesure du spectre (%d points)" % (N,), 0.)
         if self.data_points is not None:
             self.data_widget.ids['graph_widget'].remove_plot(self.data_points)
         self.data_points = SmoothLinePlot()
         self.data_widget.ids['graph_widget'].add_plot(self.data_points)
-        self.data_widget.ids['graph_widget'].ymax = 0.000001
-        self.get_spectrum_point()
+        # read all the points as one stream
+        if not self.send_command(self.spectro.get_spectrum_bulk, self.on_get_spectrum_ok,
+                                 self.on_measure_spectrum_btn_press_error, self.on_get_spectrum_progress):
+            self.current_popup.dismiss()
+            self.show_message("Erreur.", "Spectrom\u00e8tre non connect\u00e9.")
 
     def on_measure_spectrum_btn_press_error(self):
         self.current_popup.dismiss()
         self.show_message("Erreur.", "Impossible de mesurer le spectre.")
 
-    def get_spectrum_point(self):
-        cmd_ok = self.send_command(lambda: self.spectro.get_spectrum_data(), self.on_get_spectrum_point_ok,
-                                   self.on_measure_spectrum_btn_press_error)
-        if not cmd_ok:
-            self.current_popup.dismiss()
-            self.show_message("Erreur.", "Spectrom\u00e8tre non connect\u00e9.")
-
-    def on_get_spectrum_point_ok(self, ans):
-        data, i, N = ans
-        self.data_points.points.append(data)
+    def on_get_spectrum_progress(self, ans):
+        n_received, n_expected = ans
+        i, N = n_received // 2, n_expected // 2
         self.current_popup.update("Spectre", "Mesure du spectre (%d/%d points)" % (i, N), float(i) / float(N) * 100.0)
-        # raw min and max to keep data in the window
-        self.data_widget.ids['graph_widget'].ymax = max(self.data_widget.ids['graph_widget'].ymax, data[1])
-        self.data_widget.ids['graph_widget'].ymin = min(self.data_widget.ids['graph_widget'].ymin, data[1])
-        if i < N:
-            self.get_spectrum_point()
+
+    def on_get_spectrum_ok(self, ans):
+        (wl, absorbance), N = ans
+        # decoded arrays are reused by the driver : keep the counts with the acquisition metadata
+        baseline = self.baseline_cache.get(self.port, self.device_model, self.device_firmware)
+        self.spectrum = Spectrum.from_values(absorbance, wl[0], self.spectrum_res, model=self.device_model,
+                                             firmware=self.device_firmware, speed=self.spectrum_speed,
+                                             res=self.spectrum_res, time=time.time(),
+                                             baseline_time=baseline[1] if baseline is not None else None)
+        if self.archive is not None:
+            i = self.archive.append(self.spectrum)
+            self.catalog.add_spectrum(self.spectrum, self.port, self.archive.path, i)
         else:
-            # autoscale of graph with usable ticks for wavelength and absorbance data
-            ymin, ymax, major_tick, minor_tick = get_bounds_and_ticks(self.data_widget.ids['graph_widget'].ymin,
-                                                                      self.data_widget.ids['graph_widget'].ymax, 10)
-            self.data_widget.ids['graph_widget'].ymin = ymin
-            self.data_widget.ids['graph_widget'].ymax = ymax
-            self.data_widget.ids['graph_widget'].y_ticks_major = major_tick
-            self.data_widget.ids['graph_widget'].y_ticks_minor = minor_tick
-            xmin, xmax, major_tick, minor_tick = get_bounds_and_ticks(self.data_widget.ids['graph_widget'].xmin,
-                                                                      self.data_widget.ids['graph_widget'].xmax, 10)
-            self.data_widget.ids['graph_widget'].xmin = xmin
-            self.data_widget.ids['graph_widget'].xmax = xmax
-            self.data_widget.ids['graph_widget'].x_ticks_major = major_tick
-            self.data_widget.ids['graph_widget'].x_ticks_minor = minor_tick
-            self.current_popup.update("Spectre", "Mesure du spectre (%d/%d points)" % (N, N), 100.0)
-            self.current_popup.close_after()
+            self.catalog.add_spectrum(self.spectrum, self.port)
+        absorbance = self.spectrum.absorbance
+        self.data_points.points = self.spectrum.points()
+        # autoscale of graph with usable ticks for wavelength and absorbance data
+        ymin, ymax, major_tick, minor_tick = get_bounds_and_ticks(min(0., *absorbance), max(0.000001, *absorbance), 10)
+        self.data_widget.ids['graph_widget'].ymin = ymin
+        self.data_widget.ids['graph_widget'].ymax = ymax
+        self.data_widget.ids['graph_widget'].y_ticks_major = major_tick
+        self.data_widget.ids['graph_widget'].y_ticks_minor = minor_tick
+        xmin, xmax, major_tick, minor_tick = get_bounds_and_ticks(self.data_widget.ids['graph_widget'].xmin,
+                                                                  self.data_widget.ids['graph_widget'].xmax, 10)
+        self.data_widget.ids['graph_widget'].xmin = xmin
+        self.data_widget.ids['graph_widget'].xmax = xmax
+        self.data_widget.ids['graph_widget'].x_ticks_major = major_tick
+        self.data_widget.ids['graph_widget'].x_ticks_minor = minor_tick
+        self.current_popup.update("Spectre", "Mesure du spectre (%d/%d points)" % (N, N), 100.0)
+        self.current_popup.close_after()
 
     def save_spectrum(self, txt):
         options = self.data_widget.ids['spectrum_export_spinner'].values
-        # export as png image
+        # export as png image : gl read-back here, png encoding and writing in the export pool
         if txt == options[0]:
-            self.data_widget.ids['graph_widget'].export_to_png('screenshot.png')
-            self.show_message('Export du graphique comme image', 'Fichier sauvegard\u00e9 sous \'screenshot.png\'')
-        # export as csv data
-        elif txt == options[1] and self.data_points is not None:
-            data = self.data_points.points
-            f = open('data.csv', 'w')
-            f.write('# wavelength(nm); abs')
-            for it in data:
-                f.write(str('%d ; %f' % it).replace('.', ','))  # change decimal point to comma to fit with LOo Calc
-            f.close()
-            self.show_message('Export du graphique comme donn\u00e9es csv', 'Fichier sauvegard\u00e9 sous \'data.csv\'')
+            texture = self.data_widget.ids['graph_widget'].export_as_image().texture
+            pixels, (width, height) = texture.pixels, texture.size
+            self.submit_export("Export du graphique comme image",
+                               lambda report, aborting: [export_png(pixels, width, height, self.export_dir,
+                                                                    bottom_up=True)])
+        # export as csv data (decimal separator of the locale)
+        elif txt == options[1] and self.spectrum is not None:
+            spectrum = self.spectrum
+            self.submit_export("Export du graphique comme donn\u00e9es csv",
+                               lambda report, aborting: [export_spectrum(spectrum, self.export_dir,
+                                                                          fmt=self.export_format)])
+        # export every archived spectrum in one file
+        elif txt == options[2] and self.archive is not None:
+            self.submit_export("Export des spectres",
+                               lambda report, aborting: export_archive(self.archive, self.export_dir,
+                                                                       fmt=self.export_format, report=report,
+                                                                       aborting=aborting.is_set),
+                               progress=True)
         options = self.data_widget.ids['spectrum_export_spinner'].text = 'Exporter'
 
+    def submit_export(self, title, job, progress=False):
+        """queue an export job (returns the list of written files) in the export pool - its popup shows the
+        progress [progress: the job reports (done, total)]"""
+        popup = PopupProgress() if progress else PopupOperation()
+        popup.open()
+        if progress:
+            popup.update(title, "Export en cours...", 0.)
+        else:
+            popup.update(title, "Export en cours...")
+
+        def on_progress(ans):
+            done, total = ans
+            popup.update(title, "Export en cours (%d/%d)" % (done, total), done * 100. / total)
+
+        def on_ok(paths):
+            popup.dismiss()
+            self.show_message(title, 'Fichier sauvegard\u00e9 sous \'%s\'' % (', '.join(paths),))
+
+        def on_error():
+            popup.dismiss()
+            self.show_message("Erreur.", "Impossible d'exporter.")
+        self.export_pool.submit(job, on_ok, on_error, on_progress if progress else None)
+
     def on_wavelength_abs_btn_press(self):
         p = PopupWavelengthAbs()
         p.open()
@@ -526,6 +692,7 @@ class SpectroApp(App):
 
     def set_wavelength_abs(self, val):
         val = int(val)
+        self.sequence = None
         if self.send_command(lambda: self.spectro.set_abs_wavelength(val), self.on_set_wavelength_abs_ok,
                              self.on_set_wavelength_abs_error):
             self.current_popup = PopupOperation()
@@ -541,16 +708,26 @@ class SpectroApp(App):
         self.current_popup.close_after()
         self.root.ids['wavelength_abs_lbl'].text = "%d nm" % (self.wl_abs,)
         self.root.ids['blank_abs_btn'].disabled = False
-        self.root.ids['measure_abs_btn'].disabled = True
         self.data_widget.ids['abs_data_ti'].text += "Longueur d\'onde r\u00e9gl\u00e9e \u00e0 %d nm.\n" % (self.wl_abs,)
+        # the blank of this wavelength is still valid : measure right away
+        blank_ok = self.zero_cache.get(self.wl_abs) is not None
+        self.root.ids['measure_abs_btn'].disabled = not blank_ok
+        self.root.ids['kinetics_abs_btn'].disabled = not blank_ok
+        if blank_ok:
+            self.data_widget.ids['abs_data_ti'].text += "z\u00e9ro d'absorbance en m\u00e9moire.\n"
 
     def on_set_wavelength_abs_error(self):
         self.current_popup.dismiss()
         self.show_message("Erreur.", "Impossible de r\u00e9gler la longueur d'onde d'aborbance")
 
     def on_blank_abs_btn_press(self):
-        if self.send_command(lambda: self.spectro.get_abs_zero(), self.on_blank_abs_btn_press_ok,
-                             self.on_blank_abs_btn_press_error):
+        if self.sequence is not None:
+            self.on_blank_sequence_btn_press()
+            return
+        # the device keeps one zero : once made, blanks of other wavelengths are read against it
+        self.blank_new_zero = not self.zero_cache.has_zero()
+        cmd_func = self.spectro.get_abs_zero if self.blank_new_zero else self.spectro.get_abs
+        if self.send_command(cmd_func, self.on_blank_abs_btn_press_ok, self.on_blank_abs_btn_press_error):
             self.current_popup = PopupOperation()
             self.current_popup.open()
             self.current_popup.update("Absorbance", "Mesure du z\u00e9ro \u00e0 %d nm..." % (self.wl_abs,))
@@ -559,6 +736,7 @@ class SpectroApp(App):
 
     def on_blank_abs_btn_press_ok(self, ans):
         self.root.ids['measure_abs_btn'].disabled = False
+        self.root.ids['kinetics_abs_btn'].disabled = False
         if not self.send_command(lambda: self.spectro.get_abs_data(), self.on_blank_abs_btn_press_ok_data_ok,
                                  self.on_blank_abs_btn_press_ok_data_error):
             self.current_popup.dismiss()
@@ -570,7 +748,12 @@ class SpectroApp(App):
 
     def on_blank_abs_btn_press_ok_data_ok(self, ans):
         val = ans[1]
-        self.spectro.zero_data = val
+        if self.blank_new_zero:
+            self.spectro.zero_data = val
+            self.zero_cache.new_zero(self.wl_abs)
+        if self.zero_cache.put(self.wl_abs, val):
+            self.data_widget.ids['abs_data_ti'].text += \
+                "D\u00e9rive d\u00e9tect\u00e9e : z\u00e9ros des autres longueurs d'onde effac\u00e9s.\n"
         self.data_widget.ids['abs_data_ti'].text += "z\u00e9ro d'absorbance...ok.\n"
         self.current_popup.dismiss()
 
@@ -578,6 +761,9 @@ class SpectroApp(App):
         self.on_blank_abs_btn_press_error()
 
     def on_measure_abs_btn_press(self):
+        if self.sequence is not None:
+            self.on_measure_sequence_btn_press()
+            return
         if self.send_command(lambda: self.spectro.get_abs(), self.on_measure_abs_btn_press_ok,
                              self.on_measure_abs_btn_press_error):
             self.current_popup = PopupOperation()
@@ -599,7 +785,15 @@ class SpectroApp(App):
         self.show_message("Erreur.", "Impossible de mesurer l'absorbance")
 
     def on_measure_abs_btn_press_ok_data_ok(self, ans):
-        val = ans[1]
+        # blank of the wavelength subtracted on the host
+        val = self.zero_cache.apply(self.wl_abs, ans[1])
+        if val is None:
+            self.root.ids['measure_abs_btn'].disabled = True
+            self.root.ids['kinetics_abs_btn'].disabled = True
+            self.current_popup.dismiss()
+            self.show_message("Erreur.", "Z\u00e9ro p\u00e9rim\u00e9 : refaites le blanc.")
+            return
+        self.catalog.add_abs(self.wl_abs, val, self.port, self.device_model, self.device_firmware)
         self.data_widget.ids[
             'abs_data_ti'].text += 'Valeur de l\'absorbance: %f\n' % (val,)
         self.current_popup.update("Absorbance", "Mesure de l'absorbance \u00e0 %d nm... OK" % (self.wl_abs,))
@@ -608,6 +802,154 @@ class SpectroApp(App):
     def on_measure_abs_btn_press_ok_data_error(self):
         self.on_blank_abs_btn_press_error()
 
+    def on_sequence_abs_btn_press(self):
+        p = PopupWavelengthSequence()
+        p.open()
+
+    def set_wavelength_sequence(self, wls):
+        """prepare a sequence : the blank and measure buttons then work on all its wavelengths"""
+        self.sequence = AbsSequence(self.spectro, wls, zeros=self.zero_cache)
+        text = ', '.join('%d' % (wl,) for wl in self.sequence.wavelengths)
+        self.root.ids['wavelength_abs_lbl'].text = "%s nm" % (text,)
+        self.root.ids['blank_abs_btn'].disabled = False
+        self.root.ids['kinetics_abs_btn'].disabled = True
+        self.data_widget.ids['abs_data_ti'].text += "S\u00e9quence : %s nm.\n" % (text,)
+        # every blank of the sequence is still valid : measure right away
+        blank_ok = not self.sequence.missing()
+        self.root.ids['measure_abs_btn'].disabled = not blank_ok
+        if blank_ok:
+            self.data_widget.ids['abs_data_ti'].text += "z\u00e9ros d'absorbance en m\u00e9moire.\n"
+
+    def on_blank_sequence_btn_press(self):
+        if self.send_task(self.sequence.task('blank'), self.on_blank_sequence_ok, self.on_blank_sequence_error,
+                          self.on_sequence_progress):
+            self.current_popup = PopupProgress()
+            self.current_popup.open()
+            self.current_popup.update("Absorbance", "Blanc de la s\u00e9quence...", 0.)
+        else:
+            self.show_message("Erreur.", "Spectrom\u00e8tre non connect\u00e9.")
+
+    def on_sequence_progress(self, ans):
+        done, total = ans
+        self.current_popup.update(self.current_popup.title, "%d/%d longueurs d'onde" % (done, total),
+                                  done * 100. / total)
+
+    def on_blank_sequence_ok(self, ans):
+        self.root.ids['measure_abs_btn'].disabled = False
+        self.data_widget.ids['abs_data_ti'].text += "Blanc de la s\u00e9quence...ok.\n"
+        self.current_popup.dismiss()
+
+    def on_blank_sequence_error(self):
+        self.current_popup.dismiss()
+        self.show_message("Erreur.", "Impossible de mesurer le blanc de la s\u00e9quence")
+
+    def on_measure_sequence_btn_press(self):
+        if self.send_task(self.sequence.task('measure'), self.on_measure_sequence_ok,
+                          self.on_measure_sequence_error, self.on_sequence_progress):
+            self.current_popup = PopupProgress()
+            self.current_popup.open()
+            self.current_popup.update("Absorbance", "Mesure de la s\u00e9quence...", 0.)
+        else:
+            self.show_message("Erreur.", "Spectrom\u00e8tre non connect\u00e9.")
+
+    def on_measure_sequence_ok(self, rows):
+        with self.catalog.batch():
+            for row in rows:
+                self.catalog.add_abs(row.wavelength, row.abs, self.port, self.device_model, self.device_firmware,
+                                     row.time)
+        self.data_widget.ids['abs_data_ti'].text += format_table(rows) + '\n'
+        self.current_popup.close_after()
+
+    def on_measure_sequence_error(self):
+        self.current_popup.dismiss()
+        if self.sequence.missing():
+            # blanks expired or dropped (drift, reconnection) : the blank phase must be done again
+            self.root.ids['measure_abs_btn'].disabled = True
+            self.show_message("Erreur.", "Blanc de la s\u00e9quence expir\u00e9 : refaites le blanc.")
+            return
+        self.show_message("Erreur.", "Impossible de mesurer la s\u00e9quence")
+
+    def on_kinetics_abs_btn_press(self):
+        """start or stop the kinetics (absorbance time series streamed to a csv file)"""
+        if self.kinetics is not None:
+            self.stop_kinetics()
+            return
+        path = time.strftime('kinetics_%Y%m%d_%H%M%S.csv')
+        blank = self.zero_cache.get(self.wl_abs)
+        if blank is None:
+            self.root.ids['kinetics_abs_btn'].disabled = True
+            self.show_message("Erreur.", "Z\u00e9ro p\u00e9rim\u00e9 : refaites le blanc.")
+            return
+        self.kinetics_path = os.path.abspath(path)
+        self.kinetics_file = open(path, 'w')
+        self.kinetics = Kinetics(self.spectro, self.kinetics_file, blank=blank)
+        if not self.send_task(self.kinetics.task(), self.on_kinetics_ok, self.on_kinetics_error,
+                              self.on_kinetics_progress):
+            self.close_kinetics()
+            self.show_message("Erreur.", "Spectrom\u00e8tre non connect\u00e9.")
+            return
+        self.kinetics_bounds = None
+        self.data_widget.init_kinetics()
+        if self.data_points is not None:
+            self.data_widget.ids['graph_widget'].remove_plot(self.data_points)
+        self.data_points = SmoothLinePlot()
+        self.data_widget.ids['graph_widget'].add_plot(self.data_points)
+        self.data_widget.ids['abs_data_ti'].text += "Cin\u00e9tique \u00e0 %d nm : %s\n" % (self.wl_abs, path)
+        self.root.ids['kinetics_abs_btn'].text = "Arr\u00eater"
+        for btn in ('wavelength_abs_btn', 'sequence_abs_btn', 'blank_abs_btn', 'measure_abs_btn'):
+            self.root.ids[btn].disabled = True
+
+    def stop_kinetics(self):
+        if self.kinetics is not None:
+            self.kinetics.stop()
+
+    def close_kinetics(self):
+        if self.kinetics is None:
+            return
+        self.kinetics_file.close()
+        self.kinetics_file = None
+        self.kinetics = None
+        self.root.ids['kinetics_abs_btn'].text = "Cin\u00e9tique"
+
+    def on_kinetics_progress(self, samples):
+        if self.kinetics is None or self.data_widget is None:
+            return
+        # points is a ListProperty : extending it redraws the plot
+        self.data_points.points.extend(samples)
+        graph = self.data_widget.ids['graph_widget']
+        # autoscale : time axis grows by whole ticks, absorbance axis follows the data
+        t_last = samples[-1][0]
+        vals = [val for t, val in samples]
+        lo, hi = min(vals), max(vals)
+        if self.kinetics_bounds is not None:
+            lo, hi = min(lo, self.kinetics_bounds[0]), max(hi, self.kinetics_bounds[1])
+        if self.kinetics_bounds != (lo, hi):
+            self.kinetics_bounds = (lo, hi)
+            ymin, ymax, major_tick, minor_tick = get_bounds_and_ticks(min(0., lo), max(0.000001, hi), 10)
+            graph.ymin, graph.ymax, graph.y_ticks_major, graph.y_ticks_minor = ymin, ymax, major_tick, minor_tick
+        if t_last > graph.xmax:
+            xmin, xmax, major_tick, minor_tick = get_bounds_and_ticks(0., t_last * 1.5, 10)
+            graph.xmax, graph.x_ticks_major, graph.x_ticks_minor = xmax, major_tick, minor_tick
+        self.data_widget.ids['boxabs_rate_lbl'].text = "%d mesures - %.1f mesures/s (max %.1f mesures/s)" % (
+            self.kinetics.n, self.kinetics.rate_mean(), self.kinetics.rate_max())
+
+    def on_kinetics_ok(self, kinetics):
+        self.catalog.add_kinetics(self.wl_abs, self.kinetics_path, self.port, self.device_model,
+                                  self.device_firmware, n=kinetics.n)
+        self.close_kinetics()
+        if self.data_widget is None:
+            # absorbance panel closed while running
+            return
+        self.data_widget.ids['abs_data_ti'].text += \
+            "Cin\u00e9tique termin\u00e9e : %d mesures en %.1f s, %.1f mesures/s (max %.1f mesures/s)\n" % (
+                kinetics.n, kinetics.times[-1] if kinetics.n else 0., kinetics.rate_mean(), kinetics.rate_max())
+        for btn in ('wavelength_abs_btn', 'sequence_abs_btn', 'blank_abs_btn', 'measure_abs_btn', 'kinetics_abs_btn'):
+            self.root.ids[btn].disabled = False
+
+    def on_kinetics_error(self):
+        self.close_kinetics()
+        self.show_message("Erreur.", "Cin\u00e9tique interrompue.")
+
     def on_autotest_btn_press(self):
         if self.send_command(self.spectro.perform_autotest, self.on_autotest_btn_press_ok,
                              self.on_autotest_btn_press_error):
@@ -670,9 +1012,16 @@ class SpectroApp(App):
     def on_stop(self):
         """on_stop : things to do when about to stop app"""
         if self.send_command(self.spectro.stop_device, None, None):
+            self.stop_spectro_worker()
             self.spectro.disconnect()
+        if self.export_pool is not None:
+            # let the queued exports finish
+            self.export_pool.stop()
+        if self.catalog is not None:
+            self.catalog.close()
 
 
 # ------- start App
+use_user_locale()
 sapp = SpectroApp()
 sapp.run()
@@ -0,0 +1,270 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - spectra processing
+# #########################################################################
+
+"""post-processing of spectra : smoothing, derivatives, baseline correction, normalization - needs numpy
+
+    pipeline = Pipeline().crop(400, 700).smooth(11, 3).baseline('rubberband').normalize('max')
+    wl, values = pipeline.apply(spectrum)           # one spectrum : 1-D array
+    wl, stack = pipeline.apply(archive)             # every spectrum of an archive on their common range : 2-D
+    d1 = derivative(values, 1, 11, 3, delta=1.)     # functions work on the last axis of 1-D or 2-D arrays
+
+Every function works on the last axis of an array : a stack of spectra (one per row, same wavelengths) is
+processed in one call, without a loop on the spectra.
+Savitzky-Golay filters are computed here (least squares polynomial on a sliding window) : the points of the edges
+are taken from the polynomial fitted on the first and last windows. The rubber-band baseline is the lower convex
+hull of each spectrum : all the hulls grow by one vertex at each step (steepest chord from the current vertex)."""
+
+from math import factorial
+from s250Prim_async import get_numpy
+from spectrum import Abs_Scale
+
+Baseline_Methods = ('rubberband', 'poly')
+Normalize_Methods = ('max', 'minmax', 'area', 'vector', 'snv')
+
+_savgol_cache = {}  # (window, order, deriv): (center coefficients, left edge matrix, right edge matrix)
+
+
+def numpy_or_error():
+    np = get_numpy()
+    if np is None:
+        raise ImportError("spectra processing needs numpy")
+    return np
+
+
+# ------- Savitzky-Golay
+def savgol_matrices(window, order, deriv=0):
+    """savgol_matrices : (center coefficients (window,), left edge matrix (window//2, window), right edge matrix)
+    for a unit step - the polynomial fitted on a window gives the value (or derivative) at each point"""
+    key = (window, order, deriv)
+    if key not in _savgol_cache:
+        np = numpy_or_error()
+        if window % 2 == 0 or window < 3:
+            raise ValueError("window must be odd and at least 3 (got %d)" % (window,))
+        if not deriv <= order < window:
+            raise ValueError("order must be at least deriv and less than window (got %d)" % (order,))
+        half = window // 2
+        k = np.arange(-half, half + 1, dtype=np.float64)
+        fit = np.linalg.pinv(k[:, None] ** np.arange(order + 1))  # (order+1, window): window -> polynomial
+
+        def at(positions):
+            # derivative of every monomial at positions
+            powers = np.arange(order + 1)
+            scale = np.array([factorial(p) / factorial(p - deriv) if p >= deriv else 0. for p in powers])
+            return scale * positions[:, None] ** np.maximum(powers - deriv, 0)
+        _savgol_cache[key] = ((at(np.zeros(1)) @ fit)[0], at(k[:half]) @ fit, at(k[half + 1:]) @ fit)
+    return _savgol_cache[key]
+
+
+def savgol(values, window=11, order=3, deriv=0, delta=1.):
+    """savgol : Savitzky-Golay filter on the last axis [window: odd number of points] [order: of the polynomial]
+    [deriv: derivative order (0: smoothing)] [delta: step between points (nm)]"""
+    np = numpy_or_error()
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    if n < window:
+        raise ValueError("%d points for a window of %d" % (n, window))
+    center, left, right = savgol_matrices(window, order, deriv)
+    half = window // 2
+    out = np.empty_like(values)
+    windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=-1)
+    out[..., half:n - half] = windows @ center
+    out[..., :half] = values[..., :window] @ left.T
+    out[..., n - half:] = values[..., n - window:] @ right.T
+    if deriv:
+        out /= delta ** deriv
+    return out
+
+
+def smooth(values, window=11, order=3):
+    """smooth : Savitzky-Golay smoothing"""
+    return savgol(values, window, order)
+
+
+def derivative(values, deriv=1, window=11, order=3, delta=1.):
+    """derivative : first or second (deriv) derivative by Savitzky-Golay - per nm with delta in nm"""
+    return savgol(values, window, max(order, deriv), deriv, delta)
+
+
+# ------- baselines
+def poly_baseline(values, x=None, degree=3, iterations=50):
+    """poly_baseline : polynomial under the spectrum - the points above the fit are clipped to it and the
+    polynomial fitted again (every spectrum of a stack in one least squares solve)"""
+    np = numpy_or_error()
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    x = np.arange(n, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    # x in [-1, 1] keeps the vandermonde matrix well conditioned
+    t = (x - x.min()) * (2. / max(x.max() - x.min(), 1e-12)) - 1.
+    vander = t[:, None] ** np.arange(degree + 1)
+    # least squares projection on the polynomials, the same for every spectrum and iteration
+    inverse = np.linalg.pinv(vander)
+    work = values.reshape(-1, n).T.copy()  # (n, spectra)
+    for i in range(iterations):
+        fit = vander @ (inverse @ work)
+        clipped = np.minimum(work, fit)
+        # the clipping no longer moves any point : converged
+        if (work - clipped).max() <= 1e-9:
+            break
+        work = clipped
+    return fit.T.reshape(values.shape)
+
+
+def rubberband_baseline(values, x=None):
+    """rubberband_baseline : lower convex hull of each spectrum (as if a band were stretched under it)"""
+    np = numpy_or_error()
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    x = np.arange(n, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    y = values.reshape(-1, n)
+    m = len(y)
+    rows = np.arange(m)
+    baseline = np.empty_like(y)
+    baseline[:, 0] = y[:, 0]
+    current = np.zeros(m, dtype=np.int64)  # last hull vertex of each spectrum
+    columns = np.arange(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while True:
+            active = current < n - 1
+            if not active.any():
+                break
+            r, c = rows[active], current[active]
+            # next vertex : steepest descending chord from the current vertex (last one on ties)
+            slopes = (y[r] - y[r, c][:, None]) / (x[None, :] - x[c][:, None])
+            slopes[columns[None, :] <= c[:, None]] = np.inf
+            nxt = n - 1 - np.argmin(slopes[:, ::-1], axis=1)
+            slope = slopes[np.arange(len(r)), nxt]
+            # chord from the current vertex to the next one
+            span = (columns[None, :] > c[:, None]) & (columns[None, :] <= nxt[:, None])
+            chord = y[r, c][:, None] + slope[:, None] * (x[None, :] - x[c][:, None])
+            baseline[r] = np.where(span, chord, baseline[r])
+            current[active] = nxt
+    return baseline.reshape(values.shape)
+
+
+def baseline(values, x=None, method='rubberband', degree=3):
+    """baseline : baseline of the spectra [method: 'rubberband' or 'poly'] [degree: of the polynomial]"""
+    if method == 'rubberband':
+        return rubberband_baseline(values, x)
+    if method == 'poly':
+        return poly_baseline(values, x, degree)
+    raise ValueError("unknown baseline method: %s" % (method,))
+
+
+def correct_baseline(values, x=None, method='rubberband', degree=3):
+    """correct_baseline : spectra minus their baseline"""
+    return values - baseline(values, x, method, degree)
+
+
+# ------- normalization
+def normalize(values, method='max', x=None):
+    """normalize : scale each spectrum [method: 'max' (max = 1), 'minmax' (from 0 to 1), 'area' (area = 1),
+    'vector' (euclidean norm = 1), 'snv' (mean 0, standard deviation 1)] - flat spectra are left as they are"""
+    np = numpy_or_error()
+    values = np.asarray(values, dtype=np.float64)
+    offset = 0.
+    if method == 'max':
+        scale = np.abs(values).max(axis=-1, keepdims=True)
+    elif method == 'minmax':
+        offset = values.min(axis=-1, keepdims=True)
+        scale = values.max(axis=-1, keepdims=True) - offset
+    elif method == 'area':
+        x = np.arange(values.shape[-1], dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+        # trapezoids
+        scale = np.abs(((values[..., 1:] + values[..., :-1]) * np.diff(x)).sum(axis=-1, keepdims=True) / 2.)
+    elif method == 'vector':
+        scale = np.sqrt((values * values).sum(axis=-1, keepdims=True))
+    elif method == 'snv':
+        offset = values.mean(axis=-1, keepdims=True)
+        scale = values.std(axis=-1, keepdims=True)
+    else:
+        raise ValueError("unknown normalization: %s" % (method,))
+    return (values - offset) / np.where(scale == 0., 1., scale)
+
+
+# ------- spectra as arrays
+def stack(spectra, wl_lo=None, wl_hi=None):
+    """stack : (wavelengths, 2-D absorbance array) of spectra on their common range (or wl_lo - wl_hi nm)
+    - the spectra must have the same step"""
+    np = numpy_or_error()
+    spectra = list(spectra)
+    if not spectra:
+        raise ValueError("no spectrum to stack")
+    if len(set(spectrum.wl_step for spectrum in spectra)) > 1:
+        raise ValueError("spectra with different steps")
+    lo = max(spectrum.wl_start for spectrum in spectra)
+    hi = min(spectrum.wl_end for spectrum in spectra)
+    lo, hi = max(lo, wl_lo) if wl_lo is not None else lo, min(hi, wl_hi) if wl_hi is not None else hi
+    if hi < lo:
+        raise ValueError("spectra have no common range")
+    parts = [spectrum.crop(lo, hi) for spectrum in spectra]
+    return parts[0].wavelengths, np.stack([np.asarray(part.raw) for part in parts]) / Abs_Scale
+
+
+class Pipeline:
+    """Pipeline : processing stages applied in order - each method adds a stage and returns the pipeline
+
+    apply() takes a Spectrum, a list of spectra or an archive (stacked on their common range), or an array with
+    its wavelengths, and returns (wavelengths, values)"""
+
+    def __init__(self):
+        self.stages = []  # (name, function of (wavelengths, values) returning (wavelengths, values))
+
+    def __repr__(self):
+        return '<Pipeline %s>' % (' | '.join(name for name, func in self.stages),)
+
+    def add(self, name, func):
+        """add : add a stage - func(wavelengths, values) returns (wavelengths, values)"""
+        self.stages.append((name, func))
+        return self
+
+    def crop(self, wl_lo, wl_hi):
+        def crop_stage(x, values):
+            keep = (x >= wl_lo) & (x <= wl_hi)
+            return x[keep], values[..., keep]
+        return self.add('crop %s-%s' % (wl_lo, wl_hi), crop_stage)
+
+    def smooth(self, window=11, order=3):
+        return self.add('smooth %d/%d' % (window, order), lambda x, values: (x, smooth(values, window, order)))
+
+    def derivative(self, deriv=1, window=11, order=3):
+        return self.add('derivative %d' % (deriv,),
+                        lambda x, values: (x, derivative(values, deriv, window, order, step(x))))
+
+    def baseline(self, method='rubberband', degree=3):
+        if method not in Baseline_Methods:
+            raise ValueError("unknown baseline method: %s" % (method,))
+        return self.add('baseline %s' % (method,),
+                        lambda x, values: (x, correct_baseline(values, x, method, degree)))
+
+    def normalize(self, method='max'):
+        if method not in Normalize_Methods:
+            raise ValueError("unknown normalization: %s" % (method,))
+        return self.add('normalize %s' % (method,), lambda x, values: (x, normalize(values, method, x)))
+
+    def apply(self, data, wavelengths=None):
+        """apply : run the stages on a Spectrum, spectra or an archive, or on an array (1-D: one spectrum, 2-D:
+        one per row) with its wavelengths (default: point numbers) - return (wavelengths, values)"""
+        np = numpy_or_error()
+        if hasattr(data, 'absorbance'):
+            x, values = data.wavelengths, np.asarray(data.absorbance, dtype=np.float64)
+        elif hasattr(data, 'ndim') or (isinstance(data, (list, tuple)) and data and not hasattr(data[0], 'raw')):
+            values = np.asarray(data, dtype=np.float64)
+            x = (np.arange(values.shape[-1], dtype=np.float64) if wavelengths is None
+                 else np.asarray(wavelengths, dtype=np.float64))
+        else:
+            x, values = stack(data)
+        for name, func in self.stages:
+            x, values = func(x, values)
+        return x, values
+
+    __call__ = apply
+
+
+def step(x):
+    """step : distance between points of wavelengths x (1 if there is only one point)"""
+    return float(x[1] - x[0]) if len(x) > 1 else 1.
@@ -0,0 +1,335 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - headless plot renderer
+# #########################################################################
+
+"""spectrum plots as png or svg images without kivy (no window, no gl) - needs numpy
+
+    plot = Plot([spectrum], title='2019-04-12 10:15')
+    plot.save('spectrum.png')                   # or .svg
+    paths = render_archive('spectra', 'report', processes=4)    # every spectrum of an archive, on 4 cores
+
+Axes are computed as in the app : bounds and tick distances from utilities.get_bounds_and_ticks, tick positions
+from utilities.get_ticks (a fork of the linear ticks of Graph), labels with the '%g' precision of Graph.
+The image is drawn in a numpy array : lines are sampled once per pixel along each segment (all segments at
+once) and text uses a small bitmap font (digits, signs and the few letters of the axis titles)."""
+
+import os
+from math import floor, log10
+from s250Prim_async import get_numpy
+from utilities import get_bounds_and_ticks, get_ticks
+
+Render_Size = (800, 600)  # px - default image size
+Render_Margins = (72, 24, 24, 48)  # px - left, top, right, bottom
+Render_Font_Scale = 2  # px per font dot
+Render_Background = (255, 255, 255)
+Render_Axis_Color = (0, 0, 0)
+Render_Grid_Color = (220, 220, 220)
+Render_Colors = ((31, 119, 180), (214, 39, 40), (44, 160, 44), (255, 127, 14), (148, 103, 189), (140, 86, 75))
+
+# 3x5 bitmap font : one string per row, '1' for a dot
+Font_Glyphs = {
+    '0': ('111', '101', '101', '101', '111'), '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'), '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'), '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'), '7': ('111', '001', '001', '001', '001'),
+    '8': ('111', '101', '111', '101', '111'), '9': ('111', '101', '111', '001', '111'),
+    '.': ('000', '000', '000', '000', '010'), ',': ('000', '000', '000', '010', '100'),
+    '-': ('000', '000', '111', '000', '000'), '+': ('000', '010', '111', '010', '000'),
+    ':': ('000', '010', '000', '010', '000'), '(': ('010', '100', '100', '100', '010'),
+    ')': ('010', '001', '001', '001', '010'), ' ': ('000', '000', '000', '000', '000'),
+    'e': ('000', '111', '111', '100', '111'), 'n': ('000', '000', '110', '101', '101'),
+    'm': ('000', '000', '111', '111', '101'), 'A': ('010', '101', '111', '101', '101'),
+    'b': ('100', '100', '110', '101', '110'), 's': ('011', '100', '010', '001', '110'),
+    't': ('010', '111', '010', '010', '011'),
+}
+Font_Width, Font_Height = 3, 5
+_glyph_masks = {}  # (char, scale): boolean mask
+
+
+def glyph_mask(char, scale):
+    """glyph_mask : dots of a character scaled to pixels (None if the font lacks it)"""
+    key = (char, scale)
+    if key not in _glyph_masks:
+        glyph = Font_Glyphs.get(char)
+        if glyph is None:
+            _glyph_masks[key] = None
+        else:
+            dots = get_numpy().array([[c == '1' for c in row] for row in glyph])
+            _glyph_masks[key] = dots.repeat(scale, axis=0).repeat(scale, axis=1)
+    return _glyph_masks[key]
+
+
+def rgba(color):
+    return tuple(color) + (255,)
+
+
+def text_width(text, scale=Render_Font_Scale):
+    """text_width : px - width of a text in the bitmap font (one dot between characters)"""
+    return max(len(text) * (Font_Width + 1) - 1, 0) * scale
+
+
+class Plot:
+    """Plot : curves on axes, rendered to an rgba array, png or svg
+
+    curves : Spectrum objects or (x, y) pairs of sequences
+    xrange, yrange : (min, max) of the data shown (default: data bounds, y from 0 as in the app)"""
+
+    def __init__(self, curves, size=Render_Size, xrange=None, yrange=None, title=None, xlabel='nm',
+                 ylabel='Abs'):
+        self.np = get_numpy()
+        if self.np is None:
+            raise ImportError("the renderer needs numpy")
+        np = self.np
+        self.curves = []
+        for curve in curves:
+            if hasattr(curve, 'absorbance'):
+                curve = (curve.wavelengths, curve.absorbance)
+            self.curves.append((np.asarray(curve[0], dtype=np.float64), np.asarray(curve[1], dtype=np.float64)))
+        self.width, self.height = size
+        self.title, self.xlabel, self.ylabel = title, xlabel, ylabel
+        points = [curve for curve in self.curves if len(curve[0])]
+        if xrange is None:
+            xrange = ((min(float(x.min()) for x, y in points), max(float(x.max()) for x, y in points))
+                      if points else (0., 1.))
+        if yrange is None:
+            # like the spectrum graph of the app : absorbance axis includes 0
+            yrange = ((min(0., *(float(np.nanmin(y)) for x, y in points)),
+                       max(0.000001, *(float(np.nanmax(y)) for x, y in points))) if points else (0., 1.))
+        if xrange[1] <= xrange[0]:
+            xrange = (xrange[0], xrange[0] + 1.)
+        self.xmin, self.xmax, self.x_ticks_major, self.x_ticks_minor = get_bounds_and_ticks(xrange[0], xrange[1], 10)
+        self.ymin, self.ymax, self.y_ticks_major, self.y_ticks_minor = get_bounds_and_ticks(yrange[0], yrange[1], 10)
+        left, top, right, bottom = Render_Margins
+        self.left, self.top = left, top
+        self.right, self.bottom = self.width - right - 1, self.height - bottom - 1  # px - plot area, included
+
+    # ------- axes
+    def ticks(self, axis):
+        """ticks : (major, minor) tick positions of the 'x' or 'y' axis"""
+        if axis == 'x':
+            return get_ticks(self.x_ticks_major, self.x_ticks_minor, self.xmin, self.xmax)
+        return get_ticks(self.y_ticks_major, self.y_ticks_minor, self.ymin, self.ymax)
+
+    def to_px(self, x, y):
+        """to_px : pixel coordinates (column, row from the top) of data coordinates (arrays)"""
+        px = self.left + (x - self.xmin) * ((self.right - self.left) / (self.xmax - self.xmin))
+        py = self.bottom - (y - self.ymin) * ((self.bottom - self.top) / (self.ymax - self.ymin))
+        return px, py
+
+    @staticmethod
+    def label(val, tick):
+        # values on the tick grid : drop float noise before the '%g' of Graph
+        digits = max(0, -int(floor(log10(tick)))) + 1 if tick > 0 else 6
+        return '%g' % (round(val, digits),)
+
+    # ------- raster
+    def fill(self, img, x0, y0, x1, y1, color):
+        """fill : rectangle from (x0, y0) to (x1, y1) included, clipped to the image"""
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), self.width - 1), min(int(y1), self.height - 1)
+        if x1 >= x0 and y1 >= y0:
+            img[y0:y1 + 1, x0:x1 + 1] = color
+
+    def polyline(self, img, px, py, color, thickness=2):
+        """polyline : line through pixel coordinates, clipped to the plot area - every segment at once"""
+        np = self.np
+        keep = np.isfinite(px) & np.isfinite(py)
+        px, py = px[keep], py[keep]
+        if len(px) == 0:
+            return
+        if len(px) == 1:
+            xs, ys = px, py
+        else:
+            dx, dy = np.diff(px), np.diff(py)
+            # one sample per pixel along each segment
+            n = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+            segment = np.repeat(np.arange(len(n)), n)
+            first = np.repeat(np.cumsum(n) - n, n)
+            t = (np.arange(int(n.sum())) - first) / np.repeat(np.maximum(n - 1, 1), n)
+            xs = px[:-1][segment] + t * dx[segment]
+            ys = py[:-1][segment] + t * dy[segment]
+        xs, ys = np.rint(xs).astype(np.int64), np.rint(ys).astype(np.int64)
+        for ox in range(thickness):
+            for oy in range(thickness):
+                x, y = xs + ox - thickness // 2, ys + oy - thickness // 2
+                inside = (x >= self.left) & (x <= self.right) & (y >= self.top) & (y <= self.bottom)
+                img[y[inside], x[inside]] = color
+
+    def text(self, img, x, y, text, color, scale=Render_Font_Scale, anchor='left'):
+        """text : text in the bitmap font, (x, y) is its top left corner (or top center/right with anchor)
+        - unknown characters are left blank"""
+        if anchor == 'center':
+            x -= text_width(text, scale) // 2
+        elif anchor == 'right':
+            x -= text_width(text, scale)
+        for i, char in enumerate(text):
+            mask = glyph_mask(char, scale)
+            if mask is None:
+                continue
+            x0 = x + i * (Font_Width + 1) * scale
+            if x0 < 0 or y < 0 or x0 + mask.shape[1] > self.width or y + mask.shape[0] > self.height:
+                continue
+            img[y:y + mask.shape[0], x0:x0 + mask.shape[1]][mask] = color
+
+    def rasterize(self):
+        """rasterize : the plot as a (height, width, 4) uint8 rgba array (first row at the top)"""
+        np = self.np
+        img = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        # one 32 bits word per pixel for the background
+        img.view(np.uint32)[...] = np.frombuffer(bytes(rgba(Render_Background)), dtype=np.uint32)[0]
+        axis, grid = rgba(Render_Axis_Color), rgba(Render_Grid_Color)
+        font_h = Font_Height * Render_Font_Scale
+        (x_major, x_minor), (y_major, y_minor) = self.ticks('x'), self.ticks('y')
+        # grid on major ticks, tick marks on both
+        xs_major = self.to_px(np.asarray(x_major, dtype=np.float64), 0.)[0]
+        ys_major = self.to_px(0., np.asarray(y_major, dtype=np.float64))[1]
+        for px in np.rint(xs_major).astype(int):
+            self.fill(img, px, self.top, px, self.bottom, grid)
+        for py in np.rint(ys_major).astype(int):
+            self.fill(img, self.left, py, self.right, py, grid)
+        for values, length in ((x_major, 6), (x_minor, 3)):
+            for px in np.rint(self.to_px(np.asarray(values, dtype=np.float64), 0.)[0]).astype(int):
+                self.fill(img, px, self.bottom, px, self.bottom + length, axis)
+        for values, length in ((y_major, 6), (y_minor, 3)):
+            for py in np.rint(self.to_px(0., np.asarray(values, dtype=np.float64))[1]).astype(int):
+                self.fill(img, self.left - length, py, self.left, py, axis)
+        # frame
+        self.fill(img, self.left, self.top, self.right, self.top, axis)
+        self.fill(img, self.left, self.bottom, self.right, self.bottom, axis)
+        self.fill(img, self.left, self.top, self.left, self.bottom, axis)
+        self.fill(img, self.right, self.top, self.right, self.bottom, axis)
+        # labels
+        for val, px in zip(x_major, np.rint(xs_major).astype(int)):
+            self.text(img, px, self.bottom + 10, self.label(val, self.x_ticks_major), axis,
+                      anchor='center')
+        for val, py in zip(y_major, np.rint(ys_major).astype(int)):
+            self.text(img, self.left - 10, py - font_h // 2, self.label(val, self.y_ticks_major), axis,
+                      anchor='right')
+        if self.xlabel:
+            self.text(img, (self.left + self.right) // 2, self.height - font_h - 6, self.xlabel, axis,
+                      anchor='center')
+        if self.ylabel:
+            self.text(img, 6, (self.top - font_h) // 2, self.ylabel, axis)
+        if self.title:
+            self.text(img, (self.left + self.right) // 2, (self.top - font_h) // 2, self.title, axis,
+                      anchor='center')
+        # curves
+        for i, (x, y) in enumerate(self.curves):
+            px, py = self.to_px(x, y)
+            self.polyline(img, px, py, rgba(Render_Colors[i % len(Render_Colors)]))
+        return img
+
+    def png(self):
+        """png : png file content of the plot"""
+        from export import encode_png
+        return encode_png(self.rasterize().tobytes(), self.width, self.height)
+
+    # ------- vector
+    def svg(self):
+        """svg : svg document of the plot (text as real text)"""
+        np = self.np
+        color = 'rgb(%d,%d,%d)'
+        out = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" '
+               'font-family="sans-serif" font-size="12">' % (self.width, self.height, self.width, self.height),
+               '<rect width="100%%" height="100%%" fill="%s"/>' % (color % Render_Background,)]
+        (x_major, x_minor), (y_major, y_minor) = self.ticks('x'), self.ticks('y')
+        grid, axis = color % Render_Grid_Color, color % Render_Axis_Color
+        for val in x_major:
+            px = self.to_px(val, 0.)[0]
+            out.append('<line x1="%.1f" y1="%d" x2="%.1f" y2="%d" stroke="%s"/>' % (px, self.top, px, self.bottom,
+                                                                                     grid))
+            out.append('<text x="%.1f" y="%d" text-anchor="middle">%s</text>' % (
+                px, self.bottom + 22, self.label(val, self.x_ticks_major)))
+        for val in y_major:
+            py = self.to_px(0., val)[1]
+            out.append('<line x1="%d" y1="%.1f" x2="%d" y2="%.1f" stroke="%s"/>' % (self.left, py, self.right, py,
+                                                                                     grid))
+            out.append('<text x="%d" y="%.1f" text-anchor="end">%s</text>' % (
+                self.left - 10, py + 4, self.label(val, self.y_ticks_major)))
+        for val, length in [(v, 6) for v in x_major] + [(v, 3) for v in x_minor]:
+            px = self.to_px(val, 0.)[0]
+            out.append('<line x1="%.1f" y1="%d" x2="%.1f" y2="%d" stroke="%s"/>' % (
+                px, self.bottom, px, self.bottom + length, axis))
+        for val, length in [(v, 6) for v in y_major] + [(v, 3) for v in y_minor]:
+            py = self.to_px(0., val)[1]
+            out.append('<line x1="%d" y1="%.1f" x2="%d" y2="%.1f" stroke="%s"/>' % (
+                self.left - length, py, self.left, py, axis))
+        out.append('<rect x="%d" y="%d" width="%d" height="%d" fill="none" stroke="%s"/>' % (
+            self.left, self.top, self.right - self.left, self.bottom - self.top, axis))
+        if self.xlabel:
+            out.append('<text x="%d" y="%d" text-anchor="middle">%s</text>' % (
+                (self.left + self.right) // 2, self.height - 8, escape(self.xlabel)))
+        if self.ylabel:
+            out.append('<text x="6" y="%d">%s</text>' % (self.top - 8, escape(self.ylabel)))
+        if self.title:
+            out.append('<text x="%d" y="%d" text-anchor="middle">%s</text>' % (
+                (self.left + self.right) // 2, self.top - 8, escape(self.title)))
+        out.append('<clipPath id="area"><rect x="%d" y="%d" width="%d" height="%d"/></clipPath>' % (
+            self.left, self.top, self.right - self.left, self.bottom - self.top))
+        for i, (x, y) in enumerate(self.curves):
+            px, py = self.to_px(x, y)
+            keep = np.isfinite(px) & np.isfinite(py)
+            points = ' '.join('%.1f,%.1f' % p for p in zip(px[keep].tolist(), py[keep].tolist()))
+            out.append('<polyline points="%s" fill="none" stroke="%s" stroke-width="1.5" clip-path="url(#area)"/>' % (
+                points, color % Render_Colors[i % len(Render_Colors)]))
+        out.append('</svg>')
+        return '\n'.join(out) + '\n'
+
+    def save(self, path):
+        """save : write the plot to path (png or svg from its extension)"""
+        if path.lower().endswith('.svg'):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.svg())
+        else:
+            with open(path, 'wb') as f:
+                f.write(self.png())
+        return path
+
+
+def escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+# ------- batch
+def render_rows(archive_path, directory, rows, kind='png', size=Render_Size):
+    """render_rows : one image per spectrum of an archive (runs in a worker process) - return the paths"""
+    from archive import SpectrumArchive
+    from export import open_unique, format_time
+    archive = SpectrumArchive(archive_path)
+    paths = []
+    for i in rows:
+        spectrum = archive[i]
+        plot = Plot([spectrum], size, title=format_time(spectrum.time)[:16])
+        data = plot.svg().encode('utf-8') if kind == 'svg' else plot.png()
+        f, path = open_unique(directory, 'spectrum_%d' % (i,), '.' + kind, binary=True)
+        with f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def render_archive(archive_path, directory='', rows=None, kind='png', size=Render_Size, processes=None,
+                   chunk_size=64):
+    """render_archive : one image per spectrum of an archive, rendered by a pool of processes - return the paths
+    [rows: numbers of the spectra, default all] [kind: 'png' or 'svg'] [processes: default one per cpu]
+    each process opens the archive (memmap) : only the spectra numbers and the paths are sent between processes"""
+    from concurrent.futures import ProcessPoolExecutor
+    from archive import SpectrumArchive
+    if rows is None:
+        rows = range(len(SpectrumArchive(archive_path)))
+    rows = list(rows)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    if processes == 1 or len(chunks) <= 1:
+        return [path for chunk in chunks for path in render_rows(archive_path, directory, chunk, kind, size)]
+    paths = []
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(render_rows, archive_path, directory, chunk, kind, size) for chunk in chunks]
+        for future in futures:
+            paths += future.result()
+    return paths
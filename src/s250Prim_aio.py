@@ -0,0 +1,238 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - asyncio version
+# #########################################################################
+
+"""asyncio front end of the S250Prim driver
+
+    dev = AsyncS250Prim()
+    await dev.connect('/dev/ttyUSB0')
+    await dev.set_abs_wavelength(520)
+    zero = await dev.get_abs_zero()
+    val = await dev.get_abs()
+    async with contextlib.aclosing(dev.spectrum(400, 700)) as points:
+        async for wl, val in points:
+            ...
+    dev.disconnect()
+
+Every command accepts a timeout (s, default: adaptive timeout of the driver) and can be cancelled. A cancelled or
+timed out spectrum stops the scan (Cmd_Stop).
+The points of a spectrum are read by a task of their own, which holds the lock for the transfer only : a consumer
+that stops iterating doesn't block the other commands. Closing the generator (aclosing) stops the scan at once,
+an abandoned generator lets the task read the scan to its end."""
+
+import asyncio
+import time
+from s250Prim_async import S250Prim, Cmd_GetSpectrumBulk, Fmt_SpectrumPoint
+
+
+class AsyncS250Prim:
+    """AsyncS250Prim : awaitable commands of a S250Prim driver - one command on the wire at a time"""
+    poll_interval = 0.005  # s - polling period for transports without file descriptor
+
+    def __init__(self, spectro=None):
+        self.spectro = spectro if spectro is not None else S250Prim()
+        self.lock = asyncio.Lock()
+        self.baseline_params = None
+        self.stale = False  # an abandoned answer may still be arriving
+
+    # ------- connection
+    async def connect(self, port):
+        """connect : open the port and initialize the spectrometer - return True if the device answers"""
+        if not self.spectro.connect(port):
+            return False
+        # non blocking reads : waiting is done by the event loop
+        self.spectro.conn.timeout = 0
+        return await self.init()
+
+    def disconnect(self):
+        self.spectro.disconnect()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.spectro.connected:
+            self.disconnect()
+
+    # ------- low level
+    def fileno(self):
+        try:
+            return self.spectro.conn.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    async def wait_readable(self):
+        """wait_readable : wait for incoming bytes"""
+        fd = self.fileno()
+        if fd is None:
+            await asyncio.sleep(self.poll_interval)
+            return
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        loop.add_reader(fd, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            loop.remove_reader(fd)
+
+    async def read_available(self, n, minimum=1):
+        """read_available : read at least minimum and at most n bytes"""
+        data = bytearray()
+        while len(data) < minimum:
+            waiting = self.spectro.conn.in_waiting
+            if waiting:
+                data += self.spectro.receive(min(waiting, n - len(data)))
+            else:
+                await self.wait_readable()
+        return bytes(data)
+
+    async def read_exactly(self, n):
+        return await self.read_available(n, n)
+
+    def drop_input(self):
+        """drop_input : forget bytes of an abandoned answer"""
+        try:
+            self.spectro.conn.reset_input_buffer()
+        except AttributeError:
+            pass
+
+    async def drain(self, quiet=0.05):
+        """drain : drop incoming bytes until the line stays quiet for quiet s"""
+        while True:
+            self.drop_input()
+            try:
+                await asyncio.wait_for(self.wait_readable(), quiet)
+            except asyncio.TimeoutError:
+                return
+            if self.fileno() is None and not self.spectro.conn.in_waiting:
+                return
+
+    def timeout_for(self, cmd, timeout):
+        """timeout_for : given timeout or adaptive timeout of the driver"""
+        if timeout is not None:
+            return timeout
+        return self.spectro.timeout_for(cmd)
+
+    async def transact(self, cmd_func, timeout=None):
+        """transact : send a command of the driver and return its decoded answer"""
+        if self.stale:
+            await self.drain()
+            self.stale = False
+        t0 = time.monotonic()
+        cmd_sent, n_return = cmd_func()
+        if n_return == 0:
+            return None
+        try:
+            data = await asyncio.wait_for(self.read_exactly(n_return), self.timeout_for(cmd_sent, timeout))
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.drop_input()
+            self.stale = True
+            raise
+        self.spectro.record_latency(cmd_sent, time.monotonic() - t0)
+        return self.spectro.return_command(data, cmd_sent)
+
+    async def execute(self, cmd_func, timeout=None):
+        async with self.lock:
+            return await self.transact(cmd_func, timeout)
+
+    # ------- commands
+    async def init(self, timeout=None):
+        return await self.execute(self.spectro.start_device, timeout)
+
+    async def stop(self):
+        await self.execute(self.spectro.stop_device)
+
+    async def get_model_name(self, timeout=None):
+        return await self.execute(self.spectro.get_model_name, timeout)
+
+    async def get_firmware_version(self, timeout=None):
+        return await self.execute(self.spectro.get_firmware_version, timeout)
+
+    async def perform_autotest(self, timeout=None):
+        return await self.execute(self.spectro.perform_autotest, timeout)
+
+    async def set_abs_wavelength(self, wl, gain=255, timeout=None):
+        return await self.execute(lambda: self.spectro.set_abs_wavelength(wl, gain), timeout)
+
+    async def get_abs_zero(self, timeout=None):
+        """get_abs_zero : make the absorbance zero and return the zero value"""
+        async with self.lock:
+            if not await self.transact(self.spectro.get_abs_zero, timeout):
+                return None
+            val = (await self.transact(self.spectro.get_abs_data, timeout))[1]
+        self.spectro.zero_data = val
+        return val
+
+    async def get_abs(self, timeout=None):
+        """get_abs : measure and return the absorbance"""
+        async with self.lock:
+            if not await self.transact(self.spectro.get_abs, timeout):
+                return None
+            return (await self.transact(self.spectro.get_abs_data, timeout))[1]
+
+    async def baseline(self, lo, hi, speed=8, res=3, timeout=None):
+        """baseline : make the spectrum baseline (blank in the cell) - [wlLo in nm] [wlHi in nm] [speed] [res]"""
+        ok = await self.execute(lambda: self.spectro.make_spectrum_baseline(lo, hi, speed, res), timeout)
+        self.baseline_params = (lo, hi, speed, res) if ok else None
+        return ok
+
+    async def spectrum(self, lo=None, hi=None, speed=8, res=3, timeout=None):
+        """spectrum : yield (wavelength, absorbance) points as they are received
+        a baseline is made first if none was made for [lo, hi] (the blank must be in the cell)
+        closing the generator before the end stops the scan"""
+        if lo is not None and self.baseline_params != (lo, hi, speed, res):
+            if not await self.baseline(lo, hi, speed, res, timeout):
+                raise IOError("baseline failed")
+        points = asyncio.Queue()
+        reader = asyncio.ensure_future(self.read_spectrum(points, timeout))
+        try:
+            while True:
+                point = await points.get()
+                if point is None:
+                    break
+                yield point
+            # errors of the transfer
+            await reader
+        finally:
+            if not reader.done():
+                # closed early : the reader stops the scan and drops the rest of the stream
+                reader.cancel()
+                try:
+                    await reader
+                except asyncio.CancelledError:
+                    pass
+
+    async def read_spectrum(self, points, timeout=None):
+        """read_spectrum : measure a spectrum and put its (wavelength, absorbance) points in an asyncio.Queue,
+        then None - the lock is held during the transfer only"""
+        try:
+            async with self.lock:
+                wl_start, N = await self.transact(self.spectro.get_spectrum_header, timeout)
+                timeout = self.timeout_for(Cmd_GetSpectrumBulk, timeout)
+                size = Fmt_SpectrumPoint.size
+                step = self.spectro.scan_step()
+                done = 0
+                t0 = time.monotonic()
+                try:
+                    while done < N:
+                        data = await asyncio.wait_for(self.read_available(size * (N - done), size), timeout)
+                        # keep an odd trailing byte for the next read
+                        while len(data) % size:
+                            data += await asyncio.wait_for(self.read_exactly(1), timeout)
+                        wl, val = self.spectro.decoder.decode(data, wl_start + done * step, step)
+                        chunk = list(zip(wl.tolist(), val.tolist())) if hasattr(wl, 'tolist') else list(zip(wl, val))
+                        done += len(chunk)
+                        for point in chunk:
+                            points.put_nowait(point)
+                    self.spectro.record_latency(Cmd_GetSpectrumBulk, time.monotonic() - t0)
+                finally:
+                    if done < N:
+                        # interrupted : stop the scan and drop the rest of the stream
+                        self.spectro.stop_device()
+                        await self.drain()
+        finally:
+            points.put_nowait(None)
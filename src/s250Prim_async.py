@@ -7,14 +7,45 @@
 # #########################################################################
 
 # Backend Code ####################################
+import os
+import sys
+import time
 import struct
-from kivy.utils import platform
+from collections import namedtuple
+from functools import lru_cache
+from s250Prim_capture import CaptureWriter, Dir_Sent, Dir_Received
+
+
+def get_platform():
+    """get_platform : same values as kivy.utils.platform without importing kivy (headless use)"""
+    if 'ANDROID_ARGUMENT' in os.environ or 'P4A_BOOTSTRAP' in os.environ:
+        return 'android'
+    elif sys.platform in ('win32', 'cygwin'):
+        return 'windows'
+    elif sys.platform == 'darwin':
+        return 'macosx'
+    elif sys.platform.startswith(('linux', 'freebsd')):
+        return 'linux'
+    return 'unknown'
+
+
+platform = get_platform()
+# numpy is optional and imported on first use (see get_numpy) : it takes longer to import than the whole driver
+np = None
+numpy_checked = False
+
+
+def get_numpy():
+    """get_numpy : import numpy on first use - return None if not available"""
+    global np, numpy_checked
+    if not numpy_checked:
+        numpy_checked = True
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np
 
-if platform in ['windows', 'linux']:
-    import serial
-elif platform == 'android':
-    from usb4a import usb
-    from usbserial4a import serial4a
 
 __author__ = "Olivier Boesch"
 __version__ = "0.5 - 02/2019"
@@ -38,89 +69,344 @@ Cmd_BaseLine = b'\x34'
 Ans_Baseline_Ok = b'\x1B'
 Cmd_GetSpectrum = b'\x35'
 Cmd_GetSpectrumData = b'\x00'  # fake command to get spectrum data ! not sent to device.
+Cmd_GetSpectrumBulk = b'\x01'  # fake command to get all spectrum data at once ! not sent to device.
 Cmd_GetType = b'\x51'
 Cmd_Stop = b'\xE7'
 
 # Spectrometer types
 Secoman_Models = {b'T\x00': 'S250 I+/E+', b'T\x01': 'S250 T+', b'P\x02': 'Prim Advanced', b'P\x01': 'Prim Lignt'}
 
+# Codec ####################################
+# precompiled frame encoders and answer decoders
+Fmt_SetWavelength = struct.Struct(">HxxB")  # wl, gain
+Fmt_BaseLine = struct.Struct(">HHBBxx")  # wlLo, wlHi, res, speed
+Fmt_Firmware = struct.Struct(">xB")
+Fmt_AbsData = struct.Struct(">Bh")
+Fmt_SpectrumHeader = struct.Struct(">xxHHx")  # wlStart, N
+Fmt_SpectrumPoint = struct.Struct(">h")
+Fmt_Type = struct.Struct("2s")
+
+
+def decode_init(spectro, data):
+    if data == Ans_Init_Ok:
+        return True
+    elif data == Ans_Init_Nok:
+        return False
+    return None
+
+
+def decode_firmware(spectro, data):
+    return Fmt_Firmware.unpack(data)[0]
+
+
+def decode_autotest(spectro, data):
+    return data == Ans_Autotest_Ok, int.from_bytes(data, 'big')
+
+
+def decode_abs_data(spectro, data):
+    data = Fmt_AbsData.unpack(data)
+    return data[0], data[1] / 10000.0
+
+
+def decode_spectrum_header(spectro, data):
+    wlStart, N = Fmt_SpectrumHeader.unpack(data)
+    spectro.spectrum_data = (wlStart, N)
+    spectro.spectrum_data_idx = 0
+    return wlStart, N
+
+
+def decode_spectrum_point(spectro, data):
+    wlStart, N = spectro.spectrum_data
+    i = spectro.spectrum_data_idx
+    wlcurrent = wlStart + i * spectro.scan_step()
+    i += 1
+    spectro.spectrum_data_idx = i
+    abs_val = Fmt_SpectrumPoint.unpack(data)[0] / 10000.
+    return (wlcurrent, abs_val), i, N
+
+
+def decode_spectrum_bulk(spectro, data):
+    wlStart, N = spectro.spectrum_data
+    spectro.spectrum_data_idx = N
+    return spectro.decoder.decode(data, wlStart, spectro.scan_step()), N
+
+
+def decode_type(spectro, data):
+    rawmodel = Fmt_Type.unpack(data)[0]
+    stringmodel = "Secomam " + Secoman_Models[rawmodel]
+    return stringmodel, rawmodel
+
+
+def answer_is(ans):
+    """answer_is : decoder of commands answered by a single acknowledge byte"""
+    return lambda spectro, data: data == ans
+
+
+# prefixed: frame starts with Cmd_Prefix - encoder: Struct of the arguments (or None)
+# length: length of the answer in bytes (None if given by the spectrum header) - decode: decoder function
+CommandSpec = namedtuple('CommandSpec', 'prefixed encoder length decode')
+
+Codec = {
+    Cmd_Init: CommandSpec(False, None, 1, decode_init),
+    Cmd_Stop: CommandSpec(True, None, 0, None),
+    Cmd_Firmware: CommandSpec(True, None, Fmt_Firmware.size, decode_firmware),
+    Cmd_Autotest: CommandSpec(True, None, 1, decode_autotest),
+    Cmd_SetWavelength: CommandSpec(True, Fmt_SetWavelength, 1, answer_is(Ans_SetWavelength_Ok)),
+    Cmd_GetZeroAbs: CommandSpec(True, None, 1, answer_is(Ans_GetZeroAbs_Ok)),
+    Cmd_GetAbs: CommandSpec(True, None, 1, answer_is(Ans_GetAbs_Ok)),
+    Cmd_GetAbsData: CommandSpec(False, None, Fmt_AbsData.size, decode_abs_data),
+    Cmd_BaseLine: CommandSpec(True, Fmt_BaseLine, 1, answer_is(Ans_Baseline_Ok)),
+    Cmd_GetSpectrum: CommandSpec(True, None, Fmt_SpectrumHeader.size, decode_spectrum_header),
+    Cmd_GetSpectrumData: CommandSpec(False, None, Fmt_SpectrumPoint.size, decode_spectrum_point),
+    Cmd_GetSpectrumBulk: CommandSpec(False, None, None, decode_spectrum_bulk),
+    Cmd_GetType: CommandSpec(True, None, Fmt_Type.size, decode_type),
+}
+
+
+@lru_cache(maxsize=256)
+def encode_frame(cmd, *args):
+    """encode_frame : build (and cache) the frame sent for a command - [command] [command arguments]"""
+    spec = Codec[cmd]
+    frame = Cmd_Prefix + cmd if spec.prefixed else cmd
+    if spec.encoder is not None:
+        frame += spec.encoder.pack(*args)
+    return frame
+
+
+class S250PrimError(IOError):
+    pass
+
+
+class S250PrimTimeout(S250PrimError):
+    pass
+
+
+class S250PrimAnswerError(ValueError):
+    """S250PrimAnswerError : unexpected answer of the device - the link works, reconnecting won't help"""
+    pass
+
+
+class LatencyStats:
+    """LatencyStats : running latency statistics (mean and variance, Welford) and the timeouts derived from them
+
+    Keys are (command, context) : the context separates scans of different range and speed, and wavelength
+    changes of different travel.
+    Until min_samples answers are measured, the prior of the command is used."""
+    priors = {Cmd_Init: 5., Cmd_Autotest: 30., Cmd_SetWavelength: 10., Cmd_GetZeroAbs: 5., Cmd_GetAbs: 5.,
+              Cmd_BaseLine: 120., Cmd_GetSpectrum: 120., Cmd_GetSpectrumBulk: 120.}  # s
+    default_prior = 1.  # s - short commands
+    min_samples = 5
+    k = 6.  # number of standard deviations above mean latency
+    margin = 1.5  # factor applied to mean + k * std
+    min_timeout = 0.2  # s
+
+    def __init__(self):
+        self.stats = {}  # key: [n, mean, m2]
+
+    def add(self, key, latency):
+        """add : record the latency (s) of a valid answer"""
+        n, mean, m2 = self.stats.get(key, (0, 0., 0.))
+        n += 1
+        delta = latency - mean
+        mean += delta / n
+        m2 += delta * (latency - mean)
+        self.stats[key] = (n, mean, m2)
+
+    def get(self, key):
+        """get : return (number of samples, mean, standard deviation) of a key"""
+        n, mean, m2 = self.stats.get(key, (0, 0., 0.))
+        return n, mean, (m2 / (n - 1)) ** 0.5 if n > 1 else 0.
+
+    def timeout(self, key, scale=1.):
+        """timeout : return the timeout (s) to use for a key [scale: factor applied to the measured timeout]"""
+        n, mean, std = self.get(key)
+        if n < self.min_samples:
+            return self.priors.get(key[0], self.default_prior)
+        return max(self.min_timeout, scale * self.margin * (mean + self.k * std))
+
+
+class SpectrumDecoder:
+    """SpectrumDecoder : decode a raw spectrum payload (big-endian int16, 1/10000 abs) in one vectorized call
+
+    Output buffers are preallocated and reused from one call to the other : the returned arrays are views
+    that are overwritten by the next decode (copy them if they must be kept).
+    Falls back to lists if numpy is not available."""
+
+    def __init__(self, capacity=0):
+        self.capacity = 0
+        self.index = None
+        self.wl = None
+        self.abs = None
+        self.reserve(capacity)
+
+    def reserve(self, capacity):
+        """reserve : grow buffers to hold at least capacity points"""
+        if capacity <= self.capacity or get_numpy() is None:
+            return
+        self.capacity = capacity
+        self.index = np.arange(capacity, dtype=np.float64)
+        self.wl = np.empty(capacity, dtype=np.float64)
+        self.abs = np.empty(capacity, dtype=np.float64)
+
+    def decode(self, data, wl_start, wl_step=1):
+        """decode : return (wavelengths, absorbances) of a raw payload - [raw bytes] [first wl in nm] [step in nm]"""
+        n = len(data) // 2
+        if get_numpy() is None:
+            values = [val[0] / 10000. for val in struct.iter_unpack(">h", data[:2 * n])]
+            return [wl_start + i * wl_step for i in range(n)], values
+        self.reserve(n)
+        raw = np.frombuffer(data, dtype='>i2', count=n)
+        wl = self.wl[:n]
+        np.multiply(self.index[:n], wl_step, out=wl)
+        wl += wl_start
+        absorbance = self.abs[:n]
+        np.divide(raw, 10000., out=absorbance)
+        return wl, absorbance
+
 
 class S250Prim:
     waveLengthLimits = {'start': 330, 'end': 900, 'step': 3, 'speed': [1, 2, 3, 4, 5, 6, 7, 8]}
     serialComParameters = {'baudrate': 4800, 'bytesize': 8, 'parity': 'N',
                            'stopbits': 1}
     device_capabilities = {'serialcomparameters': serialComParameters, 'device': waveLengthLimits}
-    connected = False
-    zero_data = 0.
-    spectrum_data = None
-    spectrum_data_idx = None
-    conn = None
+    read_timeout = 0.1  # s - max blocking time of a single read (keeps the I/O worker responsive)
 
     def __init__(self):
-        pass
+        # per instance state : one driver per spectrometer
+        self.connected = False
+        self.conn = None
+        self.zero_data = 0.
+        self.spectrum_data = None
+        self.spectrum_data_idx = None
+        self.capture = None
+        self.port = None
+        self.scan_params = None
+        self.abs_wavelength = None
+        self.wl_position = None  # nm - wavelength of the monochromator (None if unknown, e.g. after a scan)
+        self.wl_travel = None  # nm - travel of the last wavelength change (None if unknown)
+        self.decoder = SpectrumDecoder()
+        self.latency = LatencyStats()
 
     def send(self, s):
         if self.connected:
             n = self.conn.write(s)
+            if self.capture is not None:
+                self.capture.write(Dir_Sent, s)
             return n
 
     def receive(self, n):
         if self.connected:
             c = self.conn.read(n)
+            if self.capture is not None:
+                self.capture.write(Dir_Received, c)
             return c
 
-    def return_command(self, data, cmd_sent):
-        if cmd_sent == Cmd_Init:
-            if data == Ans_Init_Ok:
-                return True
-            elif data == Ans_Init_Nok:
-                return False
+    def start_capture(self, path):
+        """start_capture : record every byte sent and received in a capture file - [path of the file]"""
+        self.stop_capture()
+        self.capture = CaptureWriter(path)
+
+    def stop_capture(self):
+        """stop_capture : stop recording - no arguments"""
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def is_open(self):
+        """is_open : True if connected and the port was not closed under the driver"""
+        return self.connected and self.conn is not None and getattr(self.conn, 'is_open', True)
+
+    def attach(self, conn):
+        """attach : use an already opened serial-like transport (e.g. s250Prim_capture.ReplayConnection)"""
+        self.conn = conn
+        self.connected = True
+
+    def receive_exactly(self, n, timeout):
+        """receive_exactly : read n bytes, raise S250PrimTimeout if they don't come within timeout s"""
+        deadline = time.monotonic() + timeout
+        data = bytearray()
+        while len(data) < n:
+            if not self.is_open():
+                raise S250PrimError("not connected")
+            if time.monotonic() > deadline:
+                raise S250PrimTimeout("no answer after %g s (%d/%d bytes)" % (timeout, len(data), n))
+            data += self.receive(n - len(data))
+        return bytes(data)
+
+    def query(self, cmd_func, timeout=None):
+        """ query : send a command and wait for its decoded answer (blocking) - [command function]
+                    [timeout in s, default: adaptive timeout of the command]"""
+        t0 = time.monotonic()
+        cmd_sent, n_return = cmd_func()
+        if n_return == 0:
             return None
-        elif cmd_sent == Cmd_Firmware:
-            s = struct.unpack(">xB", data)[0]
-            return s
-        elif cmd_sent == Cmd_Autotest:
-            return data == Ans_Autotest_Ok, int.from_bytes(data, 'big')
-        elif cmd_sent == Cmd_SetWavelength:
-            return data == Ans_SetWavelength_Ok
-        elif cmd_sent == Cmd_GetZeroAbs:
-            return data == Ans_GetZeroAbs_Ok
-        elif cmd_sent == Cmd_GetAbs:
-            return data == Ans_GetAbs_Ok
-        elif cmd_sent == Cmd_GetAbsData:
-            data = struct.unpack(">Bh", data)
-            val = data[1] / 10000.0
-            return data[0], val
-        elif cmd_sent == Cmd_BaseLine:
-            return data == Ans_Baseline_Ok
-        elif cmd_sent == Cmd_GetSpectrum:
-            wlStart, N = struct.unpack(">xxHHx", data)
-            self.spectrum_data = (wlStart, N)
-            self.spectrum_data_idx = 0
-            return wlStart, N
-        elif cmd_sent == Cmd_GetSpectrumData:
-            wlStart, N = self.spectrum_data
-            i = self.spectrum_data_idx
-            wlcurrent = wlStart + i
-            i += 1
-            self.spectrum_data_idx = i
-            abs_val = struct.unpack(">h", data)[0] / 10000.
-            return (wlcurrent, abs_val), i, N
-        elif cmd_sent == Cmd_GetType:
-            data = struct.unpack("2s", data)
-            rawmodel = data[0]
-            stringmodel = "Secomam " + Secoman_Models[rawmodel]
-            return stringmodel, rawmodel
-        else:
+        data = self.receive_exactly(n_return, self.timeout_for(cmd_sent) if timeout is None else timeout)
+        self.record_latency(cmd_sent, time.monotonic() - t0)
+        return self.return_command(data, cmd_sent)
+
+    def drain(self):
+        """drain : drop incoming bytes until the line stays quiet for one read timeout"""
+        while self.connected and self.receive(256):
+            pass
+
+    def latency_key(self, cmd):
+        """latency_key : key of the latency statistics of a command (scans depend on range and speed,
+        wavelength changes on the travel : moves of 2**(k-1) to 2**k - 1 nm share the key (cmd, k))"""
+        if cmd in (Cmd_BaseLine, Cmd_GetSpectrum):
+            return cmd, self.scan_params
+        elif cmd == Cmd_GetSpectrumBulk:
+            return cmd, self.spectrum_data
+        elif cmd == Cmd_SetWavelength:
+            return cmd, None if self.wl_travel is None else int(self.wl_travel).bit_length()
+        return cmd, None
+
+    def scan_step(self):
+        """scan_step : nm between two points of a spectrum (resolution of the baseline, 1 if unknown)"""
+        return max(1, self.scan_params[3]) if self.scan_params is not None else 1
+
+    def timeout_for(self, cmd):
+        """timeout_for : timeout (s) to get the answer of a command, from measured latencies"""
+        key = self.latency_key(cmd)
+        if cmd == Cmd_SetWavelength:
+            if key[1] is None:
+                # unknown travel : up to the whole range
+                return self.latency.priors[Cmd_SetWavelength]
+            # a move of the bucket can be twice as long as the measured ones
+            return self.latency.timeout(key, 2.)
+        return self.latency.timeout(key)
+
+    def record_latency(self, cmd, latency):
+        """record_latency : record the time (s) between sending a command and its complete answer"""
+        self.latency.add(self.latency_key(cmd), latency)
+
+    def return_command(self, data, cmd_sent):
+        spec = Codec.get(cmd_sent)
+        if spec is None or spec.decode is None:
             return None
+        return spec.decode(self, data)
+
+    def command(self, cmd, *args):
+        """ command : send the frame of a command and return (command, answer length) - [command] [arguments]"""
+        self.conn.flush()
+        self.send(encode_frame(cmd, *args))
+        return cmd, Codec[cmd].length
 
     def connect(self, port):
+        self.port = port
+        # transport selected and imported on first connection
+        if platform == 'android':
+            from usb4a import usb
+            from usbserial4a import serial4a
+        else:
+            import serial
+        from serial import SerialException
         try:
-            if platform in ['windows', 'linux']:
+            if platform != 'android':
                 self.conn = serial.Serial(port, baudrate=self.serialComParameters['baudrate'],
                                           parity=self.serialComParameters['parity'],
-                                          stopbits=self.serialComParameters['stopbits'])
-            elif platform == 'android':
+                                          stopbits=self.serialComParameters['stopbits'],
+                                          timeout=self.read_timeout)
+            else:
                 device = usb.get_usb_device(port)
                 if not device:
                     raise SerialException(
@@ -135,7 +421,7 @@ class S250Prim:
                     8,
                     self.serialComParameters['parity'],
                     self.serialComParameters['stopbits'],
-                    timeout=1
+                    timeout=self.read_timeout
                 )
             self.connected = True
             return True
@@ -151,81 +437,113 @@ class S250Prim:
         del self.conn
         self.conn = None
         self.connected = False
+        self.wl_position = None
 
     def start_device(self):
         """ start_device : start spectrometer and test if initialization of spectrometer is completed - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Init)
-        return Cmd_Init, 1
+        self.wl_position = None
+        return self.command(Cmd_Init)
 
     def stop_device(self):
         """stop_device : stop spectrometer - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_Stop)
-        return Cmd_Stop, 0
+        return self.command(Cmd_Stop)
 
     def is_device_ready(self):
         """ is_device_ready : test if device is up and ready - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Init)
-        return Cmd_Init, 1
+        return self.command(Cmd_Init)
 
     def get_firmware_version(self):
         """ get_firmware_version : get and return Prom version - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_Firmware)
-        return Cmd_Firmware, 2
+        return self.command(Cmd_Firmware)
 
     def get_model_name(self):
         """ get_model_name : return complete model name - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_GetType)
-        return Cmd_GetType, 2
+        return self.command(Cmd_GetType)
 
     def perform_autotest(self):
         """ perform_autotest : performs AutoTest of spectrometer - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_Autotest)
-        return Cmd_Autotest, 1
+        return self.command(Cmd_Autotest)
+
+    def move_to(self, wl, gain=255):
+        """ move_to : record the wavelength about to be set and the travel to it - [wl in nm] [gain]"""
+        self.wl_travel = abs(wl - self.wl_position) if self.wl_position is not None else None
+        self.wl_position = wl
+        self.abs_wavelength = (wl, gain)
 
     def set_abs_wavelength(self, wl, gain=255):
         """ set_abs_wavelength : Set value of wavelength - [wl in nm] [gain from 0 to 255]"""
-        self.conn.flush()
-        data = struct.pack(">HxxB", wl, gain)
-        self.send(Cmd_Prefix + Cmd_SetWavelength + data)
-        return Cmd_SetWavelength, 1
+        self.move_to(wl, gain)
+        return self.command(Cmd_SetWavelength, wl, gain)
 
     def get_abs_zero(self):
         """ get_abs_zero : get value of absorbance zero - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_GetZeroAbs)
-        return Cmd_GetZeroAbs, 1
+        return self.command(Cmd_GetZeroAbs)
 
     def get_abs(self):
         """ get_abs : get value of absorbance - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_GetAbs)
-        return Cmd_GetAbs, 1
+        return self.command(Cmd_GetAbs)
 
     def get_abs_data(self):
-        self.conn.flush()
-        self.send(Cmd_GetAbsData)
-        return Cmd_GetAbsData, 3
+        return self.command(Cmd_GetAbsData)
 
     def make_spectrum_baseline(self, wllo, wlhi, speed=8, res=3):
         """ make_spectrum_baseline : performs baseline of spectrum
                                      [wlLo in nm] [wlHi in nm] [speed from 1 to 8] [res = 3]"""
-        data = struct.pack(">HHBBxx", wllo, wlhi, res, speed)
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_BaseLine + data)
-        return Cmd_BaseLine, 1
+        self.scan_params = (wllo, wlhi, speed, res)
+        # the scan leaves the monochromator anywhere
+        self.wl_position = None
+        return self.command(Cmd_BaseLine, wllo, wlhi, res, speed)
 
     def get_spectrum_header(self):
         """ get_spectrum_header : Gets and returns spectrum header - no arguments"""
-        self.conn.flush()
-        self.send(Cmd_Prefix + Cmd_GetSpectrum)
-        return Cmd_GetSpectrum, 7
+        self.wl_position = None
+        return self.command(Cmd_GetSpectrum)
 
     @staticmethod
     def get_spectrum_data():
-        return Cmd_GetSpectrumData, 2
+        return Cmd_GetSpectrumData, Codec[Cmd_GetSpectrumData].length
+
+    def get_spectrum_bulk(self):
+        """ get_spectrum_bulk : read all the points announced by get_spectrum_header at once - no arguments"""
+        wlStart, N = self.spectrum_data
+        return Cmd_GetSpectrumBulk, N * Fmt_SpectrumPoint.size
+
+    def restart_spectrum(self):
+        """ restart_spectrum : measure the spectrum again (same baseline) after an interrupted transfer
+                               and read all the points at once - no arguments"""
+        self.query(self.get_spectrum_header)
+        return self.get_spectrum_bulk()
+
+    def iter_spectrum(self, chunk_size=1, timeout=None, header=None):
+        """ iter_spectrum : measure a spectrum and yield its points as they come off the wire
+                            [chunk_size: 1 yields (wl, abs) points, more yields (wavelengths, absorbances) chunks
+                            of at most chunk_size points (numpy arrays or lists)]
+                            [timeout in s without data, default: adaptive timeout of a whole spectrum]
+                            [header: (wlStart, N) if get_spectrum_header was already queried]
+        Points are read only when the consumer asks for them : a slow consumer leaves them in the serial buffer.
+        Closing the generator before the end stops the scan (Cmd_Stop) and drops the rest of the stream."""
+        wl_start, N = self.query(self.get_spectrum_header) if header is None else header
+        timeout = self.timeout_for(Cmd_GetSpectrumBulk) if timeout is None else timeout
+        step = self.scan_step()
+        size = Fmt_SpectrumPoint.size
+        decoder = SpectrumDecoder(chunk_size) if chunk_size > 1 else None
+        done = 0
+        t0 = time.monotonic()
+        try:
+            while done < N:
+                n = min(chunk_size, N - done)
+                data = self.receive_exactly(n * size, timeout)
+                if decoder is None:
+                    yield wl_start + done * step, Fmt_SpectrumPoint.unpack(data)[0] / 10000.
+                else:
+                    wl, val = decoder.decode(data, wl_start + done * step, step)
+                    # decoder buffers are reused : hand out copies
+                    yield (wl.copy(), val.copy()) if hasattr(wl, 'copy') else (wl, val)
+                done += n
+            self.spectrum_data_idx = N
+            self.record_latency(Cmd_GetSpectrumBulk, time.monotonic() - t0)
+        finally:
+            if done < N and self.connected:
+                # closed early or failed : stop the scan and drop the rest of the stream
+                self.stop_device()
+                self.drain()
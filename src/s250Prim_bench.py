@@ -0,0 +1,213 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - bench of spectrometers
+# #########################################################################
+
+"""drive a bench of spectrometers from one process
+
+    bench = S250PrimBench(['/dev/ttyUSB0', '/dev/ttyUSB1'])
+    bench.open()
+    bench.submit_all(job_baseline(400, 700))
+    for i in range(10):
+        bench.submit_all(job_spectrum())
+    bench.wait()
+    print(bench.throughput())
+    bench.close()
+
+Each device has its own driver, thread and job queue : a slow or failing device doesn't hold the others.
+Jobs are functions called with the driver of the device, their results are put in the results queue of the
+device as (job name, result) tuples. A failing job puts the device in error : the result of the job and of
+every job queued after it is the exception, until reset() reconnects and restarts the device."""
+
+import time
+import queue
+import threading
+from s250Prim_async import S250Prim
+
+# device status
+Status_Closed = 'closed'
+Status_Idle = 'idle'
+Status_Busy = 'busy'
+Status_Error = 'error'
+
+Job_Reset = 'reset'  # queued by BenchDevice.reset : reconnect the device, run even in error
+
+
+def job_baseline(wllo, wlhi, speed=8, res=3):
+    """job_baseline : make the spectrum baseline - [wlLo in nm] [wlHi in nm] [speed from 1 to 8] [res = 3]"""
+    def baseline(spectro):
+        return spectro.query(lambda: spectro.make_spectrum_baseline(wllo, wlhi, speed, res))
+    return baseline
+
+
+def job_spectrum():
+    """job_spectrum : measure a spectrum - result is (wavelengths, absorbances)"""
+    def spectrum(spectro):
+        spectro.query(spectro.get_spectrum_header)
+        (wl, val), N = spectro.query(spectro.get_spectrum_bulk)
+        # decoder buffers are reused : keep a copy (lists of the fallback decoder are new)
+        if hasattr(val, 'copy'):
+            return wl.copy(), val.copy()
+        return wl, val
+    return spectrum
+
+
+def job_abs(wl):
+    """job_abs : measure absorbance at a wavelength - [wl in nm]"""
+    def absorbance(spectro):
+        spectro.query(lambda: spectro.set_abs_wavelength(wl))
+        spectro.query(spectro.get_abs)
+        return spectro.query(spectro.get_abs_data)[1]
+    return absorbance
+
+
+class BenchDevice:
+    """BenchDevice : one spectrometer of the bench with its own thread and queues"""
+
+    def __init__(self, port):
+        self.port = port
+        self.spectro = S250Prim()
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.status = Status_Closed
+        self.last_error = None
+        self.n_spectra = 0
+        self.n_jobs = 0
+        self.thread = None
+
+    def connect(self):
+        """connect : (re)open the port and initialize the spectrometer - raise IOError if it doesn't answer"""
+        self.spectro.disconnect()
+        if not self.spectro.connect(self.port) or not self.spectro.query(self.spectro.start_device, 2.):
+            raise IOError("no spectrometer on %s" % (self.port,))
+
+    def open(self):
+        """open : connect and initialize the spectrometer - return True if it answers"""
+        try:
+            self.connect()
+        except Exception as e:
+            self.set_error(e)
+            return False
+        self.status = Status_Idle
+        self.last_error = None
+        self.thread = threading.Thread(target=self.run, name='BenchDevice %s' % (self.port,), daemon=True)
+        self.thread.start()
+        return True
+
+    def close(self):
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join()
+            self.thread = None
+        self.spectro.disconnect()
+        if self.status != Status_Error:
+            self.status = Status_Closed
+
+    def set_error(self, e):
+        self.status = Status_Error
+        self.last_error = e
+
+    def reset(self):
+        """reset : reconnect and restart the device after the jobs already queued (they fail if it is in error)
+        - return the result of open() if the device never opened, None otherwise ((Job_Reset, True or the error)
+        is put in the results queue)"""
+        if self.thread is None:
+            return self.open()
+        self.jobs.put(Job_Reset)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                if job == Job_Reset:
+                    try:
+                        self.connect()
+                    except Exception as e:
+                        self.set_error(e)
+                        self.results.put((Job_Reset, e))
+                        continue
+                    self.status = Status_Idle
+                    self.last_error = None
+                    self.results.put((Job_Reset, True))
+                    continue
+                if self.status == Status_Error:
+                    # device failed : its pending jobs fail with the same error
+                    self.results.put((job.__name__, self.last_error))
+                    continue
+                self.status = Status_Busy
+                try:
+                    result = job(self.spectro)
+                except Exception as e:
+                    self.set_error(e)
+                    self.results.put((job.__name__, e))
+                    continue
+                self.n_jobs += 1
+                if job.__name__ == 'spectrum':
+                    self.n_spectra += 1
+                self.results.put((job.__name__, result))
+                self.status = Status_Idle
+            finally:
+                self.jobs.task_done()
+
+
+class S250PrimBench:
+    """S250PrimBench : run acquisitions on many spectrometers in parallel"""
+
+    def __init__(self, ports):
+        self.devices = {port: BenchDevice(port) for port in ports}
+        self.t_start = None
+
+    def open(self):
+        """open : connect all devices in parallel - return the list of ports that answered"""
+        threads = [threading.Thread(target=device.open) for device in self.devices.values()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.t_start = time.monotonic()
+        return [port for port, device in self.devices.items() if device.status == Status_Idle]
+
+    def close(self):
+        for device in self.devices.values():
+            device.close()
+
+    def submit(self, port, job):
+        """submit : queue a job on one device"""
+        self.devices[port].jobs.put(job)
+
+    def reset(self):
+        """reset : reconnect every device in error - return the ports reset"""
+        ports = [port for port, device in self.devices.items() if device.status == Status_Error]
+        for port in ports:
+            self.devices[port].reset()
+        return ports
+
+    def submit_all(self, job):
+        """submit_all : queue a job on every device that is not in error"""
+        for device in self.devices.values():
+            if device.status in (Status_Idle, Status_Busy):
+                device.jobs.put(job)
+
+    def wait(self):
+        """wait : wait until every queued job is done"""
+        for device in self.devices.values():
+            if device.thread is not None:
+                device.jobs.join()
+
+    def status(self):
+        """status : return {port: (status, jobs done, spectra done, last error)}"""
+        return {port: (device.status, device.n_jobs, device.n_spectra, device.last_error)
+                for port, device in self.devices.items()}
+
+    def throughput(self):
+        """throughput : return the number of spectra per hour across the bench since open()"""
+        if self.t_start is None:
+            return 0.
+        elapsed = time.monotonic() - self.t_start
+        n_spectra = sum(device.n_spectra for device in self.devices.values())
+        return n_spectra * 3600. / elapsed if elapsed > 0. else 0.
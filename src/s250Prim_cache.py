@@ -0,0 +1,176 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - measurement references cache
+# #########################################################################
+
+"""references kept between measurements (and between sessions) to avoid measuring them again
+
+    cache = BaselineCache(default_path('baselines.json'), validity=3600.)
+    params = (400, 700, 8, 3)
+    if not cache.is_valid(port, model, firmware, params):
+        spectro.query(lambda: spectro.make_spectrum_baseline(*params))
+        cache.record(port, model, firmware, params)
+
+The device holds one baseline at a time : the cache remembers the last baseline made on each device
+(port, model, firmware) with its parameters and time. Times are wall clock (s since epoch) to survive restarts.
+
+The device also holds one absorbance zero. ZeroCache keeps, for each wavelength, the blank read against this zero :
+absorbance = reading - blank is computed on the host, and coming back to a wavelength doesn't need a new blank."""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+def default_path(name):
+    """default_path : path of a cache file in the user configuration directory (desktop)"""
+    return os.path.join(os.path.expanduser('~'), '.config', 'spectro', name)
+
+
+def device_key(port, model, firmware):
+    return '%s|%s|%s' % (port, model, firmware)
+
+
+class BaselineCache:
+    """BaselineCache : last spectrum baseline of each device, stored in a json file
+
+    validity : s - age after which a baseline must be made again (None: no limit)"""
+
+    def __init__(self, path, validity=3600.):
+        self.path = path
+        self.validity = validity
+        self.entries = {}  # device key: {'params': [wlLo, wlHi, speed, res], 'time': s}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            # no cache yet or unreadable : start empty
+            self.entries = {}
+
+    def save(self):
+        """save : write the cache (replaced at once, never half written)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def get(self, port, model, firmware):
+        """get : (params, time) of the last baseline of a device, or None"""
+        entry = self.entries.get(device_key(port, model, firmware))
+        if entry is None:
+            return None
+        return tuple(entry['params']), entry['time']
+
+    def age(self, port, model, firmware, now=None):
+        """age : s since the last baseline of a device, None if there is none"""
+        entry = self.get(port, model, firmware)
+        if entry is None:
+            return None
+        return (time.time() if now is None else now) - entry[1]
+
+    def is_valid(self, port, model, firmware, params, now=None):
+        """is_valid : True if the device holds a baseline made with params within the validity window
+        [params: (wlLo, wlHi, speed, res)]"""
+        entry = self.get(port, model, firmware)
+        if entry is None or entry[0] != tuple(params):
+            return False
+        age = self.age(port, model, firmware, now)
+        return age >= 0. and (self.validity is None or age <= self.validity)
+
+    def record(self, port, model, firmware, params, now=None):
+        """record : a baseline was just made on the device with params (it replaces the previous one)"""
+        self.entries[device_key(port, model, firmware)] = {'params': list(params),
+                                                           'time': time.time() if now is None else now}
+        self.save()
+
+    def invalidate(self, port, model, firmware):
+        """invalidate : the device no longer holds its baseline"""
+        if self.entries.pop(device_key(port, model, firmware), None) is not None:
+            self.save()
+
+
+class ZeroCache:
+    """ZeroCache : blank readings by wavelength against the current zero of the device (in memory)
+
+    max_age : s - a blank older than this is evicted (lamp and detector drift), None: no limit
+    tolerance : absorbance - a blank measured again that moved more than this means the device drifted : the
+                blanks of the other wavelengths are dropped
+    max_entries : the least recently used wavelengths are evicted above this number
+    Shared between the ui and the serial I/O worker : every method holds the lock."""
+
+    def __init__(self, max_age=900., tolerance=0.002, max_entries=64):
+        self.max_age = max_age
+        self.tolerance = tolerance
+        self.max_entries = max_entries
+        self.zero = None  # (wavelength, time) of the zero made on the device
+        self.entries = OrderedDict()  # wl: (blank, time), least recently used first
+        self.lock = threading.RLock()
+
+    def clear(self):
+        """clear : the device zero is lost (restart, reconnection)"""
+        with self.lock:
+            self.zero = None
+            self.entries.clear()
+
+    def has_zero(self):
+        return self.zero is not None
+
+    def new_zero(self, wl, now=None):
+        """new_zero : a zero was just made on the device at wl - blanks against the former zero are dropped"""
+        with self.lock:
+            self.entries.clear()
+            self.zero = (wl, time.monotonic() if now is None else now)
+
+    def evict(self, now=None):
+        """evict : drop blanks older than max_age"""
+        with self.lock:
+            if self.max_age is None:
+                return
+            now = time.monotonic() if now is None else now
+            for wl in [wl for wl, (blank, t) in self.entries.items() if now - t > self.max_age]:
+                del self.entries[wl]
+
+    def get(self, wl, now=None):
+        """get : blank at wl, None if there is no valid one"""
+        with self.lock:
+            self.evict(now)
+            entry = self.entries.get(wl)
+            if entry is None:
+                return None
+            self.entries.move_to_end(wl)
+            return entry[0]
+
+    def put(self, wl, blank, now=None):
+        """put : record the blank read at wl - return True if it shows a drift (other blanks are dropped)"""
+        with self.lock:
+            previous = self.get(wl, now)
+            drift = previous is not None and abs(blank - previous) > self.tolerance
+            if drift:
+                self.entries.clear()
+            self.entries[wl] = (blank, time.monotonic() if now is None else now)
+            self.entries.move_to_end(wl)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return drift
+
+    def apply(self, wl, reading, now=None):
+        """apply : absorbance of a reading at wl (reading - blank, 4 decimals), None if there is no valid blank"""
+        blank = self.get(wl, now)
+        if blank is None:
+            return None
+        return round(reading - blank, 4)
+
+    def missing(self, wavelengths, now=None):
+        """missing : wavelengths without a valid blank"""
+        return [wl for wl in wavelengths if self.get(wl, now) is None]
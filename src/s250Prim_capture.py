@@ -0,0 +1,157 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - serial traffic capture and replay
+# #########################################################################
+
+import time
+import struct
+import threading
+
+# capture file : magic, then records of (timestamp in s since start, direction, length) + bytes
+Capture_Magic = b'S250CAP1'
+Fmt_Record = struct.Struct("<dcI")
+Dir_Sent = b'>'
+Dir_Received = b'<'
+
+
+class CaptureWriter:
+    """CaptureWriter : timestamped binary log of every byte sent to and received from a spectrometer"""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(Capture_Magic)
+        self.t0 = time.monotonic()
+        self.lock = threading.Lock()
+
+    def write(self, direction, data):
+        """write : log bytes - [Dir_Sent or Dir_Received] [bytes]"""
+        if not data:
+            return
+        with self.lock:
+            self.file.write(Fmt_Record.pack(time.monotonic() - self.t0, direction, len(data)))
+            self.file.write(data)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def load_capture(path):
+    """load_capture : read a capture file - return a list of (timestamp, direction, bytes)"""
+    with open(path, 'rb') as f:
+        if f.read(len(Capture_Magic)) != Capture_Magic:
+            raise ValueError("%s is not a spectrometer capture file" % (path,))
+        records = []
+        while True:
+            header = f.read(Fmt_Record.size)
+            if len(header) < Fmt_Record.size:
+                return records
+            t, direction, n = Fmt_Record.unpack(header)
+            records.append((t, direction, f.read(n)))
+
+
+class ReplayMismatch(Exception):
+    pass
+
+
+class ReplayConnection:
+    """ReplayConnection : serial-like transport that feeds a captured session back to the driver
+
+    Give it to S250Prim.attach(). Received bytes become readable once the driver has sent everything that
+    preceded them in the capture. With timing=True they are also held back for the delay they had after
+    the preceding sent bytes (original timing), with timing=False the session runs at full CPU speed.
+    Sent bytes that differ from the capture raise ReplayMismatch if strict, they are counted otherwise."""
+
+    def __init__(self, path, timing=False, strict=False, timeout=0.1):
+        self.records = load_capture(path)
+        self.timing = timing
+        self.strict = strict
+        self.timeout = timeout
+        self.mismatches = 0
+        self.idx = 0  # next record to replay
+        self.sent_pending = b''  # bytes of the current sent record not yet matched
+        self.rx = bytearray()  # partially read received record
+        self.t_ref = time.monotonic()  # replay time of the capture origin
+
+    def ready_time(self, t):
+        return self.t_ref + t if self.timing else 0.
+
+    def write(self, data):
+        data = bytes(data)
+        remaining = data
+        while remaining:
+            if not self.sent_pending:
+                # skip received records the driver never read
+                while self.idx < len(self.records) and self.records[self.idx][1] != Dir_Sent:
+                    self.idx += 1
+                if self.idx >= len(self.records):
+                    self.mismatch(remaining)
+                    return len(data)
+                t, direction, self.sent_pending = self.records[self.idx]
+                self.idx += 1
+                self.rx.clear()
+                # align replay clock on the sent record
+                self.t_ref = time.monotonic() - t
+            n = min(len(remaining), len(self.sent_pending))
+            if remaining[:n] != self.sent_pending[:n]:
+                self.mismatch(remaining[:n])
+            remaining = remaining[n:]
+            self.sent_pending = self.sent_pending[n:]
+        return len(data)
+
+    def mismatch(self, data):
+        self.mismatches += 1
+        if self.strict:
+            raise ReplayMismatch("unexpected bytes sent: %r" % (data,))
+
+    def fill(self):
+        """fill : move the next received record to the read buffer if it is due - return its due time"""
+        if self.rx or self.sent_pending:
+            return None
+        if self.idx < len(self.records) and self.records[self.idx][1] == Dir_Received:
+            t, direction, data = self.records[self.idx]
+            due = self.ready_time(t)
+            if time.monotonic() >= due:
+                self.rx += data
+                self.idx += 1
+                return None
+            return due
+        return None
+
+    @property
+    def in_waiting(self):
+        self.fill()
+        return len(self.rx)
+
+    def read(self, n=1):
+        deadline = time.monotonic() + (self.timeout or 0.)
+        out = bytearray()
+        while len(out) < n:
+            due = self.fill()
+            if self.rx:
+                k = min(n - len(out), len(self.rx))
+                out += self.rx[:k]
+                del self.rx[:k]
+                continue
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            # wait for the next record (or the end of the read timeout)
+            time.sleep(min(deadline, due if due is not None else deadline) - now)
+        return bytes(out)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+    # dump a capture file
+    for t, direction, data in load_capture(sys.argv[1]):
+        print("%10.4f %s %s" % (t, direction.decode(), data.hex(' ')))
@@ -0,0 +1,60 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - spectrometers discovery
+# #########################################################################
+
+import os
+from s250Prim_async import S250Prim, platform
+
+
+def get_serial_ports_list():
+    """get_serial_ports_list : return the serial ports of the system
+    (plus the ones listed in the SPECTRO_PORTS environment variable, e.g. simulator pseudo-terminals)"""
+    if platform == 'android':
+        from usb4a import usb
+        usb_device_list = usb.get_usb_device_list()
+        return [device.getDeviceName() for device in usb_device_list]
+    from serial.tools import list_ports
+    ports = list_ports.comports()
+    extra_ports = [item for item in os.environ.get('SPECTRO_PORTS', '').split(os.pathsep) if item]
+    return [item.device for item in ports] + extra_ports
+
+
+def probe(port, timeout=0.5):
+    """probe : return (port, model name, raw model, firmware) if a spectrometer answers on port, None otherwise
+    [port] [timeout in s of each command]"""
+    spectro = S250Prim()
+    try:
+        if not spectro.connect(port):
+            return None
+        if not spectro.query(spectro.start_device, timeout):
+            return None
+        model, rawmodel = spectro.query(spectro.get_model_name, timeout)
+        firmware = spectro.query(spectro.get_firmware_version, timeout)
+        return port, model, rawmodel, firmware
+    except Exception:
+        # no answer, garbage or unknown model : not a spectrometer
+        return None
+    finally:
+        spectro.disconnect()
+
+
+def discover(ports=None, timeout=0.5):
+    """discover : probe all ports at once - return the list of (port, model name, raw model, firmware) that answered
+    [ports to probe, default: all serial ports] [timeout in s of each command]"""
+    if ports is None:
+        ports = get_serial_ports_list()
+    if not ports:
+        return []
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        results = executor.map(lambda port: probe(port, timeout), ports)
+    return [result for result in results if result is not None]
+
+
+if __name__ == "__main__":
+    for port, model, rawmodel, firmware in discover():
+        print("%s: %s (version %d)" % (port, model, firmware))
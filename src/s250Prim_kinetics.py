@@ -0,0 +1,143 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - kinetics (absorbance time series)
+# #########################################################################
+
+"""absorbance time series at the current wavelength, as fast as the link allows
+
+    spectro.query(lambda: spectro.set_abs_wavelength(520))
+    kin = Kinetics(spectro, open('kinetics.csv', 'w'))
+    kin.run(duration=60.)
+    print(kin.n, kin.rate_max(), kin.rate_mean())
+
+Each sample is a GetAbs + GetAbsData cycle sent as one frame. depth cycles are kept in flight : the next
+cycle is sent before the answer of the current one is read, so the device never waits for the host.
+Timestamps (s) are taken on time.monotonic() when the answer of the cycle is complete, relative to the start."""
+
+import time
+import threading
+from array import array
+from s250Prim_async import (Cmd_GetAbs, Cmd_GetAbsData, Ans_GetAbs_Ok, Fmt_AbsData, S250PrimAnswerError,
+                            encode_frame, decode_abs_data)
+
+# one sample : frame sent and answer received
+Kinetics_Frame = encode_frame(Cmd_GetAbs) + encode_frame(Cmd_GetAbsData)
+Kinetics_Answer_Length = len(Ans_GetAbs_Ok) + Fmt_AbsData.size
+
+
+class Kinetics:
+    """Kinetics : pipelined absorbance acquisition streamed to a text file (csv: time;abs)
+
+    out : text file receiving the samples as they arrive (None: memory only), flushed every flush_interval s
+    depth : number of cycles in flight (1: no pipelining)
+    report : called with the list of new (t, abs) samples at most every report_interval s (live display)
+    blank : blank reading subtracted from every reading (zero cache applied on the host)
+    run() can be called again after an interruption (reconnection) : time and samples continue"""
+    flush_interval = 0.5  # s
+    report_interval = 0.1  # s
+
+    def __init__(self, spectro, out=None, depth=2, report=None, separator=';', blank=0.):
+        self.spectro = spectro
+        self.out = out
+        self.depth = max(1, depth)
+        self.report = report
+        self.separator = separator
+        self.blank = blank
+        self.stopping = threading.Event()
+        self.t0 = None
+        self.times = array('d')
+        self.values = array('d')
+        self.min_interval = None
+        self.wavelength = spectro.abs_wavelength[0] if spectro.abs_wavelength is not None else None
+        if self.out is not None:
+            self.out.write('# wavelength(nm): %s\n' % (self.wavelength,))
+            if self.blank:
+                self.out.write('# blank: %s\n' % (self.blank,))
+            self.out.write(self.separator.join(('time(s)', 'abs')) + '\n')
+
+    @property
+    def n(self):
+        return len(self.times)
+
+    def stop(self):
+        """stop : end the acquisition after the cycles in flight (thread safe)"""
+        self.stopping.set()
+
+    def cycle_timeout(self):
+        return self.spectro.timeout_for(Cmd_GetAbs) + self.spectro.timeout_for(Cmd_GetAbsData)
+
+    def read_sample(self, timeout):
+        """read_sample : read the answer of the oldest cycle in flight - return its absorbance"""
+        data = self.spectro.receive_exactly(Kinetics_Answer_Length, timeout)
+        if data[:len(Ans_GetAbs_Ok)] != Ans_GetAbs_Ok:
+            raise S250PrimAnswerError("bad absorbance answer %r" % (data,))
+        return decode_abs_data(self.spectro, data[len(Ans_GetAbs_Ok):])[1]
+
+    def add_sample(self, t, val):
+        if self.times and (self.min_interval is None or t - self.times[-1] < self.min_interval):
+            self.min_interval = t - self.times[-1]
+        self.times.append(t)
+        self.values.append(val)
+        if self.out is not None:
+            self.out.write('%.4f%s%.4f\n' % (t, self.separator, val))
+
+    def run(self, duration=None, count=None, aborting=None):
+        """run : acquire until stop(), duration s or count samples - [duration in s] [count]
+        [aborting: threading.Event also ending the acquisition] - return the number of samples"""
+        self.stopping.clear()
+        if self.t0 is None:
+            self.t0 = time.monotonic()
+        end = None if duration is None else self.t0 + duration
+        timeout = self.cycle_timeout() * self.depth
+        in_flight = 0
+        next_flush = next_report = time.monotonic()
+        reported = self.n
+        try:
+            while True:
+                running = not (self.stopping.is_set() or (aborting is not None and aborting.is_set())
+                               or (end is not None and time.monotonic() >= end)
+                               or (count is not None and self.n + in_flight >= count))
+                if running:
+                    while in_flight < self.depth and (count is None or self.n + in_flight < count):
+                        self.spectro.send(Kinetics_Frame)
+                        in_flight += 1
+                if not in_flight:
+                    break
+                val = self.read_sample(timeout)
+                in_flight -= 1
+                now = time.monotonic()
+                self.add_sample(now - self.t0, round(val - self.blank, 4))
+                if self.out is not None and now >= next_flush:
+                    self.out.flush()
+                    next_flush = now + self.flush_interval
+                if self.report is not None and now >= next_report:
+                    self.report(list(zip(self.times[reported:], self.values[reported:])))
+                    reported = self.n
+                    next_report = now + self.report_interval
+        finally:
+            if self.out is not None:
+                self.out.flush()
+        if self.report is not None and reported < self.n:
+            self.report(list(zip(self.times[reported:], self.values[reported:])))
+        return self.n
+
+    def task(self, duration=None, count=None):
+        """task : the acquisition as a task of S250PrimWorker.submit_task (progress gets the new samples)"""
+        def kinetics_task(report, aborting):
+            self.report = report
+            self.run(duration, count, aborting)
+            return self
+        return kinetics_task
+
+    def rate_max(self):
+        """rate_max : highest sample rate reached (Hz), from the shortest interval between two samples"""
+        return 1. / self.min_interval if self.min_interval else 0.
+
+    def rate_mean(self):
+        """rate_mean : mean sample rate (Hz) over the acquisition"""
+        if self.n < 2 or self.times[-1] <= self.times[0]:
+            return 0.
+        return (self.n - 1) / (self.times[-1] - self.times[0])
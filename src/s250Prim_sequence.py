@@ -0,0 +1,161 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - multi-wavelength absorbance sequences
+# #########################################################################
+
+"""absorbance at several wavelengths in one job
+
+    seq = AbsSequence(spectro, [600, 450, 520])
+    seq.blank()                # blank in the cell
+    rows = seq.measure()       # sample in the cell (call again for each sample)
+    print(format_table(rows))
+
+The device keeps one zero : it is made once, at the first wavelength of the blank phase (unless the zero cache
+already knows a zero of the device). The blank is then read at every wavelength against this zero, kept in the
+zero cache and subtracted on the host from the sample readings (abs = raw - blank), so no wavelength needs a zero
+of its own. A zero at each wavelength would not help : the sample phase reads every wavelength against the one
+zero left on the device.
+Wavelengths whose blank is still valid in the cache can skip the blank phase (see missing()). Wavelengths are
+visited in the order of least monochromator travel from its current position (the sample phase runs the blank
+phase backwards). Set wavelength, measure and read are sent as one frame for each wavelength.
+
+Range : readings are int16 in 1/10000 of absorbance, so they are clipped at +-Reading_Limit. Far from the
+wavelength of the zero the blank can read a large offset (e.g. 0.6 at 520 nm against a zero at 450 nm) : the
+absorbance of a sample at that wavelength is then limited to Reading_Limit - blank. A clipped reading gives an
+abs of nan in its row. A blank missing, or expiring during the sample phase, raises MissingBlankError."""
+
+import time
+from collections import namedtuple
+from s250Prim_async import (Cmd_SetWavelength, Ans_SetWavelength_Ok, Cmd_GetZeroAbs, Ans_GetZeroAbs_Ok,
+                            Cmd_GetAbs, Ans_GetAbs_Ok, Cmd_GetAbsData, Fmt_AbsData, S250PrimAnswerError,
+                            encode_frame, decode_abs_data)
+from s250Prim_cache import ZeroCache
+
+Reading_Limit = 32767 / 10000.  # abs - largest reading of the device (int16 in 1/10000)
+
+# one line of the result table : wavelength (nm), raw reading, blank reading, abs = raw - blank, time (s, epoch)
+SequenceRow = namedtuple('SequenceRow', 'wavelength raw blank abs time')
+
+
+class MissingBlankError(ValueError):
+    """MissingBlankError : no valid blank at a wavelength - the blank phase must be done again"""
+    pass
+
+
+def travel_order(wavelengths, start=None):
+    """travel_order : wavelengths (without duplicates) in the order of least monochromator travel
+    [start: current wavelength of the monochromator (nm), None if unknown]"""
+    wls = sorted(set(wavelengths))
+    if start is None or not wls:
+        return wls
+    # on a line, the shortest path goes first to the nearest end then sweeps to the other one
+    if abs(start - wls[0]) <= abs(wls[-1] - start):
+        return wls
+    return wls[::-1]
+
+
+def travel(order, start=None):
+    """travel : monochromator travel (nm) to visit wavelengths in order [start: current wavelength]"""
+    position = order[0] if start is None and order else start
+    total = 0
+    for wl in order:
+        total += abs(wl - position)
+        position = wl
+    return total
+
+
+def format_table(rows):
+    """format_table : result rows as a text table"""
+    lines = ['  wl (nm)      raw    blank      abs']
+    lines += ['%9d %8.4f %8.4f %8.4f' % (row.wavelength, row.raw, row.blank, row.abs) for row in rows]
+    return '\n'.join(lines)
+
+
+class AbsSequence:
+    """AbsSequence : blank and sample phases of a multi-wavelength absorbance measurement"""
+
+    def __init__(self, spectro, wavelengths, gain=255, zeros=None):
+        self.spectro = spectro
+        self.wavelengths = sorted(set(wavelengths))
+        self.gain = gain
+        # blank readings against the device zero (shared with single wavelength measurements)
+        self.zeros = zeros if zeros is not None else ZeroCache()
+
+    @property
+    def blanks(self):
+        return {wl: self.zeros.get(wl) for wl in self.wavelengths}
+
+    def missing(self):
+        """missing : wavelengths of the sequence without a valid blank"""
+        return self.zeros.missing(self.wavelengths)
+
+    @property
+    def position(self):
+        """position : current wavelength of the monochromator (None if unknown)"""
+        return self.spectro.abs_wavelength[0] if self.spectro.abs_wavelength is not None else None
+
+    def step(self, wl, zero=False):
+        """step : set wavelength, measure (or make the zero) and read - return the reading at wl"""
+        cmd, ans = (Cmd_GetZeroAbs, Ans_GetZeroAbs_Ok) if zero else (Cmd_GetAbs, Ans_GetAbs_Ok)
+        self.spectro.move_to(wl, self.gain)
+        self.spectro.send(encode_frame(Cmd_SetWavelength, wl, self.gain) + encode_frame(cmd)
+                          + encode_frame(Cmd_GetAbsData))
+        timeout = sum(self.spectro.timeout_for(c) for c in (Cmd_SetWavelength, cmd, Cmd_GetAbsData))
+        data = self.spectro.receive_exactly(len(Ans_SetWavelength_Ok) + len(ans) + Fmt_AbsData.size, timeout)
+        acks = len(Ans_SetWavelength_Ok) + len(ans)
+        if data[:acks] != Ans_SetWavelength_Ok + ans:
+            raise S250PrimAnswerError("bad answer at %d nm: %r" % (wl, data))
+        val = decode_abs_data(self.spectro, data[acks:])[1]
+        if zero:
+            self.spectro.zero_data = val
+        return val
+
+    def blank(self, report=None, wavelengths=None):
+        """blank : blank phase (blank in the cell) - make the zero at the first wavelength if the device has none
+        and read the blank at every wavelength [report: called with (done, total) after each wavelength]
+        [wavelengths: only these ones, e.g. missing()] - return {wl: blank}"""
+        order = travel_order(self.wavelengths if wavelengths is None else wavelengths, self.position)
+        fresh = {}
+        for i, wl in enumerate(order):
+            zero = not self.zeros.has_zero()
+            val = self.step(wl, zero)
+            if zero:
+                self.zeros.new_zero(wl)
+            fresh[wl] = val
+            if self.zeros.put(wl, val):
+                # drift : the cache dropped every blank, the ones of this phase are still good
+                for done_wl, done_val in fresh.items():
+                    self.zeros.put(done_wl, done_val)
+            if report is not None:
+                report((i + 1, len(order)))
+        return self.blanks
+
+    def measure(self, report=None):
+        """measure : sample phase (sample in the cell) - can be repeated for each sample
+        [report: called with (done, total) after each wavelength] - return SequenceRow list by wavelength"""
+        missing = self.missing()
+        if missing:
+            raise MissingBlankError("no blank at %s nm" % (', '.join('%d' % (wl,) for wl in missing),))
+        rows = []
+        order = travel_order(self.wavelengths, self.position)
+        for i, wl in enumerate(order):
+            raw = self.step(wl)
+            # the blank may have expired (max_age) or been dropped for drift since the start of the phase
+            blank = self.zeros.get(wl)
+            if blank is None:
+                raise MissingBlankError("blank at %d nm expired during the measure" % (wl,))
+            val = float('nan') if abs(raw) >= Reading_Limit else round(raw - blank, 4)
+            rows.append(SequenceRow(wl, raw, blank, val, time.time()))
+            if report is not None:
+                report((i + 1, len(order)))
+        rows.sort()
+        return rows
+
+    def task(self, phase):
+        """task : a phase ('blank' or 'measure') as a task of S250PrimWorker.submit_task"""
+        def sequence_task(report, aborting):
+            return getattr(self, phase)(report)
+        return sequence_task
@@ -0,0 +1,296 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers simulator on a pseudo-terminal (linux)
+# #########################################################################
+
+import os
+import tty
+import math
+import time
+import random
+import select
+import threading
+from s250Prim_async import (Cmd_Prefix, Cmd_Init, Ans_Init_Ok, Ans_Init_Nok, Cmd_Firmware, Cmd_Autotest,
+                            Ans_Autotest_Ok, Cmd_SetWavelength, Ans_SetWavelength_Ok, Cmd_GetZeroAbs,
+                            Ans_GetZeroAbs_Ok, Cmd_GetAbs, Ans_GetAbs_Ok, Cmd_GetAbsData, Cmd_BaseLine,
+                            Ans_Baseline_Ok, Cmd_GetSpectrum, Cmd_GetType, Cmd_Stop, Secoman_Models,
+                            Fmt_SetWavelength, Fmt_BaseLine, Fmt_AbsData, Fmt_SpectrumHeader, Fmt_SpectrumPoint,
+                            S250Prim)
+
+
+def default_sample(wl):
+    """default_sample : absorbance of the simulated sample - two gaussian bands on a small slope"""
+    return (0.8 * math.exp(-((wl - 520.) / 40.) ** 2) + 0.3 * math.exp(-((wl - 430.) / 25.) ** 2)
+            + 0.05 * (900. - wl) / 570.)
+
+
+class S250PrimSimulator:
+    """S250PrimSimulator : answers the S250Prim protocol on a linux pseudo-terminal
+
+    start() opens the pty and serves it in a thread, the port to give to S250Prim.connect() is in port
+    (or link if a symlink path is given : the link survives simulated disconnections).
+
+    baudrate : wire speed to emulate (bytes are throttled to 10 bits per byte), None for no throttling
+    latency : s - processing time of each command
+    noise : standard deviation of the absorbance noise
+    faults : probabilities per command : 'drop' (no answer), 'corrupt' (a flipped answer byte),
+             'nok' (init answers not ok), 'disconnect' (the pty is closed for reconnect_delay s then reopened)
+    speedup : time acceleration factor applied to every delay (float('inf') for no delay at all)
+    scan_rate : nm/s scanned at speed 1 (speed 8 is 8 times faster)
+    move_rate : nm/s of the monochromator when setting a wavelength"""
+
+    def __init__(self, model=b'P\x01', firmware=12, baudrate=4800, latency=0.005, noise=0.0005, faults=None,
+                 speedup=1., scan_rate=15., move_rate=500., sample=default_sample, link=None,
+                 reconnect_delay=1., seed=None):
+        if model not in Secoman_Models:
+            raise ValueError("unknown model %r" % (model,))
+        self.model = model
+        self.firmware = firmware
+        self.baudrate = baudrate
+        self.latency = latency
+        self.noise = noise
+        self.faults = faults or {}
+        self.speedup = speedup
+        self.scan_rate = scan_rate
+        self.move_rate = move_rate
+        self.sample = sample
+        self.link = link
+        self.reconnect_delay = reconnect_delay
+        self.random = random.Random(seed)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.rx = bytearray()
+        self.unplug_delay = None
+        # instrument state
+        self.wl = S250Prim.waveLengthLimits['start']
+        self.zero = 0.
+        self.abs = 0.
+        self.baseline = None
+        self.n_commands = 0
+
+    # ------- pty management
+    def open_pty(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        if self.link is not None:
+            if os.path.lexists(self.link):
+                os.remove(self.link)
+            os.symlink(self.port, self.link)
+
+    def close_pty(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except (OSError, TypeError):
+                pass
+        self.master = self.slave = None
+
+    def start(self):
+        """start : open the pty and serve it in a thread - return the port name"""
+        self.stopping.clear()
+        self.open_pty()
+        self.thread = threading.Thread(target=self.run, name='S250PrimSimulator', daemon=True)
+        self.thread.start()
+        return self.link if self.link is not None else self.port
+
+    def stop(self):
+        """stop : stop serving and close the pty - no arguments"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.close_pty()
+        if self.link is not None and os.path.islink(self.link):
+            os.remove(self.link)
+
+    # ------- timing
+    def sleep(self, t):
+        t = t / self.speedup
+        if t > 0.:
+            time.sleep(t)
+
+    def write(self, data):
+        """write : send an answer, throttled to the emulated baudrate"""
+        if self.baudrate is None or math.isinf(self.speedup):
+            os.write(self.master, data)
+            return
+        # chunks of about 10 ms of wire time
+        chunk = max(1, int(self.baudrate * self.speedup / 1000.))
+        for i in range(0, len(data), chunk):
+            part = data[i:i + chunk]
+            os.write(self.master, part)
+            self.sleep(len(part) * 10. / self.baudrate)
+
+    def fault(self, name):
+        return self.random.random() < self.faults.get(name, 0.)
+
+    # ------- measurement model
+    def measure(self, wl):
+        return self.sample(wl) + self.random.gauss(0., self.noise) if self.noise else self.sample(wl)
+
+    @staticmethod
+    def encode_abs(val):
+        return max(-32768, min(32767, int(round(val * 10000.))))
+
+    # ------- serving loop
+    def run(self):
+        while not self.stopping.is_set():
+            if self.unplug_delay is not None:
+                self.disconnect()
+            try:
+                r, _, _ = select.select([self.master], [], [], 0.05)
+                if r:
+                    self.rx += os.read(self.master, 256)
+                    self.process()
+            except OSError:
+                # client side gone : wait for next open
+                time.sleep(0.05)
+
+    def poll_stop(self):
+        """poll_stop : read pending bytes while streaming - return True if a stop command was received"""
+        if self.unplug_delay is not None:
+            self.disconnect()
+            return True
+        r, _, _ = select.select([self.master], [], [], 0.)
+        if r:
+            self.rx += os.read(self.master, 256)
+        idx = self.rx.find(Cmd_Prefix + Cmd_Stop)
+        if idx >= 0:
+            del self.rx[:idx + 2]
+            return True
+        return False
+
+    def process(self):
+        """process : answer every complete frame in the receive buffer"""
+        while self.rx:
+            cmd = bytes(self.rx[:1])
+            if cmd == Cmd_Init or cmd == Cmd_GetAbsData:
+                del self.rx[:1]
+                self.answer(cmd, b'')
+            elif cmd == Cmd_Prefix:
+                if len(self.rx) < 2:
+                    return
+                cmd = bytes(self.rx[1:2])
+                n_args = {Cmd_SetWavelength: Fmt_SetWavelength.size, Cmd_BaseLine: Fmt_BaseLine.size}.get(cmd, 0)
+                if len(self.rx) < 2 + n_args:
+                    return
+                args = bytes(self.rx[2:2 + n_args])
+                del self.rx[:2 + n_args]
+                self.answer(cmd, args)
+            else:
+                # garbage : ignore
+                del self.rx[:1]
+
+    def answer(self, cmd, args):
+        self.n_commands += 1
+        if self.fault('disconnect'):
+            self.disconnect()
+            return
+        self.sleep(self.latency)
+        if cmd == Cmd_Stop:
+            return
+        ans = self.execute(cmd, args)
+        if ans is None or self.fault('drop'):
+            return
+        if self.fault('corrupt'):
+            ans = bytearray(ans)
+            i = self.random.randrange(len(ans))
+            ans[i] ^= 1 << self.random.randrange(8)
+            ans = bytes(ans)
+        self.write(ans)
+        if cmd == Cmd_GetSpectrum:
+            self.stream_spectrum()
+
+    def unplug(self, delay=None):
+        """unplug : simulate an unplugged usb-serial adapter as soon as possible (even while streaming)
+        [delay in s before the pty is reopened, default: reconnect_delay]"""
+        self.unplug_delay = self.reconnect_delay if delay is None else delay
+
+    def disconnect(self):
+        """disconnect : simulate an unplugged usb-serial adapter"""
+        delay = self.reconnect_delay if self.unplug_delay is None else self.unplug_delay
+        self.unplug_delay = None
+        self.rx.clear()
+        self.close_pty()
+        time.sleep(delay)
+        self.open_pty()
+
+    def execute(self, cmd, args):
+        """execute : update the instrument state and return the answer to a command"""
+        if cmd == Cmd_Init:
+            return Ans_Init_Nok if self.fault('nok') else Ans_Init_Ok
+        elif cmd == Cmd_Firmware:
+            return bytes((0, self.firmware))
+        elif cmd == Cmd_Autotest:
+            return Ans_Autotest_Ok
+        elif cmd == Cmd_GetType:
+            return self.model
+        elif cmd == Cmd_SetWavelength:
+            wl, gain = Fmt_SetWavelength.unpack(args)
+            self.sleep(abs(wl - self.wl) / self.move_rate)
+            self.wl = wl
+            return Ans_SetWavelength_Ok
+        elif cmd == Cmd_GetZeroAbs:
+            self.zero = self.measure(self.wl)
+            self.abs = 0.
+            return Ans_GetZeroAbs_Ok
+        elif cmd == Cmd_GetAbs:
+            self.abs = self.measure(self.wl) - self.zero
+            return Ans_GetAbs_Ok
+        elif cmd == Cmd_GetAbsData:
+            return Fmt_AbsData.pack(0, self.encode_abs(self.abs))
+        elif cmd == Cmd_BaseLine:
+            wllo, wlhi, res, speed = Fmt_BaseLine.unpack(args)
+            self.sleep((wlhi - wllo) / (self.scan_rate * speed))
+            self.baseline = (wllo, wlhi, res, speed)
+            return Ans_Baseline_Ok
+        elif cmd == Cmd_GetSpectrum:
+            if self.baseline is None:
+                return Fmt_SpectrumHeader.pack(0, 0)
+            wllo, wlhi, res, speed = self.baseline
+            return Fmt_SpectrumHeader.pack(wllo, (wlhi - wllo) // max(1, res) + 1)
+        return None
+
+    def stream_spectrum(self):
+        """stream_spectrum : send spectrum points (one every res nm) while scanning - interrupted by a stop command"""
+        if self.baseline is None:
+            return
+        wllo, wlhi, res, speed = self.baseline
+        step = max(1, res)
+        for wl in range(wllo, wlhi + 1, step):
+            if self.poll_stop():
+                return
+            self.sleep(step / (self.scan_rate * speed))
+            self.write(Fmt_SpectrumPoint.pack(self.encode_abs(self.measure(wl))))
+
+
+if __name__ == "__main__":
+    import argparse
+    models = {name: key for key, name in Secoman_Models.items()}
+    parser = argparse.ArgumentParser(description="Secomam S250/Prim simulator on a pseudo-terminal")
+    parser.add_argument('--model', choices=sorted(models), default=Secoman_Models[b'P\x01'])
+    parser.add_argument('--firmware', type=int, default=12)
+    parser.add_argument('--baudrate', type=int, default=4800, help="emulated baudrate (0: no throttling)")
+    parser.add_argument('--latency', type=float, default=0.005, help="s - processing time of each command")
+    parser.add_argument('--noise', type=float, default=0.0005, help="absorbance noise (std dev)")
+    parser.add_argument('--speedup', type=float, default=1., help="time acceleration factor (inf: no delay)")
+    parser.add_argument('--link', default=None, help="stable symlink to the pty")
+    for fault in ('drop', 'corrupt', 'nok', 'disconnect'):
+        parser.add_argument('--' + fault, type=float, default=0., help="probability of a '%s' fault" % (fault,))
+    args = parser.parse_args()
+    sim = S250PrimSimulator(model=models[args.model], firmware=args.firmware, baudrate=args.baudrate or None,
+                            latency=args.latency, noise=args.noise, speedup=args.speedup, link=args.link,
+                            faults={f: getattr(args, f) for f in ('drop', 'corrupt', 'nok', 'disconnect')})
+    print("Simulated %s on %s" % (args.model, sim.start()))
+    try:
+        while True:
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,243 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers driver File - serial I/O worker
+# #########################################################################
+
+import threading
+import queue
+import time
+from s250Prim_async import S250PrimError
+
+# result status handed back to the ui
+Result_Ok = 'ok'
+Result_Progress = 'progress'
+Result_Status = 'status'
+Result_Timeout = 'timeout'
+Result_Error = 'error'
+Result_Failed = 'failed'  # a task failed but the link is still up : the worker goes on
+
+
+class WorkerTask:
+    """WorkerTask : long task queued in place of a command function (see S250PrimWorker.submit_task)"""
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+
+class S250PrimWorker:
+    """S250PrimWorker : background thread owning the connection of a S250Prim driver
+
+    Commands are queued with submit(). The worker sends them, waits for the answer with blocking reads
+    (bounded by the driver read_timeout) and puts (status, callback, answer) tuples in the results queue.
+    notify() is called from the worker thread each time a result is queued: it must only schedule
+    process_results() on the ui thread, callbacks are never called from the worker thread.
+
+    If the link is lost (usb-serial adapter dropping), the worker reconnects on the same port with backoff
+    (reconnect_delays), restarts the device and redoes the interrupted command. An interrupted spectrum transfer
+    is measured again and only the missing points are taken from the new scan. on_status is called with
+    ('reconnecting', attempt) and ('reconnected', port) during the process. on_reconnect is called in the worker
+    thread before the command is redone (e.g. to drop the blanks against the zero lost by the device).
+    Only transport errors (IOError, OSError : serial errors, timeouts, closed port) lead to a reconnection, at most
+    max_retries times for one command : an unexpected answer (S250PrimAnswerError) or any other error is reported
+    to the error callback (a task failing that way leaves the worker running)."""
+    reconnect_delays = (0.5, 1., 2., 4., 8.)  # s - delays before each reconnection attempt
+    max_retries = 3  # reconnections for one command or task before it is reported as failed
+
+    def __init__(self, spectro, notify=None, cmd_timeout=None, progress_interval=0.1, on_status=None,
+                 on_reconnect=None):
+        self.spectro = spectro
+        self.notify = notify
+        self.on_status = on_status
+        self.on_reconnect = on_reconnect
+        self.cmd_timeout = cmd_timeout  # s - timeout to get a valid answer (None: adaptive timeout of the driver)
+        self.progress_interval = progress_interval  # s - min time between two progress reports
+        self.commands = queue.Queue()
+        self.results = queue.Queue()
+        self.aborting = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """start : start the I/O thread - no arguments"""
+        self.aborting.clear()
+        self.thread = threading.Thread(target=self.run, name='S250PrimWorker', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.):
+        """stop : stop the I/O thread - [timeout in s to wait for the thread]
+        commands already queued are still sent but their answers are no longer awaited"""
+        if self.thread is not None:
+            self.aborting.set()
+            self.commands.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+    def submit(self, cmd_func, clbck_ok, clbck_error, clbck_progress=None):
+        """submit : queue a command - [driver command function] [success callback] [error callback]
+        [progress callback: called with (bytes received, bytes expected) while a long answer is read]"""
+        self.commands.put((cmd_func, clbck_ok, clbck_error, clbck_progress))
+
+    def submit_task(self, task, clbck_ok, clbck_error, clbck_progress=None):
+        """submit_task : queue a task using the driver for a long time (e.g. kinetics) - [task: function called
+        with (report, aborting) in the worker thread, returns the answer] [success callback] [error callback]
+        [progress callback: called with what the task gives to report()]
+        the task is called again after a reconnection : it must be able to resume"""
+        self.commands.put((WorkerTask(task), clbck_ok, clbck_error, clbck_progress))
+
+    def post(self, status, clbck, ans=None):
+        """post : hand a result back to the ui"""
+        self.results.put((status, clbck, ans))
+        if self.notify is not None:
+            self.notify()
+
+    def process_results(self, on_error=None):
+        """process_results : call the callbacks of queued results - must be called from the ui thread
+        [on_error: called before the error callback when the link is lost]"""
+        while True:
+            try:
+                status, clbck, ans = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if status in (Result_Ok, Result_Progress, Result_Status):
+                if clbck is not None:
+                    clbck(ans)
+            elif status == Result_Failed:
+                if clbck is not None:
+                    clbck()
+            else:
+                if on_error is not None:
+                    on_error()
+                if clbck is not None:
+                    clbck()
+                return
+
+    def read_answer(self, n, timeout, clbck_progress=None, data=None):
+        """read_answer : read n bytes as one stream, return None on timeout or abort
+        progress is reported at most every progress_interval s
+        [data: bytearray receiving the bytes, keeps what was read if the link is lost]"""
+        deadline = time.monotonic() + timeout
+        next_progress = time.monotonic() + self.progress_interval
+        if data is None:
+            data = bytearray()
+        while len(data) < n:
+            if self.aborting.is_set() or time.monotonic() > deadline:
+                return None
+            if not self.spectro.is_open():
+                raise S250PrimError("port closed")
+            data += self.spectro.receive(n - len(data))
+            if clbck_progress is not None and time.monotonic() >= next_progress:
+                self.post(Result_Progress, clbck_progress, (len(data), n))
+                next_progress = time.monotonic() + self.progress_interval
+        return bytes(data)
+
+    def reconnect(self):
+        """reconnect : reopen the port and restart the device - return True if the device answers again"""
+        port = self.spectro.port
+        for attempt, delay in enumerate(self.reconnect_delays):
+            self.post(Result_Status, self.on_status, ('reconnecting', attempt + 1))
+            if self.aborting.wait(delay):
+                return False
+            self.spectro.disconnect()
+            try:
+                if self.spectro.connect(port) and self.spectro.query(self.spectro.start_device):
+                    # restore the absorbance wavelength as a precaution
+                    if self.spectro.abs_wavelength is not None:
+                        self.spectro.query(lambda: self.spectro.set_abs_wavelength(*self.spectro.abs_wavelength))
+                    # state lost by the restarted device is reset before the command is redone
+                    if self.on_reconnect is not None:
+                        self.on_reconnect()
+                    self.post(Result_Status, self.on_status, ('reconnected', port))
+                    return True
+            except (IOError, OSError):
+                pass
+        return False
+
+    def execute(self, cmd_func, clbck_progress, data):
+        """execute : send a command and read its answer - return (command sent, answer bytes) or None on timeout"""
+        t0 = time.monotonic()
+        # send command and get number of bytes to be received
+        cmd_sent, n_return = cmd_func()
+        # nothing to wait for
+        if n_return == 0 or self.aborting.is_set():
+            return cmd_sent, None
+        timeout = self.spectro.timeout_for(cmd_sent) if self.cmd_timeout is None else self.cmd_timeout
+        if self.read_answer(n_return, timeout, clbck_progress, data) is None:
+            return None
+        self.spectro.record_latency(cmd_sent, time.monotonic() - t0)
+        return cmd_sent, bytes(data)
+
+    def run_task(self, task, clbck_ok, clbck_error, clbck_progress):
+        """run_task : run a task, reconnecting if the link is lost - return False if the worker must stop"""
+        def report(ans):
+            self.post(Result_Progress, clbck_progress, ans)
+        retries = 0
+        while True:
+            try:
+                ans = task(report, self.aborting)
+                break
+            except (IOError, OSError):
+                retries += 1
+                if self.aborting.is_set() or retries > self.max_retries or not self.reconnect():
+                    self.post(Result_Error, clbck_error)
+                    return False
+            except Exception:
+                # bad answer or precondition of the task : drop what is left on the line and go on
+                self.spectro.drain()
+                self.post(Result_Failed, clbck_error)
+                return True
+        self.post(Result_Ok, clbck_ok, ans)
+        return True
+
+    def run(self):
+        while True:
+            job = self.commands.get()
+            if job is None:
+                return
+            cmd_func, clbck_ok, clbck_error, clbck_progress = job
+            if isinstance(cmd_func, WorkerTask):
+                if not self.run_task(cmd_func.func, clbck_ok, clbck_error, clbck_progress):
+                    return
+                continue
+            kept = b''  # points of an interrupted spectrum transfer
+            retries = 0
+            while True:
+                data = bytearray()
+                try:
+                    result = self.execute(cmd_func, clbck_progress, data)
+                    break
+                except (IOError, OSError):
+                    # sudden disconnection (S250PrimError is an IOError : port closed)
+                    retries += 1
+                    if self.aborting.is_set() or retries > self.max_retries or not self.reconnect():
+                        # the link is lost, drop pending commands
+                        self.post(Result_Error, clbck_error)
+                        return
+                    if cmd_func == self.spectro.get_spectrum_bulk or cmd_func == self.spectro.restart_spectrum:
+                        # the stream can't be resumed : scan again and keep the points already received
+                        if len(data) > len(kept):
+                            kept = bytes(data[:len(data) - len(data) % 2])
+                        cmd_func = self.spectro.restart_spectrum
+                except Exception:
+                    # unexpected answer
+                    self.post(Result_Error, clbck_error)
+                    return
+            if result is None:
+                if self.aborting.is_set():
+                    continue
+                self.post(Result_Timeout, clbck_error)
+                return
+            cmd_sent, data = result
+            if data is None:
+                continue
+            if kept:
+                data = kept + data[len(kept):]
+            try:
+                # send to spectrometer library to proceed raw data
+                ans = self.spectro.return_command(data, cmd_sent)
+            except Exception:
+                self.post(Result_Error, clbck_error)
+                return
+            self.post(Result_Ok, clbck_ok, ans)
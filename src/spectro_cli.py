@@ -0,0 +1,422 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - command line (no gui)
+#   Licence: MIT
+# #########################################################################
+
+"""headless acquisition tool
+
+    python spectro_cli.py discover
+    python spectro_cli.py info --port /dev/ttyUSB0 --format json
+    python spectro_cli.py baseline --range 400 700
+    python spectro_cli.py spectrum --range 400 700 -o sample.csv
+    python spectro_cli.py zero 520
+    python spectro_cli.py abs 520 --format json
+    python spectro_cli.py sequence 450 520 600 --samples 3
+    python spectro_cli.py kinetics 520 --duration 600 -o kinetics.csv
+    python spectro_cli.py find --kind spectrum --range 400 700 --since 30
+    python spectro_cli.py export spectra --dir exports --layout long --table tsv
+    python spectro_cli.py render spectra --dir report --image svg --processes 4
+    python spectro_cli.py process spectra --range 400 700 --smooth 11 3 --baseline rubberband --normalize max
+
+without --port, the first spectrometer found by discovery is used.
+spectrum makes the baseline only if no baseline of the same parameters was made in the last --validity s.
+the device keeps one zero : abs reads against the zero made by zero at the same wavelength, sequence measures
+several wavelengths (a blank is read at each one and subtracted).
+results are written to stdout (or -o FILE) as csv or json.
+measured absorbances, archived spectra and kinetics files are registered in the catalog (--catalog), find lists
+them."""
+
+import os
+import sys
+import json
+import time
+import argparse
+from s250Prim_async import S250Prim, S250PrimError, S250PrimAnswerError
+from s250Prim_discovery import discover
+from s250Prim_kinetics import Kinetics
+from s250Prim_sequence import AbsSequence, MissingBlankError
+from s250Prim_cache import BaselineCache, default_path
+from spectrum import Spectrum
+from archive import SpectrumArchive
+from catalog import Catalog, Kinds, Acquisition_Columns
+from export import export_archive, get_format, use_user_locale, Layouts, Layout_Wide
+from render import render_archive, Render_Size
+from processing import Pipeline, stack, Baseline_Methods, Normalize_Methods
+try:
+    from serial import SerialException
+except ImportError:
+    # pyserial is only needed to open a port (see S250Prim.connect)
+    SerialException = S250PrimError
+
+__version__ = '0.9'
+
+
+class CliError(Exception):
+    pass
+
+
+def open_spectro(port):
+    """open_spectro : connect and initialize the spectrometer on port (or the first one found)"""
+    if port is None:
+        found = discover()
+        if not found:
+            raise CliError("no spectrometer found")
+        port = found[0][0]
+    spectro = S250Prim()
+    if not spectro.connect(port):
+        raise CliError("can't open %s" % (port,))
+    if not spectro.query(spectro.start_device):
+        spectro.disconnect()
+        raise CliError("spectrometer on %s doesn't start" % (port,))
+    return spectro
+
+
+def get_infos(spectro):
+    model, rawmodel = spectro.query(spectro.get_model_name)
+    firmware = spectro.query(spectro.get_firmware_version)
+    return {'port': spectro.port, 'model': model, 'firmware': firmware}
+
+
+def make_baseline(spectro, args, infos, cache):
+    """make_baseline : make the baseline and record it in the baseline cache"""
+    params = (args.range[0], args.range[1], args.speed, args.res)
+    if not spectro.query(lambda: spectro.make_spectrum_baseline(*params)):
+        raise CliError("baseline failed")
+    cache.record(infos['port'], infos['model'], infos['firmware'], params)
+
+
+def register(args, func):
+    """register : call func(catalog) with the catalog of the command (one commit)"""
+    with Catalog(args.catalog) as catalog, catalog.batch():
+        func(catalog)
+
+
+def cmd_discover(args):
+    rows = [(port, model, firmware) for port, model, rawmodel, firmware in discover(timeout=args.timeout)]
+    return {}, ('port', 'model', 'firmware'), rows
+
+
+def cmd_info(spectro, args):
+    infos = get_infos(spectro)
+    return infos, ('port', 'model', 'firmware'), [(infos['port'], infos['model'], infos['firmware'])]
+
+
+def cmd_baseline(spectro, args):
+    meta = get_infos(spectro)
+    make_baseline(spectro, args, meta, BaselineCache(args.cache))
+    meta.update({'wl_min': args.range[0], 'wl_max': args.range[1], 'speed': args.speed, 'res': args.res,
+                 'baseline_time': time.time()})
+    return meta, (), []
+
+
+def cmd_spectrum(spectro, args):
+    meta = get_infos(spectro)
+    params = (args.range[0], args.range[1], args.speed, args.res)
+    cache = BaselineCache(args.cache, args.validity)
+    if args.force_baseline or not (args.no_baseline or cache.is_valid(meta['port'], meta['model'],
+                                                                     meta['firmware'], params)):
+        make_baseline(spectro, args, meta, cache)
+    entry = cache.get(meta['port'], meta['model'], meta['firmware'])
+    if entry is not None and entry[0] == params:
+        meta['baseline_time'] = entry[1]
+    if spectro.scan_params is None:
+        # baseline made before : the last one cached for the device, else the one of the options
+        spectro.scan_params = entry[0] if entry is not None else params
+    # range of the baseline held by the device (may differ from --range with --no-baseline)
+    wl_start, N = spectro.query(spectro.get_spectrum_header)
+    if not N:
+        cache.invalidate(meta['port'], meta['model'], meta['firmware'])
+        raise CliError("no baseline on the device")
+    step = spectro.scan_step()
+    meta.update({'wl_min': wl_start, 'wl_max': wl_start + (N - 1) * step, 'time': time.time()})
+    if not args.no_baseline:
+        meta.update({'speed': args.speed, 'res': args.res})
+    points = spectro.iter_spectrum(header=(wl_start, N))
+    if args.format == 'csv':
+        # points are written as they are received
+        write_results(args.out, args.format, meta, ('wavelength', 'abs'), [])
+        rows = []
+        for wl, val in points:
+            args.out.write('%d,%s\n' % (wl, val))
+            if args.archive is not None:
+                rows.append((wl, val))
+    else:
+        rows = list(points)
+    if args.archive is not None:
+        spectrum = Spectrum.from_values([val for wl, val in rows], wl_start, step, model=meta['model'],
+                                        firmware=meta['firmware'], speed=meta.get('speed'), res=meta.get('res'),
+                                        baseline_time=meta.get('baseline_time'), time=meta['time'])
+        meta['archive_index'] = SpectrumArchive(args.archive).append(spectrum)
+        register(args, lambda catalog: catalog.add_spectrum(spectrum, meta['port'], args.archive,
+                                                            meta['archive_index']))
+    if args.format == 'csv':
+        return None
+    return meta, ('wavelength', 'abs'), rows
+
+
+def cmd_zero(spectro, args):
+    spectro.query(lambda: spectro.set_abs_wavelength(args.wavelength))
+    spectro.query(spectro.get_abs_zero)
+    rows = [(args.wavelength, spectro.query(spectro.get_abs_data)[1])]
+    return get_infos(spectro), ('wavelength', 'zero'), rows
+
+
+def cmd_abs(spectro, args):
+    spectro.query(lambda: spectro.set_abs_wavelength(args.wavelength))
+    spectro.query(spectro.get_abs)
+    val, t = spectro.query(spectro.get_abs_data)[1], time.time()
+    infos = get_infos(spectro)
+    register(args, lambda catalog: catalog.add_abs(args.wavelength, val, infos['port'], infos['model'],
+                                                   infos['firmware'], t))
+    return infos, ('wavelength', 'abs', 'time'), [(args.wavelength, val, t)]
+
+
+def cmd_kinetics(spectro, args):
+    spectro.query(lambda: spectro.set_abs_wavelength(args.wavelength))
+    infos = get_infos(spectro)
+    streamed = args.format == 'csv'
+    if streamed:
+        for key, val in infos.items():
+            args.out.write('# %s: %s\n' % (key, val))
+    kin = Kinetics(spectro, args.out if streamed else None, depth=args.depth, separator=',')
+    try:
+        kin.run(args.duration, args.count)
+    except KeyboardInterrupt:
+        # samples already received are written
+        pass
+    infos.update({'wavelength': args.wavelength, 'n': kin.n, 'rate_mean': kin.rate_mean(),
+                  'rate_max': kin.rate_max()})
+    sys.stderr.write("%d samples, %.2f samples/s (max %.2f samples/s)\n" % (kin.n, kin.rate_mean(), kin.rate_max()))
+    if args.output is not None:
+        register(args, lambda catalog: catalog.add_kinetics(args.wavelength, os.path.abspath(args.output),
+                                                            infos['port'], infos['model'], infos['firmware'],
+                                                            n=kin.n))
+    if streamed:
+        args.out.write('# rate_mean: %s\n# rate_max: %s\n' % (infos['rate_mean'], infos['rate_max']))
+        return None
+    return infos, ('time', 'abs'), list(zip(kin.times, kin.values))
+
+
+def wait_user(args, message):
+    """wait_user : ask the user to change the cell (only on a terminal and without --no-prompt)"""
+    if args.no_prompt or not sys.stdin.isatty():
+        return
+    sys.stderr.write("%s - press enter " % (message,))
+    sys.stdin.readline()
+
+
+def cmd_sequence(spectro, args):
+    seq = AbsSequence(spectro, args.wavelengths)
+    wait_user(args, "blank in the cell")
+    seq.blank()
+    rows = []
+    for sample in range(1, args.samples + 1):
+        wait_user(args, "sample %d in the cell" % (sample,))
+        rows += [(sample,) + tuple(row) for row in seq.measure()]
+    infos = get_infos(spectro)
+
+    def add(catalog):
+        for sample, wl, raw, blank, val, t in rows:
+            catalog.add_abs(wl, val, infos['port'], infos['model'], infos['firmware'], t)
+    register(args, add)
+    return infos, ('sample', 'wavelength', 'raw', 'blank', 'abs', 'time'), rows
+
+
+def cmd_find(args):
+    wl_min, wl_max = args.range if args.range is not None else (None, None)
+    since = time.time() - args.since * 86400. if args.since is not None else None
+    with Catalog(args.catalog) as catalog:
+        rows = catalog.find(args.kind, args.port, args.model, args.firmware, wl_min, wl_max, since,
+                            limit=args.limit)
+    return {}, Acquisition_Columns, [tuple(row) for row in rows]
+
+
+def cmd_export(args):
+    archive = SpectrumArchive(args.archive)
+    rows = None
+    if args.spectra is not None:
+        rows = [i for i in args.spectra if 0 <= i < len(archive)]
+    paths = export_archive(archive, args.dir, rows, args.layout, get_format(args.table, args.decimal))
+    return {}, ('path',), [(path,) for path in paths]
+
+
+def cmd_process(args):
+    archive = SpectrumArchive(args.archive)
+    rows = range(len(archive)) if args.spectra is None else [i for i in args.spectra if 0 <= i < len(archive)]
+    if not rows:
+        raise CliError("no spectrum to process")
+    # stages in a fixed order : crop, smooth, baseline, derivative, normalize
+    pipeline = Pipeline()
+    if args.range is not None:
+        pipeline.crop(*args.range)
+    if args.smooth is not None:
+        pipeline.smooth(*args.smooth)
+    if args.baseline is not None:
+        pipeline.baseline(args.baseline, args.degree)
+    if args.derivative:
+        pipeline.derivative(args.derivative)
+    if args.normalize is not None:
+        pipeline.normalize(args.normalize)
+    try:
+        wavelengths, values = stack(archive[i] for i in rows)
+        wavelengths, values = pipeline.apply(values, wavelengths)
+    except ValueError as e:
+        raise CliError(str(e))
+    meta = {'spectra': len(rows), 'pipeline': ' | '.join(name for name, func in pipeline.stages)}
+    columns = ('wavelength',) + tuple('spectrum %d' % (i,) for i in rows)
+    return meta, columns, [(wl,) + tuple(column) for wl, column in zip(wavelengths.tolist(), values.T.tolist())]
+
+
+def cmd_render(args):
+    rows = None
+    if args.spectra is not None:
+        n = len(SpectrumArchive(args.archive))
+        rows = [i for i in args.spectra if 0 <= i < n]
+    paths = render_archive(args.archive, args.dir, rows, args.image, tuple(args.size), args.processes)
+    return {}, ('path',), [(path,) for path in paths]
+
+
+def write_results(out, fmt, meta, columns, rows):
+    """write_results : write metadata and rows as csv (metadata as # comments) or json"""
+    if fmt == 'json':
+        meta = dict(meta)
+        meta['data'] = [dict(zip(columns, (float(v) if hasattr(v, 'item') else v for v in row))) for row in rows]
+        json.dump(meta, out, indent=1)
+        out.write('\n')
+        return
+    for key, val in meta.items():
+        out.write('# %s: %s\n' % (key, val))
+    if columns:
+        out.write(','.join(columns) + '\n')
+    for row in rows:
+        out.write(','.join(str(float(v)) if hasattr(v, 'item') else str(v) for v in row) + '\n')
+
+
+def make_parser():
+    # options common to every command (accepted after the command name)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-p', '--port', default=None, help="serial port (default: first spectrometer found)")
+    common.add_argument('-o', '--output', default=None, help="output file (default: stdout)")
+    common.add_argument('-f', '--format', choices=('csv', 'json'), default='csv')
+    common.add_argument('--cache', default=default_path('baselines.json'), help="baseline cache file")
+    common.add_argument('--catalog', default=default_path('catalog.sqlite'), help="catalog of the acquisitions")
+    parser = argparse.ArgumentParser(description="Secomam S250/Prim spectrometers - command line acquisition")
+    parser.add_argument('--version', action='version', version=__version__)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    cmd = commands.add_parser('discover', help="list the spectrometers on the serial ports", parents=[common])
+    cmd.add_argument('--timeout', type=float, default=0.5, help="s - timeout of each probe command")
+    cmd.set_defaults(func=cmd_discover, needs_device=False)
+    cmd = commands.add_parser('info', help="model and firmware version", parents=[common])
+    cmd.set_defaults(func=cmd_info)
+    for name, func, help in (('baseline', cmd_baseline, "make the spectrum baseline (blank in the cell)"),
+                             ('spectrum', cmd_spectrum, "measure a spectrum (after a baseline)")):
+        cmd = commands.add_parser(name, help=help, parents=[common])
+        cmd.add_argument('--range', type=int, nargs=2, metavar=('WLMIN', 'WLMAX'),
+                         default=(S250Prim.waveLengthLimits['start'], S250Prim.waveLengthLimits['end']))
+        cmd.add_argument('--speed', type=int, choices=S250Prim.waveLengthLimits['speed'], default=8)
+        cmd.add_argument('--res', type=int, default=3)
+        cmd.set_defaults(func=func)
+    cmd.add_argument('--no-baseline', action='store_true', help="use the baseline already made on the device")
+    cmd.add_argument('--archive', default=None,
+                     help="also append the spectrum to this archive (path without extension)")
+    cmd.add_argument('--force-baseline', action='store_true', help="make the baseline even if a valid one is cached")
+    cmd.add_argument('--validity', type=float, default=3600.,
+                     help="s - a cached baseline of the same parameters is reused during this time")
+    for name, func, help in (('zero', cmd_zero, "make the absorbance zero at a wavelength (blank in the cell)"),
+                             ('abs', cmd_abs, "measure absorbance at the wavelength of the zero (see sequence for "
+                                              "several wavelengths)")):
+        cmd = commands.add_parser(name, help=help, parents=[common])
+        cmd.add_argument('wavelength', type=int, metavar='WL')
+        cmd.set_defaults(func=func)
+    cmd = commands.add_parser('sequence', help="blank then samples at several wavelengths (zero made once)",
+                              parents=[common])
+    cmd.add_argument('wavelengths', type=int, nargs='+', metavar='WL')
+    cmd.add_argument('--samples', type=int, default=1, help="number of samples measured after the blank")
+    cmd.add_argument('--no-prompt', action='store_true', help="don't wait for the user between blank and samples")
+    cmd.set_defaults(func=cmd_sequence)
+    cmd = commands.add_parser('kinetics', help="absorbance time series at a wavelength (until ctrl-c without limit)",
+                              parents=[common])
+    cmd.add_argument('wavelength', type=int, metavar='WL')
+    cmd.add_argument('--duration', type=float, default=None, help="s - length of the acquisition")
+    cmd.add_argument('--count', type=int, default=None, help="number of samples")
+    cmd.add_argument('--depth', type=int, default=2, help="measurement cycles in flight (1: no pipelining)")
+    cmd.set_defaults(func=cmd_kinetics)
+    cmd = commands.add_parser('find', help="acquisitions registered in the catalog, latest first", parents=[common])
+    cmd.add_argument('--kind', choices=Kinds, default=None)
+    cmd.add_argument('--model', default=None)
+    cmd.add_argument('--firmware', type=int, default=None)
+    cmd.add_argument('--range', type=float, nargs=2, metavar=('WLMIN', 'WLMAX'), default=None,
+                     help="nm - acquisitions lying in this range")
+    cmd.add_argument('--since', type=float, default=None, help="days - acquisitions of the last days")
+    cmd.add_argument('--limit', type=int, default=None)
+    cmd.set_defaults(func=cmd_find, needs_device=False)
+    cmd = commands.add_parser('export', help="write archived spectra to csv/tsv files (paths are listed)",
+                              parents=[common])
+    cmd.add_argument('archive', help="spectrum archive (path without extension)")
+    cmd.add_argument('--dir', default='', help="directory of the exported files")
+    cmd.add_argument('--layout', choices=Layouts, default=Layout_Wide,
+                     help="wide: a column per spectrum, long: a line per point, files: a file per spectrum")
+    cmd.add_argument('--table', choices=('csv', 'tsv'), default='csv')
+    cmd.add_argument('--decimal', default=None, help="decimal separator (default: the one of the locale)")
+    cmd.add_argument('--spectra', type=int, nargs='+', default=None, metavar='N', help="numbers of the spectra")
+    cmd.set_defaults(func=cmd_export, needs_device=False)
+    cmd = commands.add_parser('render', help="draw archived spectra to png/svg images, no display needed "
+                                             "(paths are listed)", parents=[common])
+    cmd.add_argument('archive', help="spectrum archive (path without extension)")
+    cmd.add_argument('--dir', default='', help="directory of the images")
+    cmd.add_argument('--image', choices=('png', 'svg'), default='png')
+    cmd.add_argument('--size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'), default=Render_Size)
+    cmd.add_argument('--processes', type=int, default=None, help="rendering processes (default: one per cpu)")
+    cmd.add_argument('--spectra', type=int, nargs='+', default=None, metavar='N', help="numbers of the spectra")
+    cmd.set_defaults(func=cmd_render, needs_device=False)
+    cmd = commands.add_parser('process', help="smooth, correct and normalize archived spectra (one column per "
+                                              "spectrum, on their common range)", parents=[common])
+    cmd.add_argument('archive', help="spectrum archive (path without extension)")
+    cmd.add_argument('--range', type=float, nargs=2, metavar=('WLMIN', 'WLMAX'), default=None)
+    cmd.add_argument('--smooth', type=int, nargs=2, metavar=('WINDOW', 'ORDER'), default=None,
+                     help="Savitzky-Golay smoothing (odd window in points)")
+    cmd.add_argument('--baseline', choices=Baseline_Methods, default=None, help="baseline correction")
+    cmd.add_argument('--degree', type=int, default=3, help="degree of the polynomial baseline")
+    cmd.add_argument('--derivative', type=int, choices=(0, 1, 2), default=0)
+    cmd.add_argument('--normalize', choices=Normalize_Methods, default=None)
+    cmd.add_argument('--spectra', type=int, nargs='+', default=None, metavar='N', help="numbers of the spectra")
+    cmd.set_defaults(func=cmd_process, needs_device=False)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    use_user_locale()
+    # commands streaming their results write to args.out and return None
+    args.out = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+    spectro = None
+    try:
+        if getattr(args, 'needs_device', True):
+            spectro = open_spectro(args.port)
+            results = args.func(spectro, args)
+        else:
+            results = args.func(args)
+        if results is not None:
+            write_results(args.out, args.format, *results)
+    except (CliError, S250PrimError, S250PrimAnswerError, MissingBlankError, SerialException) as e:
+        sys.stderr.write("error: %s\n" % (e,))
+        return 1
+    except KeyError as e:
+        # e.g. a model or an answer unknown to the driver
+        sys.stderr.write("error: unknown %s\n" % (e,))
+        return 1
+    finally:
+        if spectro is not None:
+            spectro.disconnect()
+        if args.out is not sys.stdout:
+            args.out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
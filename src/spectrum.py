@@ -0,0 +1,133 @@
+#!/bin/env python
+# -*- coding: utf8 -*-
+# #########################################################################
+# Spectro v0.9
+#   Olivier Boesch (c) 2019
+#   Secomam s250 and Prim Spectrometers software - spectrum data
+# #########################################################################
+
+"""spectrum as measured by the device, independent of the display
+
+    spectrum = Spectrum.from_bytes(payload, 400, model='Secomam Prim Lignt', firmware=12, speed=8, res=3)
+    visible = spectrum.crop(400, 700)       # no copy
+    print(visible.at(520), visible.wavelengths, visible.absorbance)
+
+Points are stored as the device sends them : int16 counts of 1/10000 absorbance, one point every wl_step nm
+(a few bytes per point). The float absorbance array is computed on first use and kept.
+Arrays are numpy arrays when numpy is available, array.array (and lists) otherwise."""
+
+import struct
+from array import array
+from s250Prim_async import get_numpy
+
+Abs_Scale = 10000.  # device counts per absorbance unit
+
+
+class Spectrum:
+    """Spectrum : raw counts of a spectrum with its acquisition metadata"""
+    __slots__ = ('raw', 'wl_start', 'wl_step', 'model', 'firmware', 'speed', 'res', 'baseline_time', 'time',
+                 '_abs')
+
+    def __init__(self, raw, wl_start, wl_step=1, model=None, firmware=None, speed=None, res=None,
+                 baseline_time=None, time=None):
+        self.raw = raw  # int16 counts (numpy array or array('h'))
+        self.wl_start = wl_start  # nm - wavelength of the first point
+        self.wl_step = wl_step  # nm between two points
+        self.model = model
+        self.firmware = firmware
+        self.speed = speed
+        self.res = res
+        self.baseline_time = baseline_time  # s since epoch
+        self.time = time  # s since epoch
+        self._abs = None
+
+    # ------- construction
+    @classmethod
+    def from_bytes(cls, data, wl_start, wl_step=1, **meta):
+        """from_bytes : spectrum from the payload sent by the device (big-endian int16)"""
+        np = get_numpy()
+        if np is not None:
+            raw = np.frombuffer(data, dtype='>i2', count=len(data) // 2).astype(np.int16)
+        else:
+            raw = array('h', (val[0] for val in struct.iter_unpack(">h", data[:len(data) // 2 * 2])))
+        return cls(raw, wl_start, wl_step, **meta)
+
+    @classmethod
+    def from_values(cls, values, wl_start, wl_step=1, **meta):
+        """from_values : spectrum from decoded absorbances (exact : they are multiples of 1/10000)"""
+        np = get_numpy()
+        if np is not None:
+            raw = np.rint(np.asarray(values, dtype=np.float64) * Abs_Scale).astype(np.int16)
+        else:
+            raw = array('h', (int(round(val * Abs_Scale)) for val in values))
+        return cls(raw, wl_start, wl_step, **meta)
+
+    def meta(self):
+        """meta : acquisition metadata as a dict"""
+        return {'wl_start': self.wl_start, 'wl_step': self.wl_step, 'wl_end': self.wl_end, 'model': self.model,
+                'firmware': self.firmware, 'speed': self.speed, 'res': self.res,
+                'baseline_time': self.baseline_time, 'time': self.time}
+
+    # ------- data
+    def __len__(self):
+        return len(self.raw)
+
+    @property
+    def wl_end(self):
+        """wl_end : nm - wavelength of the last point"""
+        return self.wl_start + (len(self.raw) - 1) * self.wl_step
+
+    @property
+    def nbytes(self):
+        """nbytes : memory used by the raw counts"""
+        return len(self.raw) * self.raw.itemsize
+
+    @property
+    def wavelengths(self):
+        np = get_numpy()
+        if np is not None:
+            return self.wl_start + self.wl_step * np.arange(len(self.raw), dtype=np.float64)
+        return [self.wl_start + i * self.wl_step for i in range(len(self.raw))]
+
+    @property
+    def absorbance(self):
+        """absorbance : float view of the counts (computed on first use)"""
+        if self._abs is None:
+            np = get_numpy()
+            if np is not None:
+                self._abs = self.raw / Abs_Scale
+                self._abs.flags.writeable = False
+            else:
+                self._abs = [val / Abs_Scale for val in self.raw]
+        return self._abs
+
+    def index(self, wl):
+        """index : index of the point at (or just after) a wavelength, clipped to the spectrum"""
+        i = -(-(wl - self.wl_start) // self.wl_step)
+        return int(min(max(i, 0), len(self.raw)))
+
+    def at(self, wl):
+        """at : absorbance at a wavelength of the spectrum"""
+        i = (wl - self.wl_start) / self.wl_step
+        if i != int(i) or not 0 <= i < len(self.raw):
+            raise KeyError("no point at %s nm" % (wl,))
+        return self.raw[int(i)] / Abs_Scale
+
+    def crop(self, wl_lo, wl_hi):
+        """crop : part of the spectrum from wl_lo to wl_hi nm (included) - shares the counts with numpy"""
+        i, j = self.index(wl_lo), self.index(wl_hi + self.wl_step / 2.)
+        part = Spectrum(self.raw[i:j], self.wl_start + i * self.wl_step, self.wl_step, self.model,
+                        self.firmware, self.speed, self.res, self.baseline_time, self.time)
+        if self._abs is not None:
+            part._abs = self._abs[i:j]
+        return part
+
+    def points(self):
+        """points : list of (wavelength, absorbance) tuples (e.g. for a plot)"""
+        wl, val = self.wavelengths, self.absorbance
+        if hasattr(wl, 'tolist'):
+            wl, val = wl.tolist(), val.tolist()
+        return list(zip(wl, val))
+
+    def __repr__(self):
+        return '<Spectrum %s-%s nm, %d points, %s>' % (self.wl_start, self.wl_end, len(self.raw), self.model)
@@ -1,5 +1,5 @@
 from decimal import Decimal
-from math import pow, isclose
+from math import pow, isclose, floor
 
 def step_data(rawval, step):
     val = step * (rawval // float(step))
@@ -42,6 +42,25 @@ def get_bounds_and_ticks(minval, maxval, nticks):
     else:
         goodmax = tick * (maxval // tick)
     return goodmin, goodmax, tick, suggested_minor_tick
+
+def get_ticks(major, minor, s_min, s_max):
+    """get_ticks : positions of the major and minor ticks of a linear axis from s_min to s_max
+    [major: distance between major ticks] [minor: number of intervals between two major ticks]
+    - return (points_major, points_minor)
+    Deliberate fork of the linear branch of Graph._get_ticks (vendored graph package) : the graph package imports
+    kivy and must stay as vendored, the headless renderer needs the same ticks without it."""
+    if not major or s_max <= s_min:
+        return [], []
+    # distance between each tick
+    tick_dist = major / float(minor if minor else 1.0)
+    points_major = []
+    points_minor = []
+    for m in range(0, int(floor((s_max - s_min) / tick_dist) + 1)):
+        if minor and m % minor:
+            points_minor.append(m * tick_dist + s_min)
+        else:
+            points_major.append(m * tick_dist + s_min)
+    return points_major, points_minor
     
 if __name__ == "__main__":
     import random